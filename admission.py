@@ -0,0 +1,81 @@
+import os
+import asyncio
+import logging
+from collections import deque
+
+
+class Ticket:
+    def __init__(self):
+        self.admitted = asyncio.Event()
+        self.released = False
+
+
+class AdmissionController:
+    """Limit concurrent workflows, with a bounded FIFO wait queue.
+
+    `reserve` is called before the SSE response starts so overload is rejected
+    with an HTTP error instead of an open stream; admitted or queued tickets
+    must always be given back with `release`.
+    """
+    def __init__(self, max_concurrent: int | None = None, max_queue: int | None = None):
+        if max_concurrent is None:
+            max_concurrent = int(os.getenv("MAX_CONCURRENT_REQUESTS", 4))
+        if max_queue is None:
+            max_queue = int(os.getenv("MAX_QUEUED_REQUESTS", 16))
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiters: deque[Ticket] = deque()
+
+    def reserve(self) -> Ticket | None:
+        """Admit or queue a request, None if the queue is full"""
+        ticket = Ticket()
+        if self.active < self.max_concurrent and not self.waiters:
+            self.active += 1
+            ticket.admitted.set()
+        elif len(self.waiters) < self.max_queue:
+            self.waiters.append(ticket)
+        else:
+            logging.warning(f"Request rejected, {self.active} active and {len(self.waiters)} queued")
+            return None
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """1-based position in the wait queue, 0 once admitted"""
+        if ticket.admitted.is_set():
+            return 0
+        try:
+            return self.waiters.index(ticket) + 1
+        except ValueError:
+            return 0
+
+    async def wait(self, ticket: Ticket, poll_interval: float = 1.0):
+        """Wait for admission, yielding the queue position each time it changes"""
+        last_position = None
+        while not ticket.admitted.is_set():
+            position = self.position(ticket)
+            if position != last_position:
+                last_position = position
+                yield position
+            try:
+                await asyncio.wait_for(ticket.admitted.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, ticket: Ticket):
+        if ticket.released:
+            return
+        ticket.released = True
+        if not ticket.admitted.is_set():
+            # left the queue before being admitted, e.g. client disconnected
+            try:
+                self.waiters.remove(ticket)
+            except ValueError:
+                pass
+            return
+
+        self.active -= 1
+        while self.waiters and self.active < self.max_concurrent:
+            waiter = self.waiters.popleft()
+            self.active += 1
+            waiter.admitted.set()
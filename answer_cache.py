@@ -0,0 +1,262 @@
+import os
+import re
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, NamedTuple, Optional
+
+# Results of these tools change on every call, they are fingerprinted by time bucket instead
+VOLATILE_TOOLS = {"get_current_time"}
+# Answered from the manuals and the alias mapping, which change with a redeploy only; they are not
+# re-checked (the manual search may call the LLM), the entry TTL bounds them
+STATIC_TOOLS = {"search_error_info_by_code", "get_ot_key"}
+# TDengine table read by each data tool; the row count and latest ts of the rows the call read
+# (its device, tag and time range) change whenever the result of the call may have
+TOOL_TABLES = {
+    "get_spb_tree": "devices",
+    "get_device_tag_value_count_by_sql": "tag_values",
+    "get_device_tag_value_aggregate_time_window_by_sql": "tag_values",
+    "get_device_tag_value_distinct_by_sql": "tag_values",
+    "get_device_tag_history_raw_values_by_sql": "tag_values",
+    "get_device_latest_tag_value": "tag_values",
+    "analyze_device_tags": "tag_values",
+    "get_device_status_count_by_sql": "devices",
+    "get_device_status_by_sql": "devices",
+    "get_device_availability": "devices",
+    "get_alarms": "alarms",
+}
+# Results that also depend on rows outside the given range: availability starts from the status
+# before `start`, get_alarms lists the alarms active now
+OPEN_START_TOOLS = {"get_device_availability"}
+OPEN_END_TOOLS = {"get_alarms"}
+DATA_VERSION_TOOL = "get_data_version"
+
+# Conditions of a generated query that limit the rows it reads, only taken from a plain AND of conditions
+SQL_DEVICE = re.compile(r"\bdevice\s*=\s*'([^']+)'", re.IGNORECASE)
+SQL_TAG = re.compile(r"\btag_name\s*=\s*'([^']+)'", re.IGNORECASE)
+SQL_START = re.compile(r"\bts\s*>=?\s*'([^']+)'", re.IGNORECASE)
+SQL_END = re.compile(r"\bts\s*<=?\s*'([^']+)'", re.IGNORECASE)
+SQL_BETWEEN = re.compile(r"\bts\s+BETWEEN\s+'([^']+)'\s+AND\s+'([^']+)'", re.IGNORECASE)
+SQL_NOT_CONJUNCTIVE = re.compile(r"\b(OR|NOT|UNION|JOIN)\b|\(\s*SELECT\b", re.IGNORECASE)
+
+
+class DataScope(NamedTuple):
+    """Rows of `table` a call read, None for a condition the call did not have; time bounds inclusive"""
+    table: str
+    device: Optional[str] = None
+    tag: Optional[str] = None
+    start: Optional[str] = None
+    end: Optional[str] = None
+
+
+def normalize_prompt(prompt: str) -> str:
+    text = " ".join(prompt.lower().split())
+    return re.sub(r"^[\s\W]+|[\s\W]+$", "", text)
+
+
+def result_text(raw_output: Any) -> str:
+    if hasattr(raw_output, "content") and isinstance(raw_output.content, list):
+        return "\n".join(c.text for c in raw_output.content if hasattr(c, "text"))
+    return str(raw_output)
+
+
+def fingerprint(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def sql_scope(sql: str) -> dict:
+    """Device, tag and time bounds a query is limited to; nothing when its conditions are not a plain AND"""
+    if SQL_NOT_CONJUNCTIVE.search(sql):
+        return {}
+    scope = {}
+    for name, pattern in (("device", SQL_DEVICE), ("tag", SQL_TAG), ("start", SQL_START), ("end", SQL_END)):
+        values = set(pattern.findall(sql))
+        if len(values) == 1:
+            scope[name] = values.pop()
+    between = SQL_BETWEEN.findall(sql)
+    if len(between) == 1 and "start" not in scope and "end" not in scope:
+        scope["start"], scope["end"] = between[0]
+    return scope
+
+
+def data_probe(tool_name: str, tool_kwargs: dict) -> Optional[DataScope]:
+    """Rows whose data version covers the result of a call"""
+    table = TOOL_TABLES.get(tool_name)
+    if table is None:
+        return None
+    if "sql" in tool_kwargs:
+        scope = sql_scope(str(tool_kwargs["sql"]))
+    else:
+        tags = tool_kwargs.get("tags") or []
+        scope = {
+            "device": tool_kwargs.get("device"),
+            "tag": tool_kwargs.get("tag") or (tags[0] if len(tags) == 1 else None),
+            "start": tool_kwargs.get("start"),
+            "end": tool_kwargs.get("end"),
+        }
+    if tool_name in OPEN_START_TOOLS:
+        scope["start"] = None
+    if tool_name in OPEN_END_TOOLS:
+        scope["end"] = None
+    # an open range reaches the rows being ingested, a closed one only changes when late rows arrive
+    return DataScope(table, **{name: value or None for name, value in scope.items()})
+
+
+def time_dependent(tool_name: str, tool_kwargs: dict) -> bool:
+    """Whether the call reads a time range the question names, e.g. today or yesterday"""
+    if tool_name in VOLATILE_TOOLS or tool_kwargs.get("start") or tool_kwargs.get("end"):
+        return True
+    return bool(re.search(r"\bts\b", str(tool_kwargs.get("sql") or ""), re.IGNORECASE))
+
+
+@dataclass
+class ToolCallRecord:
+    tool_name: str
+    tool_kwargs: dict
+    fingerprint: str
+
+
+@dataclass
+class CacheEntry:
+    prompt: str
+    lang: str
+    answer: str
+    tool_calls: list[ToolCallRecord]
+    created: float = field(default_factory=time.time)
+    embedding: Optional[list[float]] = None
+
+    @property
+    def time_dependent(self) -> bool:
+        return any(time_dependent(call.tool_name, call.tool_kwargs) for call in self.tool_calls)
+
+
+class AnswerCache:
+    """Cache of final reports keyed by normalized prompt and language.
+
+    An entry is only replayed while the data behind its recorded tool calls is
+    unchanged: data tools are fingerprinted by the row count and latest ts of
+    the rows they read (get_data_version), one cheap query per distinct device,
+    tag and time range, so no tool and no LLM runs again. Under live ingest an
+    answer over a closed time range stays valid, one reaching up to now does not. With an embedding model, prompts
+    within `similarity` cosine of a cached prompt in the same language also match,
+    unless the cached answer read a time range: "errors today" and "errors
+    yesterday" embed almost the same but need different tool calls.
+    """
+    def __init__(self, mcp_manager, max_entries: int = 256, ttl: float | None = None,
+                 time_bucket: float | None = None, embed_model=None, similarity: float = 0.95):
+        self.mcp_manager = mcp_manager
+        self.max_entries = max_entries
+        self.ttl = ttl if ttl is not None else float(os.getenv("ANSWER_CACHE_TTL", 3600))
+        self.time_bucket = time_bucket if time_bucket is not None else float(os.getenv("ANSWER_CACHE_TIME_BUCKET", 600))
+        self.embed_model = embed_model
+        self.similarity = similarity
+        self.entries: "OrderedDict[tuple[str, str], CacheEntry]" = OrderedDict()
+
+    async def __data_version(self, scope: DataScope) -> str:
+        result = await self.mcp_manager.call_tool(DATA_VERSION_TOOL, scope._asdict())
+        if result.isError:
+            raise RuntimeError(f"{DATA_VERSION_TOOL} failed: {result_text(result)}")
+        return result_text(result)
+
+    async def __fingerprints(self, calls: list[tuple[str, dict]]) -> Optional[list[str]]:
+        """Fingerprint of every call, None when a tool has no cheap way to tell its data changed"""
+        probes = set()
+        for tool_name, tool_kwargs in calls:
+            if tool_name in VOLATILE_TOOLS or tool_name in STATIC_TOOLS:
+                continue
+            probe = data_probe(tool_name, tool_kwargs)
+            if probe is None:
+                logging.info(f"Answer cache skips answers using {tool_name}, its data has no fingerprint")
+                return None
+            probes.add(probe)
+        probes = list(probes)
+        versions = dict(zip(probes, await asyncio.gather(*(self.__data_version(probe) for probe in probes))))
+        fingerprints = []
+        for tool_name, tool_kwargs in calls:
+            if tool_name in VOLATILE_TOOLS:
+                text = str(int(time.time() // self.time_bucket))
+            elif tool_name in STATIC_TOOLS:
+                text = ""
+            else:
+                text = versions[data_probe(tool_name, tool_kwargs)]
+            fingerprints.append(fingerprint(text))
+        return fingerprints
+
+    async def __embed(self, prompt: str) -> Optional[list[float]]:
+        if self.embed_model is None:
+            return None
+        try:
+            return await self.embed_model.aget_query_embedding(prompt)
+        except Exception as e:
+            logging.warning(f"Answer cache embedding failed: {e}")
+            return None
+
+    @staticmethod
+    def __cosine(a: list[float], b: list[float]) -> float:
+        dot = sum(x * y for x, y in zip(a, b))
+        norm = (sum(x * x for x in a) * sum(y * y for y in b)) ** 0.5
+        return dot / norm if norm else 0.0
+
+    async def __find(self, key: tuple[str, str]) -> Optional[CacheEntry]:
+        entry = self.entries.get(key)
+        if entry is not None or self.embed_model is None or not self.entries:
+            return entry
+        embedding = await self.__embed(key[0])
+        if embedding is None:
+            return None
+        best, best_score = None, self.similarity
+        for entry in self.entries.values():
+            if entry.lang == key[1] and entry.embedding is not None and not entry.time_dependent:
+                score = self.__cosine(embedding, entry.embedding)
+                if score >= best_score:
+                    best, best_score = entry, score
+        return best
+
+    async def __still_valid(self, entry: CacheEntry) -> bool:
+        try:
+            fingerprints = await self.__fingerprints([(call.tool_name, call.tool_kwargs) for call in entry.tool_calls])
+        except Exception as e:
+            logging.warning(f"Answer cache validation failed: {e}")
+            return False
+        return fingerprints == [call.fingerprint for call in entry.tool_calls]
+
+    async def get(self, prompt: str, lang: str) -> Optional[str]:
+        key = (normalize_prompt(prompt), lang)
+        entry = await self.__find(key)
+        if entry is None:
+            return None
+        entry_key = (entry.prompt, entry.lang)
+        if time.time() - entry.created > self.ttl or not await self.__still_valid(entry):
+            logging.info(f"Answer cache entry invalidated: {entry.prompt}")
+            self.entries.pop(entry_key, None)
+            return None
+        self.entries.move_to_end(entry_key)
+        logging.info(f"Answer cache hit: {prompt}")
+        return entry.answer
+
+    async def fingerprint_call(self, tool_name: str, tool_kwargs: dict) -> Optional[str]:
+        """Fingerprint of the data a call reads, taken before it runs; None when the answer must not be cached.
+
+        Rows ingested while the tools and the LLM run are not covered by the
+        report, the next lookup sees them as a change.
+        """
+        try:
+            fingerprints = await self.__fingerprints([(tool_name, dict(tool_kwargs))])
+        except Exception as e:
+            logging.warning(f"Answer cache fingerprinting failed: {e}")
+            return None
+        return fingerprints[0] if fingerprints else None
+
+    async def put(self, prompt: str, lang: str, answer: str, tool_calls: list[tuple[str, dict, Optional[str]]]):
+        """Cache the report `answer`, `tool_calls` are the (tool_name, tool_kwargs, fingerprint_call result) it was built from"""
+        if not answer or any(value is None for _, _, value in tool_calls):
+            return
+        key = (normalize_prompt(prompt), lang)
+        records = [ToolCallRecord(tool_name, dict(tool_kwargs), value) for tool_name, tool_kwargs, value in tool_calls]
+        self.entries[key] = CacheEntry(key[0], lang, answer, records, embedding=await self.__embed(key[0]))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
@@ -0,0 +1,94 @@
+"""Embedding throughput of AliEmbeddings against a local fake OpenAI-compatible server.
+
+    uv run python -m bench.embedding --texts 2000 --error-rate 0.05
+
+Embeds paragraphs of the manuals in data/ one per request (the old behaviour),
+batched through the sync path, and batched through the async path, and prints
+seconds, texts/s and the client metrics of each run.
+"""
+import os
+import sys
+import glob
+import time
+import asyncio
+import argparse
+import threading
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+os.chdir(PROJECT_PATH)
+sys.path.insert(0, PROJECT_PATH)
+sys.path.insert(0, os.path.join(PROJECT_PATH, "db"))
+
+
+def load_texts(limit: int) -> list[str]:
+    texts = []
+    for path in sorted(glob.glob("./data/*.md")):
+        with open(path, "r", encoding="utf-8") as f:
+            texts.extend(p.strip() for p in f.read().split("\n\n") if p.strip())
+    return texts[:limit]
+
+
+def start_server(app, port: int):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+def run(name: str, embed, texts: list[str], model) -> dict:
+    start = time.perf_counter()
+    vectors = embed(texts)
+    elapsed = time.perf_counter() - start
+    assert len(vectors) == len(texts)
+    stats = model.stats()
+    return {"run": name, "seconds": round(elapsed, 2), "texts_per_second": round(len(texts) / elapsed, 1),
+            "requests": stats["requests"], "retries": stats["retries"], "failures": stats["failures"]}
+
+
+def main():
+    from bench.fake_embedding import create_app
+    from ali_embedding import AliEmbeddings
+
+    parser = argparse.ArgumentParser(description="AliEmbeddings throughput against a fake embedding server")
+    parser.add_argument("--texts", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=18100)
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake server seconds per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429/500")
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--skip-sequential", action="store_true", help="Skip the one text per request baseline")
+    args = parser.parse_args()
+
+    texts = load_texts(args.texts)
+    server, thread = start_server(create_app(latency=args.latency, error_rate=args.error_rate, max_batch_size=args.batch_size), args.port)
+    base_url = f"http://127.0.0.1:{args.port}/v1"
+
+    def model(batch_size: int, concurrency: int) -> AliEmbeddings:
+        return AliEmbeddings(key="fake", base_url=base_url, model_name="fake-embedding", max_batch_size=batch_size, max_concurrency=concurrency)
+
+    results = []
+    try:
+        if not args.skip_sequential:
+            sequential = model(1, 1)
+            results.append(run("sequential", sequential.get_text_embedding_batch, texts, sequential))
+        batched = model(args.batch_size, args.concurrency)
+        results.append(run("batched", batched.get_text_embedding_batch, texts, batched))
+        concurrent = model(args.batch_size, args.concurrency)
+        results.append(run("async", lambda t: asyncio.run(concurrent.aget_text_embedding_batch(t)), texts, concurrent))
+    finally:
+        server.should_exit = True
+        thread.join()
+
+    columns = ["run", "seconds", "texts_per_second", "requests", "retries", "failures"]
+    print(f"{len(texts)} texts")
+    print(" ".join(f"{c:>16}" for c in columns))
+    for result in results:
+        print(" ".join(f"{result[c]:>16}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import asyncio
+import hashlib
+import random
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def fake_vector(text: str, dimensions: int) -> list[float]:
+    """Deterministic unit-ish vector derived from the text hash"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    return [rng.uniform(-1, 1) for _ in range(dimensions)]
+
+
+def create_app(latency: float = 0.05, per_text_latency: float = 0.002, error_rate: float = 0.0, max_batch_size: int = 10) -> FastAPI:
+    """OpenAI-compatible /v1/embeddings server with latency, a batch limit and injected 429/500 errors"""
+    app = FastAPI()
+    app.state.requests = 0
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        app.state.requests += 1
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        if len(inputs) > max_batch_size:
+            return JSONResponse(status_code=400, content={"error": {"message": f"batch size is invalid, it should not be larger than {max_batch_size}"}})
+        await asyncio.sleep(latency + per_text_latency * len(inputs))
+        if error_rate and random.random() < error_rate:
+            status = random.choice([429, 500])
+            return JSONResponse(status_code=status, content={"error": {"message": "injected error"}})
+        dimensions = body.get("dimensions") or 1024
+        return {
+            "object": "list",
+            "model": body["model"],
+            "data": [{"object": "embedding", "index": i, "embedding": fake_vector(text, dimensions)} for i, text in enumerate(inputs)],
+            "usage": {"prompt_tokens": sum(len(text) for text in inputs), "total_tokens": sum(len(text) for text in inputs)},
+        }
+
+    return app
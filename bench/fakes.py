@@ -0,0 +1,194 @@
+import re
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+# Tags every fake device reports, with (base value, amplitude)
+FAKE_TAGS = {
+    "robotic_arm/voltage": (220.0, 5.0),
+    "robotic_arm/amper": (5.0, 0.5),
+    "diagnose/error_code": (10002, 0),
+}
+
+
+class FakeSpbApp:
+    """In-memory stand-in for SparkPlugBApp.
+
+    SQL is not parsed, the table name and `COUNT(` decide the shape of the
+    synthetic rows. `db_latency` is slept synchronously like the blocking
+    TDengine client does.
+    """
+    def __init__(self, devices: tuple[str, ...] = ("modbus", "opcua"), rows: int = 200, db_latency: float = 0.0):
+        self.devices = devices
+        self.rows = rows
+        self.db_latency = db_latency
+        self.origin = datetime(2025, 4, 1, tzinfo=timezone.utc)
+
+    def __tag_value(self, tag: str, i: int) -> str:
+        base, amplitude = FAKE_TAGS[tag]
+        return str(base + amplitude * ((i * 7) % 11 - 5) / 5)
+
+    def query_spb_tree(self, device: str | None = None) -> str:
+        if device:
+            if device not in self.devices:
+                return "device not found"
+            return f"-- {device}\n" + "".join(f"|  -- {tag}, {self.__tag_value(tag, 0)}\n" for tag in FAKE_TAGS)
+        tree = "-- neuron\n|  -- node\n"
+        for name in self.devices:
+            tree += f"|    -- {name}\n" + "".join(f"|      -- {tag}, {self.__tag_value(tag, 0)}\n" for tag in FAKE_TAGS)
+        return tree
+
+    def query_device_current_tag_value(self, device: str, tag: str) -> str | None:
+        if device not in self.devices or tag not in FAKE_TAGS:
+            return None
+        return self.__tag_value(tag, 0)
+
+    def query_device_availability(self, device: str | None, start: str, end: str | None = None) -> list[dict]:
+        return [
+            {"device": name, "uptime_pct": 99.5, "outage_count": 1, "mtbf_seconds": 86000.0, "mttr_seconds": 400.0,
+             "status_at_end": "online"}
+            for name in self.devices if device is None or name == device
+        ]
+
+    def stream_tag_history(self, start: str, end: str | None = None, devices: list[str] | None = None,
+                           tags: list[str] | None = None, fmt: str = "parquet"):
+        from spb.tag_export import build_sql, stream_export
+
+        build_sql(start, end, devices, tags)  # same validation as the TDengine query
+        devices = devices or list(self.devices)
+        tags = [tag for tag in tags if tag in FAKE_TAGS] if tags else list(FAKE_TAGS)
+        rows = (
+            (self.origin + timedelta(seconds=i), devices[i % len(devices)], tags[i % len(tags)], self.__tag_value(tags[i % len(tags)], i))
+            for i in range(self.rows)
+        )
+        return stream_export(rows, fmt)
+
+    def analyze_tags(self, device: str, tags: list[str], start: str, end: str | None = None,
+                     window: int = 30, z_threshold: float = 3.0) -> dict:
+        import pyarrow as pa
+        from spb.tag_export import iter_blocks, build_sql, SCHEMA
+        from spb.analytics import analyze, load_series, check_options
+
+        check_options(window, z_threshold)
+        build_sql(start, end, [device], tags)
+        rows = (
+            (self.origin + timedelta(seconds=i), device, tag, self.__tag_value(tag, i))
+            for i in range(self.rows) for tag in tags if tag in FAKE_TAGS
+        )
+        table = pa.Table.from_batches(iter_blocks(rows, 65536), schema=SCHEMA)
+        return {"device": device, "start": start, "end": end,
+                **analyze(load_series(table, tags), window=window, z_threshold=z_threshold)}
+
+    def query_alarms(self, start: str, end: str | None = None, device: str | None = None, state: str | None = None) -> list[dict]:
+        return [
+            {"time": "2025-04-01 08:00:00.000", "device": name, "tag": "robotic_arm/voltage", "rule": "overvoltage",
+             "severity": "critical", "state": "raised", "value": "245.0", "message": "robotic_arm/voltage 245 > 240"}
+            for name in self.devices if (device is None or name == device) and state in (None, "raised")
+        ]
+
+    def query_active_alarms(self) -> list[dict]:
+        return []
+
+    def data_version(self, table: str, device: str | None = None, tag: str | None = None,
+                     start: str | None = None, end: str | None = None) -> dict:
+        # the synthetic tables never change
+        devices = 1 if device else len(self.devices)
+        return {"rows": self.rows * devices, "last_ts": (self.origin + timedelta(seconds=self.rows - 1)).strftime('%Y-%m-%d %H:%M:%S.000')}
+
+    def db_execute_sql(self, sql: str) -> list[dict]:
+        if self.db_latency:
+            time.sleep(self.db_latency)
+        text = sql.lower()
+        if "count(" in text:
+            return [{"rec_count": self.rows}]
+
+        device_match = re.search(r"device\s*=\s*'([^']+)'", sql)
+        devices = [device_match.group(1)] if device_match else list(self.devices)
+        if re.search(r"from\s+devices", text):
+            return [
+                {"ts": self.origin + timedelta(minutes=i), "device": devices[i % len(devices)], "status": "online" if i % 10 else "offline"}
+                for i in range(self.rows)
+            ]
+
+        tag_match = re.search(r"tag_name\s*=\s*'([^']+)'", sql)
+        tags = [tag_match.group(1)] if tag_match and tag_match.group(1) in FAKE_TAGS else list(FAKE_TAGS)
+        return [
+            {"ts": self.origin + timedelta(seconds=i), "tag_name": tags[i % len(tags)],
+             "tag_value": self.__tag_value(tags[i % len(tags)], i), "device": devices[i % len(devices)]}
+            for i in range(self.rows)
+        ]
+
+    def on_tag_value(self, callback):
+        self.tag_value_callback = callback
+
+    def connect(self) -> bool:
+        return True
+
+    def stop(self):
+        pass
+
+
+class FakeAliasClient:
+    """In-memory stand-in for the MariaDB alias client"""
+    def __init__(self, aliases: dict[str, str] | None = None):
+        self.aliases = aliases or {"fact_0x00001": "Orange factory", "modbus": "robotic arm"}
+
+    def get_ot_id_by_alias(self, it_alias: str) -> list[str]:
+        return [ot_id for ot_id, alias in self.aliases.items() if it_alias.lower() in alias.lower()]
+
+    def connect(self) -> bool:
+        return True
+
+    def start_alias_refresh(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeRAG:
+    """In-memory stand-in for the error code RAG, answers from a fixed text"""
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def load_index_from_hybrid_chunks(self):
+        pass
+
+    def create_index_from_hybrid_chunks(self, file_path: str):
+        pass
+
+    def create_index_from_directory(self, directory: str = "./data", pattern: str = "*.md"):
+        pass
+
+    @staticmethod
+    def answer(query: str) -> str:
+        return f"{query}, 程序指针已经复位或移除\n\n说明: The program pointer was reset.\n\n建议措施: Restart the program."
+
+    def query(self, query: str) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self.answer(query)
+
+    async def aquery(self, query: str) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.answer(query)
+
+
+def load_fake_servers(spb_app: FakeSpbApp, alias_client: FakeAliasClient, rag: FakeRAG):
+    """Import spb_server and biz_app with their backends replaced by the fakes, return both modules.
+
+    The tool functions and their MCP schemas are the real ones, only the
+    TDengine/MQTT, MariaDB and vector store backends are replaced.
+    """
+    import spb.spb_app
+    import db.mariadb
+    import db.rag
+
+    spb.spb_app.SparkPlugBApp = lambda: spb_app
+    db.mariadb.Client = lambda: alias_client
+    db.rag.RAG = lambda: rag
+
+    import spb_server
+    import biz_app
+    return spb_server, biz_app
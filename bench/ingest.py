@@ -0,0 +1,49 @@
+"""Docling conversion and chunking time of the manuals in data/, serial and in a process pool.
+
+    uv run python -m bench.ingest --workers 4
+
+Only the CPU bound part of indexing is measured, embedding throughput is
+covered by bench.embedding.
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+os.chdir(PROJECT_PATH)
+sys.path.insert(0, PROJECT_PATH)
+sys.path.insert(0, os.path.join(PROJECT_PATH, "db"))
+
+
+def main():
+    from rag import chunk_document
+
+    parser = argparse.ArgumentParser(description="Docling chunking time, serial and in a process pool")
+    parser.add_argument("--directory", default="./data")
+    parser.add_argument("--pattern", default="*.md")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.directory, args.pattern)))
+
+    start = time.perf_counter()
+    serial = [len(chunk_document(path)) for path in paths]
+    serial_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("fork")) as pool:
+        parallel = [len(nodes) for nodes in pool.map(chunk_document, paths)]
+    parallel_seconds = time.perf_counter() - start
+
+    assert serial == parallel
+    print(f"{len(paths)} documents, {sum(serial)} chunks")
+    print(f"serial:   {serial_seconds:.2f}s")
+    print(f"parallel: {parallel_seconds:.2f}s with {args.workers} workers ({serial_seconds / parallel_seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
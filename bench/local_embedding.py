@@ -0,0 +1,106 @@
+"""Local embedding throughput on CPU: HuggingFaceEmbedding against LocalEmbedding (float and int8).
+
+    uv run python -m bench.local_embedding --texts 500 --concurrency 8 --threads 4
+
+For each backend prints chunks/s embedding manual paragraphs, query latency
+p50/p99 with `--concurrency` threads embedding queries at once, and the mean
+cosine similarity of its vectors to the HuggingFaceEmbedding ones.
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import statistics
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+os.chdir(PROJECT_PATH)
+sys.path.insert(0, PROJECT_PATH)
+sys.path.insert(0, os.path.join(PROJECT_PATH, "db"))
+
+from bench.embedding import load_texts
+
+MODEL_NAME = "BAAI/bge-base-en-v1.5"
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def query_latencies(model, queries: list[str], concurrency: int) -> list[float]:
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(part: list[str]):
+        for query in part:
+            start = time.perf_counter()
+            model.get_query_embedding(query)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(queries[i::concurrency],)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def cosine(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    return dot / ((sum(x * x for x in a) ** 0.5) * (sum(y * y for y in b) ** 0.5))
+
+
+def run(name: str, model, texts: list[str], queries: list[str], concurrency: int, reference: list[list[float]] | None) -> tuple[dict, list[list[float]]]:
+    model.get_query_embedding("warm up")
+    start = time.perf_counter()
+    vectors = model.get_text_embedding_batch(texts)
+    seconds = time.perf_counter() - start
+    latencies = query_latencies(model, queries, concurrency)
+    result = {
+        "backend": name,
+        "chunks_per_second": round(len(texts) / seconds, 1),
+        "query_p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "query_p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "cosine": round(statistics.mean(cosine(a, b) for a, b in zip(vectors, reference)), 4) if reference else 1.0,
+    }
+    return result, vectors
+
+
+def main():
+    import torch
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    from local_embedding import LocalEmbedding
+
+    parser = argparse.ArgumentParser(description="Local embedding backends on CPU")
+    parser.add_argument("--texts", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8, help="Threads embedding queries at the same time")
+    parser.add_argument("--threads", type=int, default=0, help="Torch threads, default: all cores")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    texts = load_texts(args.texts)
+    queries = [text.split("\n")[0][:80] for text in load_texts(args.queries)]
+
+    results = []
+    baseline, reference = run("huggingface", HuggingFaceEmbedding(model_name=MODEL_NAME), texts, queries, args.concurrency, None)
+    results.append(baseline)
+    for quantize in (False, True):
+        model = LocalEmbedding(model_name=MODEL_NAME, num_threads=args.threads or None, quantize=quantize, max_batch_size=args.batch_size)
+        result, _ = run("local-int8" if quantize else "local", model, texts, queries, args.concurrency, reference)
+        result["query_batches"] = model.stats()["query_batches"]
+        results.append(result)
+
+    columns = ["backend", "chunks_per_second", "query_p50_ms", "query_p99_ms", "cosine"]
+    print(f"{len(texts)} texts, {len(queries)} queries from {args.concurrency} threads, {torch.get_num_threads()} torch threads")
+    print(" ".join(f"{c:>18}" for c in columns))
+    for result in results:
+        print(" ".join(f"{result[c]:>18}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
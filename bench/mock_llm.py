@@ -0,0 +1,114 @@
+import asyncio
+import json
+from typing import Any, Sequence
+
+from llama_index.core.llms import ChatMessage, ChatResponse, CompletionResponse, LLMMetadata, MessageRole
+from llama_index.core.llms.function_calling import FunctionCallingLLM
+from llama_index.core.llms.llm import ToolSelection
+
+# Tool calls of the first agent turn, the defaults hit both MCP servers
+DEFAULT_TOOL_CALLS = [
+    {"name": "get_current_time", "args": {}},
+    {"name": "get_device_tag_history_raw_values_by_sql",
+     "args": {"sql": "SELECT * FROM tag_values WHERE device = 'modbus' AND tag_name = 'robotic_arm/voltage'"}},
+    {"name": "search_error_info_by_code", "args": {"query": "10002"}},
+]
+
+
+class ScriptedLLM(FunctionCallingLLM):
+    """Deterministic function calling LLM for benchmarks.
+
+    The reply depends only on the shape of the conversation, so concurrent
+    requests get the same script: the first agent turn emits `tool_calls`,
+    the agent turn after the tool results streams `answer`, and a chat without
+    tools (the DemoFlow report) streams `report_tokens` tokens. Tokens are
+    streamed after `ttft` seconds at `tokens_per_second`.
+    """
+    tool_calls: list[dict] = DEFAULT_TOOL_CALLS
+    answer: str = "The data was queried, voltage is stable and error 10002 is a program pointer reset."
+    report_tokens: int = 200
+    ttft: float = 0.3
+    tokens_per_second: float = 50.0
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ScriptedLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="scripted", is_chat_model=True, is_function_calling_model=True)
+
+    def _prepare_chat_with_tools(self, tools: Sequence[Any], user_msg: str | ChatMessage | None = None,
+                                 chat_history: list[ChatMessage] | None = None, verbose: bool = False,
+                                 allow_parallel_tool_calls: bool = False, **kwargs: Any) -> dict[str, Any]:
+        messages = list(chat_history or [])
+        if user_msg is not None:
+            messages.append(user_msg if isinstance(user_msg, ChatMessage) else ChatMessage(role=MessageRole.USER, content=user_msg))
+        return {"messages": messages, "tools": tools, **kwargs}
+
+    def get_tool_calls_from_response(self, response: ChatResponse, error_on_no_tool_call: bool = True, **kwargs: Any) -> list[ToolSelection]:
+        return [
+            ToolSelection(tool_id=call["id"], tool_name=call["name"], tool_kwargs=call["args"])
+            for call in response.message.additional_kwargs.get("tool_calls", [])
+        ]
+
+    def __reply(self, messages: Sequence[ChatMessage], tools: Any) -> tuple[str, list[dict]]:
+        if tools is None:
+            return " ".join(f"token{i}" for i in range(self.report_tokens)), []
+        if messages and messages[-1].role == MessageRole.TOOL:
+            return self.answer, []
+        available = {tool.metadata.name for tool in tools}
+        calls = [
+            {"id": f"call_{i}", "name": call["name"], "args": call["args"]}
+            for i, call in enumerate(self.tool_calls) if call["name"] in available
+        ]
+        return "", calls
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        text, calls = self.__reply(messages, kwargs.get("tools"))
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=text, additional_kwargs={"tool_calls": calls}))
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        await asyncio.sleep(self.ttft)
+        return self.chat(messages, **kwargs)
+
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any):
+        text, calls = self.__reply(messages, kwargs.get("tools"))
+        tokens = [token + " " for token in text.split(" ")] if text else [""]
+
+        async def gen():
+            await asyncio.sleep(self.ttft)
+            content = ""
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(1 / self.tokens_per_second)
+                content += token
+                yield ChatResponse(
+                    message=ChatMessage(role=MessageRole.ASSISTANT, content=content, additional_kwargs={"tool_calls": calls}),
+                    delta=token,
+                    raw={"usage": {"prompt_tokens": sum(len(str(m.content or "")) // 4 for m in messages), "completion_tokens": i + 1}},
+                )
+
+        return gen()
+
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any):
+        raise NotImplementedError("ScriptedLLM only streams asynchronously")
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return CompletionResponse(text=self.answer)
+
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        await asyncio.sleep(self.ttft)
+        return self.complete(prompt)
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        raise NotImplementedError("ScriptedLLM only streams chat")
+
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        raise NotImplementedError("ScriptedLLM only streams chat")
+
+
+def load_script(path: str) -> dict:
+    """Load ScriptedLLM fields (tool_calls, answer, report_tokens, ...) from a JSON file"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
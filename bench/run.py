@@ -0,0 +1,223 @@
+"""Offline end-to-end benchmark of main.py -> DemoFlow -> MCP tools.
+
+Runs the FastAPI app, spb_server.py and biz_app.py in this process on local
+ports, with a scripted LLM and in-memory tool backends, and reports
+requests/s, time to first SSE byte and p50/p99 latency per concurrency level.
+
+    uv run python -m bench.run --concurrency 1,4,16 --requests 32
+    uv run python -m bench.run --output bench.json
+    uv run python -m bench.run --baseline bench.json --tolerance 0.2
+
+With --baseline the run exits with status 1 when a p50/p99/TTFB value is
+slower, or requests/s lower, than the baseline by more than the tolerance.
+"""
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+import statistics
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# db/ and spb/ extend sys.path relative to the working directory
+os.chdir(PROJECT_PATH)
+sys.path.insert(0, PROJECT_PATH)
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    # nearest rank
+    index = min(len(values) - 1, max(0, math.ceil(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+async def serve(app, port: int, lifespan: str = "on"):
+    import uvicorn
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan=lifespan, timeout_graceful_shutdown=1)
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            raise RuntimeError(f"Failed to start server on port {port}")
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def one_request(client, url: str, prompt: str, language: str) -> dict:
+    headers = {"X-Tab-Session": str(uuid.uuid4()), "X-Language": language}
+    start = time.perf_counter()
+    ttfb = None
+    errors = 0
+    async with client.stream("POST", url, json={"prompt": prompt}, headers=headers) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return {"status": response.status_code, "latency": time.perf_counter() - start, "ttfb": None, "errors": 1}
+        async for chunk in response.aiter_bytes():
+            if ttfb is None and chunk:
+                ttfb = time.perf_counter() - start
+            errors += chunk.count(b"event: error")
+    return {"status": 200, "latency": time.perf_counter() - start, "ttfb": ttfb, "errors": errors}
+
+
+async def run_level(url: str, concurrency: int, requests: int, prompt: str, language: str) -> dict:
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(client):
+        async with semaphore:
+            return await one_request(client, url, prompt, language)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(limited(client) for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r["status"] == 200 and not r["errors"]]
+    latencies = [r["latency"] for r in ok]
+    ttfbs = [r["ttfb"] for r in ok if r["ttfb"] is not None]
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": len(ok),
+        "rejected": sum(1 for r in results if r["status"] == 503),
+        "failed": sum(1 for r in results if r["status"] not in (200, 503) or r["errors"]),
+        "rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "ttfb_p50_ms": round(percentile(ttfbs, 50) * 1000, 1),
+        "ttfb_p99_ms": round(percentile(ttfbs, 99) * 1000, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+    }
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    """Regressions of results against a previous run, as readable lines"""
+    regressions = []
+    previous = {level["concurrency"]: level for level in baseline}
+    for level in results:
+        base = previous.get(level["concurrency"])
+        if base is None:
+            continue
+        for key in ("ttfb_p50_ms", "p50_ms", "p99_ms"):
+            if base[key] and level[key] > base[key] * (1 + tolerance):
+                regressions.append(f"c={level['concurrency']} {key}: {level[key]} > {base[key]}")
+        if base["rps"] and level["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"c={level['concurrency']} rps: {level['rps']} < {base['rps']}")
+        if level["failed"] > base["failed"]:
+            regressions.append(f"c={level['concurrency']} failed: {level['failed']} > {base['failed']}")
+    return regressions
+
+
+def print_table(results: list[dict]):
+    columns = ["concurrency", "requests", "ok", "rejected", "failed", "rps", "ttfb_p50_ms", "ttfb_p99_ms", "p50_ms", "p99_ms"]
+    print(" ".join(f"{c:>12}" for c in columns))
+    for level in results:
+        print(" ".join(f"{level[c]:>12}" for c in columns))
+
+
+async def bench(args) -> list[dict]:
+    from bench.fakes import FakeSpbApp, FakeAliasClient, FakeRAG, load_fake_servers
+    from bench.mock_llm import ScriptedLLM, load_script
+
+    spb_server, biz_app = load_fake_servers(
+        FakeSpbApp(rows=args.rows, db_latency=args.db_latency), FakeAliasClient(), FakeRAG(latency=args.rag_latency))
+    servers = []
+    if args.transport == "sse":
+        servers = [
+            await serve(spb_server.create_starlette_app(spb_server.mcp._mcp_server), args.port + 1, lifespan="off"),
+            await serve(biz_app.create_starlette_app(biz_app.mcp._mcp_server), args.port + 2, lifespan="off"),
+        ]
+
+    import main
+    script = load_script(args.script) if args.script else {}
+    main.llm = ScriptedLLM(ttft=args.llm_ttft, tokens_per_second=args.llm_tps, report_tokens=args.report_tokens, **script)
+    servers.insert(0, await serve(main.app, args.port))
+
+    url = f"http://127.0.0.1:{args.port}/stream"
+    results = []
+    try:
+        if args.warmup:
+            await run_level(url, 1, args.warmup, args.prompt, args.language)
+        for concurrency in args.concurrency:
+            level = await run_level(url, concurrency, args.requests or concurrency * 4, args.prompt, args.language)
+            results.append(level)
+    finally:
+        # main first, its lifespan closes the MCP sessions
+        main_server, main_task = servers[0]
+        main_server.should_exit = True
+        await main_task
+        # the tool servers' SSE handlers do not notice the closed sessions, cut them without the error logs
+        logging.getLogger("uvicorn.error").setLevel(logging.CRITICAL)
+        for server, task in servers[1:]:
+            server.should_exit = True
+            server.force_exit = True
+        for server, task in servers[1:]:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark with a scripted LLM and in-memory tool backends")
+    parser.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=0, help="Requests per concurrency level, default 4x the concurrency")
+    parser.add_argument("--warmup", type=int, default=2, help="Sequential requests before measuring")
+    parser.add_argument("--prompt", default="Analyze the robotic arm voltage history of device modbus and explain error code 10002")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--port", type=int, default=18000, help="main app port, the tool servers use the next two ports")
+    parser.add_argument("--transport", choices=["sse", "memory"], default="sse",
+                        help="Reach the tool servers over HTTP SSE, or in-process like edge.py")
+    parser.add_argument("--llm-ttft", type=float, default=0.3, help="Scripted LLM seconds to first token")
+    parser.add_argument("--llm-tps", type=float, default=50.0, help="Scripted LLM tokens per second")
+    parser.add_argument("--report-tokens", type=int, default=200)
+    parser.add_argument("--script", help="JSON file with ScriptedLLM fields, e.g. tool_calls and answer")
+    parser.add_argument("--rows", type=int, default=200, help="Rows returned by the fake TDengine queries")
+    parser.add_argument("--db-latency", type=float, default=0.01, help="Fake TDengine query seconds")
+    parser.add_argument("--rag-latency", type=float, default=0.05, help="Fake RAG query seconds")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--baseline", help="Compare with a previous --output file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    # Measure the workflow itself: no answer cache or fast path, no trace file, admission sized to the load
+    if args.transport == "memory":
+        os.environ["MCP_SERVERS"] = "memory:spb_server,memory:biz_app"
+    else:
+        os.environ.setdefault("MCP_SERVERS", f"http://127.0.0.1:{args.port + 1}/sse,http://127.0.0.1:{args.port + 2}/sse")
+    os.environ.setdefault("FAST_PATH", "false")
+    os.environ.setdefault("ANSWER_CACHE_TTL", "0")
+    os.environ.setdefault("ANSWER_CACHE_SIMILARITY", "")
+    os.environ.setdefault("TRACE_ENABLED", "false")
+    os.environ.setdefault("SESSION_BACKEND", "memory")
+    os.environ.setdefault("MAX_CONCURRENT_REQUESTS", str(max(args.concurrency)))
+    os.environ.setdefault("MAX_QUEUED_REQUESTS", str(max(args.concurrency)))
+
+    results = asyncio.run(bench(args))
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Checks RedisBackend save/load/evict/expire against an in-process Redis stand-in.
+
+    uv run --extra redis --with fakeredis python -m bench.session_redis
+    uv run --extra redis python -m bench.session_redis --url redis://localhost:6379/15
+
+The backend gets a fakeredis client through its `client` argument, with --url
+a real server is used instead; its keys go under a random prefix and are
+removed afterwards. Exits with status 1 when a check fails.
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, PROJECT_PATH)
+
+from llama_index.core import Settings
+from llama_index.core.llms import ChatMessage
+from llama_index.core.memory import ChatMemoryBuffer
+
+from session_backend import RedisBackend
+
+TIMEOUT = 3600
+
+
+def memory_of(*contents: str) -> ChatMemoryBuffer:
+    messages = [ChatMessage(role="user" if i % 2 == 0 else "assistant", content=content) for i, content in enumerate(contents)]
+    return ChatMemoryBuffer.from_defaults(chat_history=messages)
+
+
+def contents(memory: ChatMemoryBuffer | None) -> list[str] | None:
+    return None if memory is None else [message.content for message in memory.get_all()]
+
+
+def touch(backend: RedisBackend, session_id: str, last_access: float):
+    """Pretend the session was last used at `last_access`"""
+    backend.client.zadd(backend.access_key, {session_id: last_access})
+
+
+def run_checks(backend: RedisBackend) -> list[tuple[str, bool]]:
+    client = backend.client
+    data_key = lambda session_id: f"{backend.prefix}data:{session_id}"
+    results = []
+
+    def check(name: str, ok: bool):
+        results.append((name, bool(ok)))
+
+    backend.save("a", memory_of("voltage of modbus?", "230 V"), tokens=12)
+    check("save stores the messages with the session timeout as TTL", 0 < client.ttl(data_key("a")) <= TIMEOUT)
+    check("save records access time and tokens", client.zscore(backend.access_key, "a") is not None
+          and int(client.hget(backend.tokens_key, "a")) == 12)
+    check("load returns the saved messages", contents(backend.load("a", TIMEOUT)) == ["voltage of modbus?", "230 V"])
+    check("load of an unknown session is None", backend.load("missing", TIMEOUT) is None)
+
+    backend.save("a", memory_of("voltage of modbus?", "230 V", "and amper?"), tokens=20)
+    check("save overwrites the session", contents(backend.load("a", TIMEOUT))[-1] == "and amper?"
+          and int(client.hget(backend.tokens_key, "a")) == 20)
+
+    touch(backend, "a", time.time() - 100)
+    client.expire(data_key("a"), 10)
+    backend.load("a", TIMEOUT)
+    check("load refreshes access time and TTL", time.time() - float(client.zscore(backend.access_key, "a")) < 5
+          and client.ttl(data_key("a")) > 10)
+
+    backend.save("idle", memory_of("old question"), tokens=5)
+    touch(backend, "idle", time.time() - 120)
+    check("load of a session idle past the timeout is None", backend.load("idle", 60) is None)
+    check("and removes it", client.get(data_key("idle")) is None and client.zscore(backend.access_key, "idle") is None
+          and client.hget(backend.tokens_key, "idle") is None)
+
+    backend.save("b", memory_of("b"), tokens=5)
+    backend.save("c", memory_of("c"), tokens=5)
+    touch(backend, "b", time.time() - 120)
+    client.delete(data_key("b"))  # its TTL ran out in Redis, only the bookkeeping is left
+    check("expire removes sessions idle past the timeout", backend.expire(60) == 1)
+    check("and keeps the others", client.zscore(backend.access_key, "b") is None and client.hget(backend.tokens_key, "b") is None
+          and contents(backend.load("c", TIMEOUT)) == ["c"])
+
+    backend.delete("a")
+    backend.delete("c")
+    now = time.time()
+    for i, session_id in enumerate(["s0", "s1", "s2", "s3"]):
+        backend.save(session_id, memory_of(session_id), tokens=10)
+        touch(backend, session_id, now - 100 + i)
+    check("evict removes least recently used first, never `keep`", backend.evict(2, 10_000, keep="s0") == ["s1", "s2"])
+    check("and their data", client.get(data_key("s1")) is None and client.get(data_key("s2")) is None
+          and backend.load("s0", TIMEOUT) is not None and backend.load("s3", TIMEOUT) is not None)
+
+    backend.save("big", memory_of("big"), tokens=100)
+    check("evict keeps the total token budget", backend.evict(10, 100, keep="big") == ["s0", "s3"])
+    check("evict within budget removes nothing", backend.evict(10, 100, keep="big") == [])
+
+    backend.delete("big")
+    check("delete removes data and bookkeeping", client.get(data_key("big")) is None
+          and client.zcard(backend.access_key) == 0 and client.hlen(backend.tokens_key) == 0)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RedisBackend checks against fakeredis or a real Redis")
+    parser.add_argument("--url", help="Redis URL to check against instead of fakeredis")
+    args = parser.parse_args()
+
+    # token counts are not checked, this avoids downloading the tiktoken encoding
+    Settings.tokenizer = str.split
+    if args.url:
+        import redis
+
+        client = redis.Redis.from_url(args.url)
+    else:
+        import fakeredis
+
+        client = fakeredis.FakeRedis()
+    backend = RedisBackend(prefix=f"bench:{uuid.uuid4().hex[:8]}:", session_timeout=TIMEOUT, client=client)
+    try:
+        results = run_checks(backend)
+    finally:
+        keys = list(client.scan_iter(f"{backend.prefix}*"))
+        if keys:
+            client.delete(*keys)
+        backend.close()
+
+    for name, ok in results:
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    failed = sum(not ok for _, ok in results)
+    print(f"{len(results) - failed} passed, {failed} failed against {args.url or 'fakeredis'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
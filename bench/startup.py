@@ -0,0 +1,109 @@
+"""Startup time of spb_server.py, biz_app.py and main.py.
+
+    uv run python -m bench.startup
+    uv run python -m bench.startup --servers biz_app --timeout 300
+
+Starts the servers one after another as their own processes, as run.sh does,
+and prints the seconds until each port accepts connections and until /readyz
+answers 200 (backends connected, RAG index loaded, MCP sessions up). Servers
+keep running until all are measured, main needs the other two to be ready.
+Stop the running servers first, the ports are fixed.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import urllib.error
+import urllib.request
+
+PROJECT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+SERVERS = {"spb_server": 8081, "biz_app": 8082, "main": 8000}
+
+
+def port_open(port: int) -> bool:
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+
+def readyz(port: int) -> tuple[int, dict]:
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/readyz", timeout=2) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"{}")
+    except (OSError, ValueError):
+        return 0, {}
+
+
+def measure(name: str, port: int, process: subprocess.Popen, start: float, timeout: float, interval: float) -> dict:
+    result = {"server": name, "bind": None, "ready": None, "status": {}}
+    while time.perf_counter() - start < timeout and process.poll() is None:
+        if result["bind"] is None and port_open(port):
+            result["bind"] = time.perf_counter() - start
+        if result["bind"] is not None:
+            code, result["status"] = readyz(port)
+            if code == 200:
+                result["ready"] = time.perf_counter() - start
+                break
+        time.sleep(interval)
+    if process.poll() is not None:
+        result["status"] = {"exit_code": process.returncode}
+    return result
+
+
+def stop(processes: list[subprocess.Popen]):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seconds until each server binds its port and reports ready")
+    parser.add_argument("--servers", default=",".join(SERVERS), help="Comma separated, of " + ", ".join(SERVERS))
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for readiness per server")
+    parser.add_argument("--interval", type=float, default=0.02)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    names = args.servers.split(",")
+    for name in names:
+        if port_open(SERVERS[name]):
+            raise SystemExit(f"Port {SERVERS[name]} is in use, stop {name} first")
+
+    results = []
+    processes = []
+    try:
+        for name in names:
+            start = time.perf_counter()
+            process = subprocess.Popen([sys.executable, f"{name}.py"], cwd=PROJECT_PATH, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            processes.append(process)
+            results.append(measure(name, SERVERS[name], process, start, args.timeout, args.interval))
+    finally:
+        stop(processes)
+
+    def seconds(value):
+        return f"{value:.2f}" if value is not None else "-"
+
+    print(f"{'server':>12} {'bind s':>8} {'ready s':>8}")
+    for result in results:
+        print(f"{result['server']:>12} {seconds(result['bind']):>8} {seconds(result['ready']):>8}")
+        if result["ready"] is None:
+            print(f"{'':>12} not ready: {json.dumps(result['status'], ensure_ascii=False)}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
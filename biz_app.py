@@ -3,10 +3,10 @@ import signal
 
 
 from mcp.server.fastmcp import FastMCP
-from db.mariadb import Client
 import logging
 import os
-from db.rag import RAG
+from db.error_codes import ErrorCodeIndex
+from util import configure_tracer, instrument_mcp_server, Warmup
 
 load_dotenv()
 
@@ -14,16 +14,49 @@ project_path = os.path.abspath(os.path.dirname(__file__))
 logging.basicConfig(level=logging.INFO, filename=os.path.join(project_path, "logs/biz_server.log"), filemode="a", format="%(asctime)s - %(levelname)s - %(message)s")
 
 mcp = FastMCP()
-client = Client()
+configure_tracer("biz_app")
+instrument_mcp_server(mcp._mcp_server)
+
+def get_client():
+    from db.mariadb import Client
+
+    client = Client()
+    # get_ot_key answers from the in-memory alias index, refreshed from ot_it_mapping in the background
+    client.start_alias_refresh()
+    return client
+
+# Forked by start_index_pool before any thread runs, get_rag indexes with it and shuts it down
+index_pool = None
+
+def start_index_pool():
+    """Fork the processes converting the manuals, call it before warmup.start() or any other thread"""
+    global index_pool
+    from db.index_pool import create_index_pool
+
+    index_pool = create_index_pool()
+
+def get_rag():
+    # llama-index, the embedding model and Milvus are only imported by the warm-up thread
+    from db.rag import RAG
 
-def get_rag() -> RAG:
     rag = RAG()
+    # Incremental, only converts and embeds the manuals changed since the last run
     try:
-        rag.load_index_from_hybrid_chunks()
-    except Exception as e:
-        rag.create_index_from_hybrid_chunks("./data/3HAC066553-010_20250426183500.md")
+        rag.create_index_from_directory("./data", "*.md", pool=index_pool)
+    finally:
+        if index_pool:
+            index_pool.shutdown(cancel_futures=True)
     return rag
-rag = get_rag()
+
+def get_error_index() -> ErrorCodeIndex:
+    error_index = ErrorCodeIndex()
+    error_index.load_or_build("./data/*.md", "./storage/error_codes.json")
+    return error_index
+
+warmup = Warmup("biz_app")
+warmup.add("mariadb", get_client, closer=lambda client: client.close())
+warmup.add("error_index", get_error_index)
+warmup.add("rag", get_rag)
 
 @mcp.tool()
 async def get_ot_key(alias:str) -> list[str]:
@@ -34,10 +67,11 @@ async def get_ot_key(alias:str) -> list[str]:
 
     Return: The key values list that match to the specified alias or descriptive text, system use the key to match the real data reported from devices.
     '''
+    client = await warmup.aget("mariadb")
     return client.get_ot_id_by_alias(alias)
 
 @mcp.tool()
-def search_error_info_by_code(query: str) -> str:
+async def search_error_info_by_code(query: str) -> str:
     """
     Search for error information in the document vector database using a query string, especially when user query the tag `diagnose/error_code` value.
 
@@ -57,8 +91,17 @@ def search_error_info_by_code(query: str) -> str:
         "10042 Axis synchronized Description
         A fine calibration or update of revolution counter(s) was made...."
     """
+    # Exact error codes are answered from the manual index, even while the RAG index is still loading;
+    # vector search and synthesis only for free text
+    error_index = await warmup.aget("error_index")
+    answer = error_index.search(query)
+    if answer is not None:
+        logging.info(f"Error code index hit: {query}")
+        return answer
+
     logging.info(f"Searching documents with query: {query}")
-    response = rag.query(query)
+    rag = await warmup.aget("rag")
+    response = await rag.aquery(query)
     logging.info(f"Search result: {response}")
     return str(response)
 
@@ -89,6 +132,7 @@ def create_starlette_app(mcp_server: Server, *, debug: bool = False) -> Starlett
         routes=[
             Route("/sse", endpoint=handle_sse),
             Mount("/messages/", app=sse.handle_post_message),
+            *warmup.routes(),
         ],
     )
 
@@ -97,6 +141,7 @@ if __name__ == "__main__":
     
     def signal_handler(sig, frame):
         logging.info("Shutting down...")
+        warmup.close()
         logging.warning("biz app mcp server stopped")
         exit(0)
     
@@ -104,5 +149,9 @@ if __name__ == "__main__":
     
     logging.info("Starting biz app mcp server...")
 
+    # The RAG index is built or loaded in the background, /readyz reports when it is done
+    start_index_pool()
+    warmup.start()
+
     starlette_app = create_starlette_app(mcp._mcp_server, debug=True)
     uvicorn.run(starlette_app, host="0.0.0.0", port=8082)
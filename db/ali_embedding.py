@@ -1,37 +1,150 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, List
-from openai import OpenAI
+
+import openai
+from openai import OpenAI, AsyncOpenAI
 
 from llama_index.core.embeddings import BaseEmbedding
 
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
 class AliEmbeddings(BaseEmbedding):
-    def __init__(self, key:str, base_url:str, model_name:str, **kwargs: Any,) -> None:
+    """Embeddings from an OpenAI-compatible endpoint (DashScope by default).
+
+    Texts are sent `max_batch_size` per request, up to `max_concurrency`
+    requests in flight, with exponential backoff on rate limits, timeouts
+    and server errors. `embed_batch_size` defaults to one full round of
+    concurrent requests so llama-index batches keep every slot busy.
+    """
+    def __init__(self, key:str, base_url:str, model_name:str, dimensions: int = 1024, max_batch_size: int = 10,
+                 max_concurrency: int = 4, max_retries: int = 5, timeout: float = 60, **kwargs: Any,) -> None:
+        kwargs.setdefault("embed_batch_size", max_batch_size * max_concurrency)
         super().__init__(**kwargs)
         self.model_name = model_name
-        self._model: OpenAI = OpenAI(api_key=key, base_url=base_url)
-        
+        self._dimensions = dimensions
+        self._max_batch_size = max_batch_size
+        self._max_concurrency = max_concurrency
+        self._max_retries = max_retries
+        self._key = key
+        self._base_url = base_url
+        self._timeout = timeout
+        # retries are done here, with backoff and metrics
+        self._model: OpenAI = OpenAI(api_key=key, base_url=base_url, max_retries=0, timeout=timeout)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embedding")
+        # the async client and its semaphore belong to one event loop
+        self._loop = None
+        self._amodel: AsyncOpenAI | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "texts": 0, "retries": 0, "failures": 0, "tokens": 0, "request_seconds": 0.0}
+        self._started = time.monotonic()
+
     @classmethod
     def class_name(cls) -> str:
         return "Ali embedding."
 
+    def stats(self) -> dict:
+        """Request metrics since creation: counts, retries, tokens and texts per second"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        elapsed = time.monotonic() - self._started
+        stats["texts_per_second"] = round(stats["texts"] / elapsed, 2) if elapsed else 0.0
+        return stats
+
+    def __record(self, texts: int, seconds: float, response=None, failed: bool = False):
+        with self._stats_lock:
+            self._stats["requests"] += 1
+            self._stats["request_seconds"] += seconds
+            if failed:
+                self._stats["failures"] += 1
+                return
+            self._stats["texts"] += texts
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                self._stats["tokens"] += usage.total_tokens or 0
+
+    def __retry_delay(self, attempt: int) -> float:
+        with self._stats_lock:
+            self._stats["retries"] += 1
+        return min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+
+    def __batches(self, texts: List[str]) -> List[List[str]]:
+        # the API rejects empty input
+        texts = [text if text.strip() else " " for text in texts]
+        return [texts[i:i + self._max_batch_size] for i in range(0, len(texts), self._max_batch_size)]
+
+    @staticmethod
+    def __vectors(response) -> List[List[float]]:
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def __embed_batch(self, batch: List[str]) -> List[List[float]]:
+        for attempt in range(self._max_retries + 1):
+            start = time.monotonic()
+            try:
+                response = self._model.embeddings.create(model=self.model_name, input=batch, dimensions=self._dimensions, encoding_format="float")
+            except RETRYABLE_ERRORS as e:
+                self.__record(len(batch), time.monotonic() - start, failed=True)
+                if attempt == self._max_retries:
+                    raise
+                delay = self.__retry_delay(attempt)
+                logging.warning(f"Embedding request failed ({type(e).__name__}), retry in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            self.__record(len(batch), time.monotonic() - start, response)
+            return self.__vectors(response)
+
+    def __async_client(self) -> tuple[AsyncOpenAI, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._amodel = AsyncOpenAI(api_key=self._key, base_url=self._base_url, max_retries=0, timeout=self._timeout)
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._amodel, self._semaphore
+
+    async def __aembed_batch(self, batch: List[str]) -> List[List[float]]:
+        client, semaphore = self.__async_client()
+        for attempt in range(self._max_retries + 1):
+            async with semaphore:
+                start = time.monotonic()
+                try:
+                    response = await client.embeddings.create(model=self.model_name, input=batch, dimensions=self._dimensions, encoding_format="float")
+                except RETRYABLE_ERRORS as e:
+                    self.__record(len(batch), time.monotonic() - start, failed=True)
+                    if attempt == self._max_retries:
+                        raise
+                    delay = self.__retry_delay(attempt)
+                    logging.warning(f"Embedding request failed ({type(e).__name__}), retry in {delay:.1f}s")
+                else:
+                    self.__record(len(batch), time.monotonic() - start, response)
+                    return self.__vectors(response)
+            # back off outside the semaphore so other batches can use the slot
+            await asyncio.sleep(delay)
+
     async def _aget_query_embedding(self, query: str) -> List[float]:
-        return self._get_query_embedding(query)
+        return (await self.__aembed_batch([query]))[0]
 
     async def _aget_text_embedding(self, text: str) -> List[float]:
-        return self._get_text_embedding(text)
+        return (await self.__aembed_batch([text]))[0]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        results = await asyncio.gather(*(self.__aembed_batch(batch) for batch in self.__batches(texts)))
+        logging.info(f"Embedding progress: {self.stats()}")
+        return [vector for vectors in results for vector in vectors]
 
     def _get_query_embedding(self, query: str) -> List[float]:
-        completion = self._model.embeddings.create(model=self.model_name, input=query, dimensions=1024, encoding_format="float")
-        return completion.data[0].embedding
+        return self.__embed_batch([query])[0]
 
     def _get_text_embedding(self, text: str) -> List[float]:
-        completion = self._model.embeddings.create(model=self.model_name, input=text, dimensions=1024, encoding_format="float")
-        return completion.data[0].embedding
+        return self.__embed_batch([text])[0]
 
     def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
-        all_embeddings = []
-        for text in texts:
-            completion = self._model.embeddings.create(model=self.model_name, input=text, dimensions=1024, encoding_format="float")
-            # Extract embedding from the response
-            embedding_data = completion.data[0].embedding
-            all_embeddings.append(embedding_data)
-        return all_embeddings
+        batches = self.__batches(texts)
+        results = list(self._executor.map(self.__embed_batch, batches))
+        logging.info(f"Embedding progress: {self.stats()}")
+        return [vector for vectors in results for vector in vectors]
@@ -0,0 +1,129 @@
+import re
+import threading
+from collections import Counter, OrderedDict
+
+# Latin words and numbers, single CJK characters
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]")
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def tokens(text: str) -> set[str]:
+    return set(TOKEN_PATTERN.findall(text.lower()))
+
+
+def trigrams(text: str) -> set[str]:
+    # padded like pg_trgm, so short aliases and word starts still produce trigrams
+    padded = f"  {normalize(text)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class AliasIndex:
+    """In-memory OT id <-> IT alias index with ranked fuzzy lookup.
+
+    A query matches an alias exactly, as a substring, by shared tokens or by
+    trigram similarity; results are ranked in that order, then by similarity.
+    """
+    def __init__(self, min_similarity: float = 0.3, cache_size: int = 1024):
+        self.min_similarity = min_similarity
+        self.cache_size = cache_size
+        # query -> results, cleared on every change, the same aliases are asked for over and over
+        self.__results: OrderedDict = OrderedDict()
+        self.aliases: dict[str, str] = {}
+        self.__normalized: dict[str, str] = {}
+        self.__tokens: dict[str, set[str]] = {}
+        self.__trigrams: dict[str, set[str]] = {}
+        self.__token_postings: dict[str, set[str]] = {}
+        self.__trigram_postings: dict[str, set[str]] = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.aliases)
+
+    def __add(self, ot_id: str, alias: str):
+        self.aliases[ot_id] = alias
+        self.__normalized[ot_id] = normalize(alias)
+        self.__tokens[ot_id] = tokens(alias)
+        self.__trigrams[ot_id] = trigrams(alias)
+        for token in self.__tokens[ot_id]:
+            self.__token_postings.setdefault(token, set()).add(ot_id)
+        for trigram in self.__trigrams[ot_id]:
+            self.__trigram_postings.setdefault(trigram, set()).add(ot_id)
+
+    def __remove(self, ot_id: str):
+        del self.aliases[ot_id]
+        del self.__normalized[ot_id]
+        for token in self.__tokens.pop(ot_id):
+            self.__token_postings[token].discard(ot_id)
+            if not self.__token_postings[token]:
+                del self.__token_postings[token]
+        for trigram in self.__trigrams.pop(ot_id):
+            self.__trigram_postings[trigram].discard(ot_id)
+            if not self.__trigram_postings[trigram]:
+                del self.__trigram_postings[trigram]
+
+    def update(self, rows: dict[str, str]) -> tuple[int, int, int]:
+        """Make the index match `rows` (ot_id -> alias), only changed rows are re-indexed.
+
+        Returns the number of added, changed and removed rows.
+        """
+        with self.__lock:
+            removed = [ot_id for ot_id in self.aliases if ot_id not in rows]
+            changed = [ot_id for ot_id, alias in rows.items() if ot_id in self.aliases and self.aliases[ot_id] != alias]
+            added = [ot_id for ot_id in rows if ot_id not in self.aliases]
+            for ot_id in removed + changed:
+                self.__remove(ot_id)
+            for ot_id in changed + added:
+                self.__add(ot_id, rows[ot_id])
+            if added or changed or removed:
+                self.__results.clear()
+        return len(added), len(changed), len(removed)
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[str, float]]:
+        """(ot_id, score) best first; exact 3, substring 2, shared tokens 1 plus the trigram similarity"""
+        query_normalized = normalize(query)
+        if not query_normalized:
+            return []
+        query_tokens = tokens(query)
+        query_trigrams = trigrams(query)
+        with self.__lock:
+            cached = self.__results.get((query_normalized, limit))
+            if cached is not None:
+                self.__results.move_to_end((query_normalized, limit))
+                return cached
+            shared = Counter()
+            for trigram in query_trigrams:
+                shared.update(self.__trigram_postings.get(trigram, ()))
+            # a substring shares all trigrams but the padded ones at its ends, a similar alias at least
+            # min_similarity of them; too short queries can sit inside a word without any, scan all aliases
+            if len(query_normalized) < 3:
+                candidates = set(self.aliases)
+            else:
+                needed = min(self.min_similarity * len(query_trigrams), len(query_trigrams) - 3)
+                candidates = {ot_id for ot_id, count in shared.items() if count >= needed}
+            for token in query_tokens:
+                candidates |= self.__token_postings.get(token, set())
+            results = []
+            for ot_id in candidates:
+                alias = self.__normalized[ot_id]
+                count = shared.get(ot_id, 0)
+                similarity = count / (len(query_trigrams) + len(self.__trigrams[ot_id]) - count)
+                if alias == query_normalized:
+                    score = 3.0
+                elif query_normalized in alias or alias in query_normalized:
+                    score = 2.0 + similarity
+                elif query_tokens & self.__tokens[ot_id]:
+                    score = 1.0 + len(query_tokens & self.__tokens[ot_id]) / len(query_tokens | self.__tokens[ot_id])
+                elif similarity >= self.min_similarity:
+                    score = similarity
+                else:
+                    continue
+                results.append((ot_id, round(score, 4)))
+            results.sort(key=lambda item: (-item[1], item[0]))
+            results = results[:limit]
+            self.__results[(query_normalized, limit)] = results
+            while len(self.__results) > self.cache_size:
+                self.__results.popitem(last=False)
+        return list(results)
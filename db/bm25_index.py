@@ -0,0 +1,104 @@
+import re
+import json
+import math
+import time
+import logging
+from collections import Counter
+
+# Words, codes like 10002 or DSQC_652, and single CJK characters for the translated manual
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._-][a-z0-9]+)*|[\u4e00-\u9fff]")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """In-memory BM25 inverted index over the RAG chunks, persisted as JSON next to the vector store.
+
+    Only chunk texts and metadata are stored, postings are rebuilt on load.
+    """
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.docs: dict[str, dict] = {}
+        self.__postings: dict[str, dict[str, int]] = {}
+        self.__lengths: dict[str, int] = {}
+        self.__total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self.docs
+
+    def __index(self, node_id: str, text: str):
+        terms = Counter(tokenize(text))
+        for term, tf in terms.items():
+            self.__postings.setdefault(term, {})[node_id] = tf
+        length = sum(terms.values())
+        self.__lengths[node_id] = length
+        self.__total_length += length
+
+    def add(self, node_id: str, text: str, metadata: dict):
+        if node_id in self.docs:
+            self.remove([node_id])
+        self.docs[node_id] = {"text": text, "metadata": metadata}
+        self.__index(node_id, text)
+
+    def remove(self, node_ids: list[str]):
+        for node_id in node_ids:
+            doc = self.docs.pop(node_id, None)
+            if doc is None:
+                continue
+            for term in set(tokenize(doc["text"])):
+                postings = self.__postings.get(term)
+                if postings is not None:
+                    postings.pop(node_id, None)
+                    if not postings:
+                        del self.__postings[term]
+            self.__total_length -= self.__lengths.pop(node_id)
+
+    def clear(self):
+        self.docs = {}
+        self.__postings = {}
+        self.__lengths = {}
+        self.__total_length = 0
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.docs, f, ensure_ascii=False)
+
+    def load(self) -> bool:
+        start_time = time.time()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                docs = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.clear()
+        for node_id, doc in docs.items():
+            self.docs[node_id] = doc
+            self.__index(node_id, doc["text"])
+        logging.info(f"BM25 index loaded with {len(self.docs)} chunks and {len(self.__postings)} terms in {time.time() - start_time:.2f} seconds")
+        return True
+
+    def search(self, query: str, top_k: int = 5, source: str | None = None) -> list[tuple[str, float]]:
+        """(node id, score) of the best matching chunks, optionally of one source document only"""
+        if not self.docs:
+            return []
+        count = len(self.docs)
+        average_length = self.__total_length / count
+        scores: dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.__postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for node_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.__lengths[node_id] / average_length)
+                scores[node_id] = scores.get(node_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        if source:
+            scores = {node_id: score for node_id, score in scores.items() if self.docs[node_id]["metadata"].get("source") == source}
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
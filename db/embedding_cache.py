@@ -0,0 +1,113 @@
+import sqlite3
+import hashlib
+import logging
+import threading
+from array import array
+from typing import Any, List
+
+from llama_index.core.embeddings import BaseEmbedding
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent (model, text hash) -> vector cache in SQLite, vectors stored as float32"""
+    def __init__(self, path: str = "./storage/embedding_cache.db"):
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, PRIMARY KEY (model, hash))"
+        )
+        self.__conn.commit()
+
+    def get_many(self, model: str, hashes: list[str]) -> dict[str, list[float]]:
+        found = {}
+        with self.__lock:
+            # stay below the SQLite host parameter limit
+            for i in range(0, len(hashes), 500):
+                chunk = hashes[i:i + 500]
+                rows = self.__conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(chunk))})",
+                    [model, *chunk],
+                ).fetchall()
+                for hash_, blob in rows:
+                    found[hash_] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, model: str, items: dict[str, list[float]]):
+        with self.__lock:
+            self.__conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(model, hash_, array("f", vector).tobytes()) for hash_, vector in items.items()],
+            )
+            self.__conn.commit()
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
+
+
+class CachedEmbedding(BaseEmbedding):
+    """Wraps an embedding model, text embeddings are served from an EmbeddingCache when present.
+
+    Query embeddings are passed through, only document chunks repeat across index builds.
+    """
+    def __init__(self, embed_model: BaseEmbedding, cache: EmbeddingCache, model_key: str | None = None, **kwargs: Any):
+        kwargs.setdefault("embed_batch_size", embed_model.embed_batch_size)
+        super().__init__(model_name=embed_model.model_name, **kwargs)
+        self._inner = embed_model
+        self._cache = cache
+        # callers add the dimension when the same model name can produce several sizes
+        self._model_key = model_key or f"{type(embed_model).__name__}:{embed_model.model_name}"
+        self._hits = 0
+        self._misses = 0
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def stats(self) -> dict:
+        return {"hits": self._hits, "misses": self._misses}
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(text) for text in texts]
+        found = self._cache.get_many(self._model_key, list(dict.fromkeys(hashes)))
+        missing = {h: text for h, text in zip(hashes, texts) if h not in found}
+        if missing:
+            vectors = self._inner.get_text_embedding_batch(list(missing.values()))
+            new = dict(zip(missing.keys(), vectors))
+            self._cache.put_many(self._model_key, new)
+            found.update(new)
+        self._hits += len(texts) - len(missing)
+        self._misses += len(missing)
+        logging.debug(f"Embedding cache {self._hits} hits, {self._misses} misses")
+        return [found[h] for h in hashes]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(text) for text in texts]
+        found = self._cache.get_many(self._model_key, list(dict.fromkeys(hashes)))
+        missing = {h: text for h, text in zip(hashes, texts) if h not in found}
+        if missing:
+            vectors = await self._inner.aget_text_embedding_batch(list(missing.values()))
+            new = dict(zip(missing.keys(), vectors))
+            self._cache.put_many(self._model_key, new)
+            found.update(new)
+        self._hits += len(texts) - len(missing)
+        self._misses += len(missing)
+        return [found[h] for h in hashes]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._inner.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._inner.aget_query_embedding(query)
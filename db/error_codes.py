@@ -0,0 +1,139 @@
+import os
+import re
+import json
+import glob
+import time
+import logging
+
+# `## 10002, Program pointer ...`, a few headings carry a prefix like `con10002` or no space after the comma
+HEADING_PATTERN = re.compile(r"^##\s+[A-Za-z]*(\d{5,6})\s*,\s*(.+?)\s*$")
+# A query made of error codes only, e.g. "50153" or "10002, 10013"
+CODES_QUERY_PATTERN = re.compile(r"^[\s,;，、]*(?:\d{5,6}[\s,;，、]*)+$")
+CODE_PATTERN = re.compile(r"\d{5,6}")
+
+# Section label (as written in the manuals, including the "actoins" typo) -> field
+SECTION_LABELS = {
+    "Description": "description",
+    "Consequences": "consequences",
+    "Probable causes": "probable_causes",
+    "Recommended actions": "recommended_actions",
+    "Recommended actoins": "recommended_actions",
+    "说明": "description",
+    "后果": "consequences",
+    "可能原因": "probable_causes",
+    "建议措施": "recommended_actions",
+}
+FIELD_TITLES = {
+    "en": {"description": "Description", "consequences": "Consequences", "probable_causes": "Probable causes", "recommended_actions": "Recommended actions"},
+    "zh": {"description": "说明", "consequences": "后果", "probable_causes": "可能原因", "recommended_actions": "建议措施"},
+}
+
+
+def _match_label(line: str) -> tuple[str, str] | None:
+    """(field, rest of line) when the line starts a section"""
+    for label, field in SECTION_LABELS.items():
+        if line.startswith(label):
+            rest = line[len(label):]
+            # English labels are whole words, Chinese labels may run into the text
+            if label.isascii() and rest and not rest[0].isspace():
+                continue
+            return field, rest.strip()
+    return None
+
+
+def parse_manual(text: str, source: str) -> dict[str, dict]:
+    """Parse the event log manual markdown into {code: entry}"""
+    entries: dict[str, dict] = {}
+    entry = None
+    field = None
+    for line in text.splitlines():
+        heading = HEADING_PATTERN.match(line)
+        if heading:
+            code, title = heading.groups()
+            title = title.replace("\\_", "_")
+            entry = {"code": code, "title": title, "source": source, "lang": "en" if title.isascii() else "zh"}
+            field = None
+            # keep the first occurrence, later duplicates are cross references
+            entries.setdefault(code, entry)
+            continue
+        if line.startswith("#"):
+            entry = None
+            continue
+        if entry is None:
+            continue
+        stripped = line.strip().replace("\\_", "_")
+        label = _match_label(stripped)
+        if label:
+            field, stripped = label
+            entry.setdefault(field, "")
+        if field and stripped:
+            entry[field] = (entry[field] + "\n" + stripped).strip()
+    return entries
+
+
+class ErrorCodeIndex:
+    """Exact error code -> manual entry index, parsed from the ABB event log manuals.
+
+    Exact code queries are answered from memory; the index is saved as JSON
+    next to the vector store and rebuilt when a manual is newer.
+    """
+    def __init__(self):
+        self.entries: dict[str, list[dict]] = {}
+
+    def build(self, paths: list[str]):
+        start_time = time.time()
+        self.entries = {}
+        for path in sorted(paths):
+            with open(path, "r", encoding="utf-8") as f:
+                manual = parse_manual(f.read(), os.path.basename(path))
+            for code, entry in manual.items():
+                self.entries.setdefault(code, []).append(entry)
+        # English first, the translated manual is a two column layout whose sections are often interleaved
+        for entries in self.entries.values():
+            entries.sort(key=lambda e: e["lang"] != "en")
+        logging.info(f"Error code index built with {len(self.entries)} codes in {time.time() - start_time:.2f} seconds")
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+
+    def load(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            self.entries = json.load(f)
+        logging.info(f"Error code index loaded with {len(self.entries)} codes")
+
+    def load_or_build(self, pattern: str = "./data/*.md", path: str = "./storage/error_codes.json"):
+        paths = glob.glob(pattern)
+        if os.path.exists(path) and all(os.path.getmtime(p) <= os.path.getmtime(path) for p in paths):
+            try:
+                self.load(path)
+                return
+            except (OSError, ValueError) as e:
+                logging.warning(f"Failed to load error code index {path}, rebuilding: {e}")
+        self.build(paths)
+        self.save(path)
+
+    def lookup(self, code: str) -> list[dict]:
+        return self.entries.get(code.strip(), [])
+
+    @staticmethod
+    def format_entry(entry: dict) -> str:
+        titles = FIELD_TITLES[entry["lang"]]
+        lines = [f"{entry['code']}, {entry['title']}"]
+        for field, title in titles.items():
+            if entry.get(field):
+                lines.append(f"{title}:\n{entry[field]}")
+        return "\n\n".join(lines)
+
+    def search(self, query: str) -> str | None:
+        """Answer a query made of error codes only, None if it is free text or a code is unknown"""
+        if not CODES_QUERY_PATTERN.match(query):
+            return None
+        answers = []
+        for code in dict.fromkeys(CODE_PATTERN.findall(query)):
+            entries = self.lookup(code)
+            if not entries:
+                return None
+            # one entry per code, the English manual when it has the code
+            answers.append(self.format_entry(entries[0]))
+        return "\n\n---\n\n".join(answers)
@@ -0,0 +1,23 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def index_workers() -> int:
+    return int(os.getenv("INDEX_WORKERS", 0)) or os.cpu_count() or 1
+
+
+def create_index_pool(workers: int | None = None) -> ProcessPoolExecutor | None:
+    """Worker processes for chunk_document, forked right away.
+
+    A fork only copies the calling thread, forking while other threads hold locks (logging, the
+    event loop, database clients) can deadlock the workers, so servers call this before starting
+    any thread. Spawned workers are no option, they would re-import the server module.
+    """
+    workers = workers or index_workers()
+    if workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+    # with fork the first submit starts every worker, before the executor starts its own threads
+    pool.submit(os.getpid).result()
+    return pool
@@ -0,0 +1,167 @@
+import time
+import queue
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, List
+
+from llama_index.core.embeddings import BaseEmbedding
+
+# The query prompts HuggingFaceEmbedding uses for the BGE models, vectors stay comparable with an index built by it
+BGE_QUERY_INSTRUCTION_EN = "Represent this question for searching relevant passages: "
+BGE_QUERY_INSTRUCTION_ZH = "为这个句子生成表示以用于检索相关文章："
+
+
+def query_instruction_for(model_name: str) -> str:
+    name = model_name.lower()
+    if "bge" not in name:
+        return ""
+    return BGE_QUERY_INSTRUCTION_ZH if "-zh" in name else BGE_QUERY_INSTRUCTION_EN
+
+
+class LocalEmbedding(BaseEmbedding):
+    """Local transformers embedding model tuned for CPU inference.
+
+    - concurrent query embeddings are collected for up to `batch_wait` seconds and run as one batch
+    - texts are sorted by token length before batching, so little compute goes to padding
+    - `num_threads` sets the torch intra-op threads, `quantize` runs the Linear layers in int8
+    - token ids are kept in an LRU cache, repeated queries and re-indexed chunks skip the tokenizer
+    """
+    def __init__(self, model_name: str = "BAAI/bge-base-en-v1.5", num_threads: int | None = None, quantize: bool = False,
+                 max_batch_size: int = 32, batch_wait: float = 0.005, max_length: int = 512, token_cache_size: int = 4096,
+                 pooling: str = "cls", query_instruction: str | None = None, **kwargs: Any) -> None:
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+
+        kwargs.setdefault("embed_batch_size", max_batch_size)
+        # int8 vectors differ slightly, they must not share cached embeddings with the float model
+        super().__init__(model_name=f"{model_name}:int8" if quantize else model_name, **kwargs)
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        start_time = time.time()
+        self._torch = torch
+        self._tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name).eval()
+        if quantize:
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self._model = model
+        self._pooling = pooling
+        self._query_instruction = query_instruction_for(model_name) if query_instruction is None else query_instruction
+        self._max_batch_size = max_batch_size
+        self._batch_wait = batch_wait
+        self._max_length = max_length
+        self._token_cache: OrderedDict = OrderedDict()
+        self._token_cache_size = token_cache_size
+        self._cache_lock = threading.Lock()
+        # one forward pass at a time, each already uses all torch threads
+        self._forward_lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._batcher: threading.Thread | None = None
+        self._batcher_lock = threading.Lock()
+        self._stats = {"queries": 0, "query_batches": 0, "texts": 0, "token_cache_hits": 0, "token_cache_misses": 0, "forward_seconds": 0.0}
+        logging.info(f"Local embedding model {self.model_name} loaded in {time.time() - start_time:.2f} seconds, "
+                     f"{torch.get_num_threads()} threads")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalEmbedding"
+
+    def stats(self) -> dict:
+        return dict(self._stats)
+
+    def __token_ids(self, texts: List[str]) -> List[List[int]]:
+        with self._cache_lock:
+            found = {}
+            for text in texts:
+                ids = self._token_cache.get(text)
+                if ids is not None:
+                    self._token_cache.move_to_end(text)
+                    found[text] = ids
+        missing = [text for text in dict.fromkeys(texts) if text not in found]
+        if missing:
+            encoded = self._tokenizer(missing, truncation=True, max_length=self._max_length)["input_ids"]
+            new = dict(zip(missing, encoded))
+            found.update(new)
+            with self._cache_lock:
+                self._token_cache.update(new)
+                while len(self._token_cache) > self._token_cache_size:
+                    self._token_cache.popitem(last=False)
+        with self._cache_lock:
+            self._stats["token_cache_hits"] += len(texts) - len(missing)
+            self._stats["token_cache_misses"] += len(missing)
+        return [found[text] for text in texts]
+
+    def __forward(self, texts: List[str]) -> List[List[float]]:
+        torch = self._torch
+        ids = self.__token_ids(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(ids[i]))
+        vectors: List[List[float]] = [[] for _ in texts]
+        for start in range(0, len(order), self._max_batch_size):
+            batch_order = order[start:start + self._max_batch_size]
+            batch = self._tokenizer.pad({"input_ids": [ids[i] for i in batch_order]}, return_tensors="pt")
+            with self._forward_lock, torch.inference_mode():
+                forward_start = time.monotonic()
+                hidden = self._model(**batch).last_hidden_state
+                if self._pooling == "cls":
+                    pooled = hidden[:, 0]
+                else:
+                    mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                    pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                pooled = torch.nn.functional.normalize(pooled, p=2, dim=1).tolist()
+                self._stats["forward_seconds"] += time.monotonic() - forward_start
+            for i, vector in zip(batch_order, pooled):
+                vectors[i] = vector
+        self._stats["texts"] += len(texts)
+        return vectors
+
+    def __batch_loop(self):
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self._batch_wait
+            while len(items) < self._max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._stats["query_batches"] += 1
+            try:
+                vectors = self.__forward([text for text, _ in items])
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(items, vectors):
+                future.set_result(vector)
+
+    def __submit_query(self, query: str) -> Future:
+        with self._batcher_lock:
+            if self._batcher is None:
+                self._batcher = threading.Thread(target=self.__batch_loop, name="embedding-batcher", daemon=True)
+                self._batcher.start()
+            self._stats["queries"] += 1
+        future: Future = Future()
+        self._queue.put((self._query_instruction + query, future))
+        return future
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self.__submit_query(query).result()
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await asyncio.wrap_future(self.__submit_query(query))
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self.__forward([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await asyncio.to_thread(self.__forward, [text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self.__forward(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.__forward, texts)
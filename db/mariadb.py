@@ -1,6 +1,13 @@
 import os
-import mysql.connector
+import time
 import logging
+import threading
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import pooling
+
+from alias_index import AliasIndex
 
 # Table definitions
 # CREATE TABLE device_alias (
@@ -16,57 +23,105 @@ import logging
 #);
 
 class Client:
+    """MariaDB access through a connection pool, OT/IT alias lookups are answered from an in-memory AliasIndex"""
     def __init__(self):
         self.host = os.getenv("MARIADB_HOST", "localhost")
         self.port = os.getenv("MARIADB_PORT", 3306)
         self.user = os.getenv("MARIADB_USER", "root")
         self.password = os.getenv("MARIADB_PASSWORD", "public")
-        self.connection = None
-    
+        self.pool_size = int(os.getenv("MARIADB_POOL_SIZE", 2))
+        self.refresh_interval = float(os.getenv("ALIAS_REFRESH_INTERVAL", 60))
+        self.pool: pooling.MySQLConnectionPool | None = None
+        self.aliases = AliasIndex()
+        self.__aliases_checksum = None
+        self.__aliases_loaded = False
+        self.__pool_lock = threading.Lock()
+        self.__refresher: threading.Thread | None = None
+        self.__closing = threading.Event()
+
     def connect(self) -> bool:
+        with self.__pool_lock:
+            if self.pool is not None:
+                return True
+            try:
+                self.pool = pooling.MySQLConnectionPool(
+                    pool_name="spb_demo",
+                    pool_size=self.pool_size,
+                    host=self.host,
+                    port=self.port,
+                    database='demo',
+                    user=self.user,
+                    password=self.password,
+                    charset="utf8mb4",
+                    collation="utf8mb4_general_ci"  # Using MariaDB compatible collation
+                )
+                logging.info(f"Connected to MariaDB at {self.host} with a pool of {self.pool_size}")
+                return True
+            except mysql.connector.Error as err:
+                logging.critical(f"Error connecting to MariaDB: {err}")
+                return False
+
+    @contextmanager
+    def connection(self):
+        """A pooled connection, returned to the pool on exit"""
+        if not self.connect():
+            raise mysql.connector.Error(msg=f"MariaDB at {self.host} is not available")
+        connection = self.pool.get_connection()
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def refresh_aliases(self) -> bool:
+        """Reload ot_it_mapping into the alias index when the table checksum changed, False on a database error"""
+        start_time = time.time()
         try:
-            connection = mysql.connector.connect(
-                host=self.host,
-                port=self.port,
-                database='demo',
-                user=self.user,
-                password=self.password,
-                charset="utf8mb4",
-                collation="utf8mb4_general_ci"  # Using MariaDB compatible collation
-            )
-            logging.info(f"Connected to MariaDB at {self.host}")
-            self.connection = connection
-            return True
+            with self.connection() as connection, connection.cursor() as cursor:
+                # cheap change detection, the table has no update timestamp
+                cursor.execute("CHECKSUM TABLE ot_it_mapping")
+                checksum = cursor.fetchone()[1]
+                if self.__aliases_loaded and checksum == self.__aliases_checksum:
+                    return True
+                cursor.execute("SELECT ot_id, it_alias FROM ot_it_mapping")
+                rows = {ot_id: it_alias for ot_id, it_alias in cursor.fetchall()}
         except mysql.connector.Error as err:
-            logging.critical(f"Error connecting to MariaDB: {err}")
+            logging.error(f"Error loading ot_it_mapping: {err}")
             return False
-    
+        added, changed, removed = self.aliases.update(rows)
+        self.__aliases_checksum = checksum
+        self.__aliases_loaded = True
+        logging.info(f"Alias index refreshed in {time.time() - start_time:.3f} seconds: {len(self.aliases)} aliases, "
+                     f"{added} added, {changed} changed, {removed} removed")
+        return True
+
+    def __refresh_periodically(self):
+        while not self.__closing.wait(self.refresh_interval):
+            self.refresh_aliases()
+
+    def start_alias_refresh(self):
+        """Load the alias index now and keep it in sync in a background thread"""
+        self.refresh_aliases()
+        if self.__refresher is None and self.refresh_interval > 0:
+            self.__refresher = threading.Thread(target=self.__refresh_periodically, name="alias-refresh", daemon=True)
+            self.__refresher.start()
+
+    def close(self):
+        self.__closing.set()
+
     def get_ot_id_by_alias(self, it_alias: str) -> list[str]:
         """
         Retrieve OT IDs based on fuzzy matching of descriptions from the ot_it_mapping table
         
         Args:
-            description (str): The description to search for
+            it_alias (str): The description to search for
             
         Returns:
-            list[str]: A list of matching OT IDs, empty list if none found
+            list[str]: Matching OT IDs, best match first, empty list if none found
         """
-        try:
-            self.connect()
-            cursor = self.connection.cursor()
-            # Using LIKE with wildcards for fuzzy matching
-            query = "SELECT ot_id FROM ot_it_mapping WHERE it_alias LIKE %s"
-            # Add wildcards before and after the search term
-            search_term = f"%{it_alias}%"
-
-            logging.info(f'{query} {search_term}')
-            cursor.execute(query, (search_term,))
-            
-            results = cursor.fetchall()
-            return [result[0] for result in results] if results else []
-            
-        except mysql.connector.Error as err:
-            print(f"Error querying database: {err}")
+        if not self.__aliases_loaded and not self.refresh_aliases():
             return []
-        
+        matches = self.aliases.search(it_alias)
+        logging.info(f"Alias {it_alias} matches {matches}")
+        return [ot_id for ot_id, _ in matches]
+
     
\ No newline at end of file
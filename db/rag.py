@@ -1,12 +1,21 @@
 import os
 import time
+import json
+import uuid
+import glob
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor, as_completed
 from dotenv import load_dotenv
 import logging
-from tempfile import mkdtemp
 
-from llama_index.core import StorageContext, Settings 
+from llama_index.core import Settings, QueryBundle, get_response_synthesizer
+from llama_index.core.retrievers import VectorIndexRetriever, BaseRetriever
+from llama_index.core.schema import TextNode, NodeWithScore
+from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.llms.siliconflow import SiliconFlow
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.core.vector_stores import (
     MetadataFilter,
     MetadataFilters,
@@ -15,66 +24,332 @@ from llama_index.core.vector_stores import (
 from llama_index.vector_stores.milvus import MilvusVectorStore
 
 from ali_embedding import AliEmbeddings
+from embedding_cache import EmbeddingCache, CachedEmbedding
+from bm25_index import BM25Index, tokenize
+from index_pool import index_workers, create_index_pool
 
 load_dotenv()
-Settings.llm = SiliconFlow(api_key=os.getenv("SFAPI_KEY"),model=str(os.getenv("MODEL_NAME")),temperature=0,max_tokens=4000, timeout=180)
+
+def use_local_embedding() -> bool:
+    local_embedding = os.getenv('EMBEDDING_LOCAL')
+    return local_embedding == "True" or local_embedding == "true"
+
+def create_embed_model():
+    if use_local_embedding():
+        # imports torch, only when the local model is used
+        from local_embedding import LocalEmbedding
+        return LocalEmbedding(
+            model_name="BAAI/bge-base-en-v1.5",
+            num_threads=int(os.getenv("EMBEDDING_THREADS") or 0) or None,
+            quantize=os.getenv("EMBEDDING_QUANTIZE", "").lower() == "int8",
+            max_batch_size=int(os.getenv("EMBEDDING_LOCAL_BATCH_SIZE", 32)),
+        )
+    return AliEmbeddings(
+        key=os.getenv("EMBEDDING_API_KEY"),
+        base_url=os.getenv("EMBEDDING_API_BASE_URL"),
+        model_name=os.getenv("EMBEDDING_MODEL_NAME"),
+        max_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", 10)),
+        max_concurrency=int(os.getenv("EMBEDDING_CONCURRENCY", 4)),
+    )
+
+# Bumped when chunking or chunk metadata changes, documents indexed by an older version are re-inserted
+CHUNK_VERSION = 2
+
+def chunk_document(path: str) -> list:
+    """Convert a manual with docling and split it into TextNodes, runs in the indexing worker processes"""
+    from docling.document_converter import DocumentConverter
+    from docling.chunking import HybridChunker
+    from llama_index.core.schema import NodeRelationship, RelatedNodeInfo
+
+    doc = DocumentConverter().convert(path).document
+
+    chunker = HybridChunker(max_tokens=256)
+    chunks = list(chunker.chunk(dl_doc=doc))
+
+    source = os.path.basename(path)
+    nodes = []
+    seen: dict[str, int] = {}
+    for chunk in chunks:
+        text = "\n".join([line for line in chunk.text.splitlines() if line.strip()])
+        text = chunk.meta.headings[0] + ': ' + text
+        # the id only depends on the content, so unchanged chunks keep their id across builds
+        key = f"{source}\0{text}"
+        seen[key] = seen.get(key, 0) + 1
+        node_id = str(uuid.UUID(hashlib.sha256(f"{key}\0{seen[key]}".encode("utf-8")).hexdigest()[:32]))
+        # source is for filtering only, keeping it out of the embedded text keeps the cached embeddings valid
+        node = TextNode(id_=node_id, text=text, metadata={"headings": "".join(chunk.meta.headings), "source": source},
+                        excluded_embed_metadata_keys=["source"], excluded_llm_metadata_keys=["source"])
+        node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=source)
+        nodes.append(node)
+    return nodes
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+class HeadingMatchRetriever(VectorIndexRetriever):
+    """Vector retriever restricted to chunks whose headings contain the query text, the filter is built per query.
+
+    `source` further restricts it to the chunks of one manual.
+    """
+    def __init__(self, *args, source: str | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._source = source
+
+    def _build_vector_store_query(self, query_bundle_with_embeddings: QueryBundle):
+        vector_store_query = super()._build_vector_store_query(query_bundle_with_embeddings)
+        filters = [MetadataFilter(
+            key="headings",
+            value=query_bundle_with_embeddings.query_str,
+            operator=FilterOperator.TEXT_MATCH,
+        )]
+        if self._source:
+            filters.append(MetadataFilter(key="source", value=self._source, operator=FilterOperator.EQ))
+        vector_store_query.filters = MetadataFilters(filters=filters)
+        return vector_store_query
+
+class HybridRetriever(BaseRetriever):
+    """BM25 and dense retrieval fused by reciprocal rank.
+
+    Queries made of identifiers only (error codes, part numbers) whose terms all occur in the
+    best BM25 chunk are answered from BM25 alone, without computing a query embedding.
+    """
+    def __init__(self, dense: VectorIndexRetriever, sparse: BM25Index, similarity_top_k: int = 5,
+                 similarity_cutoff: float = 0.5, source: str | None = None, rrf_k: int = 60):
+        super().__init__()
+        self._dense = dense
+        self._sparse = sparse
+        self._top_k = similarity_top_k
+        self._cutoff = similarity_cutoff
+        self._source = source
+        self._rrf_k = rrf_k
+
+    def __sparse_nodes(self, query: str) -> list[NodeWithScore]:
+        nodes = []
+        for node_id, score in self._sparse.search(query, self._top_k, self._source):
+            doc = self._sparse.docs[node_id]
+            node = TextNode(id_=node_id, text=doc["text"], metadata=doc["metadata"], excluded_llm_metadata_keys=["source"])
+            nodes.append(NodeWithScore(node=node, score=score))
+        return nodes
+
+    @staticmethod
+    def __sparse_only(query: str, sparse: list[NodeWithScore]) -> bool:
+        terms = set(tokenize(query))
+        if not sparse or not terms or not all(any(c.isdigit() for c in term) for term in terms):
+            return False
+        return terms <= set(tokenize(sparse[0].node.get_content()))
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        sparse = self.__sparse_nodes(query_bundle.query_str)
+        if self.__sparse_only(query_bundle.query_str, sparse):
+            logging.debug(f"BM25 only retrieval: {query_bundle.query_str}")
+            return sparse
+        # the similarity cutoff applies to the dense scores, fused scores are rank based
+        dense = [node for node in self._dense.retrieve(query_bundle) if (node.score or 0.0) >= self._cutoff]
+        fused: dict[str, NodeWithScore] = {}
+        scores: dict[str, float] = {}
+        for results in (dense, sparse):
+            for rank, node in enumerate(results):
+                node_id = node.node.node_id
+                fused.setdefault(node_id, node)
+                scores[node_id] = scores.get(node_id, 0.0) + 1.0 / (self._rrf_k + rank + 1)
+        ranked = sorted(scores, key=scores.get, reverse=True)[:self._top_k]
+        return [NodeWithScore(node=fused[node_id].node, score=scores[node_id]) for node_id in ranked]
+
 class RAG:
     def __init__(self):
-        local_embedding = os.getenv('EMBEDDING_LOCAL')
+        Settings.llm = SiliconFlow(api_key=os.getenv("SFAPI_KEY"),model=str(os.getenv("MODEL_NAME")),temperature=0,max_tokens=4000, timeout=180)
+        local_embedding = use_local_embedding()
         use_pg = os.getenv('EMBEDDING_PG')
 
-        if local_embedding == "True" or local_embedding == "true":
-            local_embedding = True
-        else:
-            local_embedding = False
-        
+        Settings.embed_model = create_embed_model()
         if local_embedding:
-            Settings.embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-base-en-v1.5",)
             self.__dimension = 768
             self.__store_uri = "./storage/en_local.db"
             logging.info("Using local embedding model: BAAI/bge-base-en-v1.5")
         else:
-            Settings.embed_model = AliEmbeddings(key=os.getenv("EMBEDDING_API_KEY"), base_url=os.getenv("EMBEDDING_API_BASE_URL"), model_name=os.getenv("EMBEDDING_MODEL_NAME"))
             self.__dimension = 1024
             self.__store_uri = "./storage/en_ali.db"
             logging.info("Using Ali embedding model")
 
+        # Chunk embeddings survive re-indexing, keyed by model and chunk text hash
+        self.__index_embed_model = CachedEmbedding(
+            Settings.embed_model, EmbeddingCache("./storage/embedding_cache.db"),
+            model_key=f"{Settings.embed_model.model_name}:{self.__dimension}")
+        # source file -> file hash and node ids in the vector store
+        self.__manifest_path = self.__store_uri + ".manifest.json"
+        # keyword index over the same chunks, kept in sync with the manifest
+        self.__sparse = BM25Index(self.__store_uri + ".bm25.json")
+        self.__sparse.load()
         self.index = None
-    
-    def create_index_from_hybrid_chunks(self, path: str):
-        start_time = time.time()
-        from docling.document_converter import DocumentConverter
-        from docling.chunking import HybridChunker
-        from llama_index.core.schema import Document
-        from llama_index.core import VectorStoreIndex 
+        self.engine = None
+        self.__engines: dict = {}
+        # LRU caches keyed by (normalized query, source, index version), bumped on every index (re)load
+        self.cache_size = int(os.getenv("RAG_CACHE_SIZE", 256))
+        self.__index_version = 0
+        self.__retrievals: OrderedDict = OrderedDict()
+        self.__answers: OrderedDict = OrderedDict()
+        # retrieve runs in asyncio.to_thread workers, the caches are shared between them
+        self.__cache_lock = threading.Lock()
+        self.insert_batch_size = int(os.getenv("INDEX_INSERT_BATCH_SIZE", 256))
 
-        doc = DocumentConverter().convert(path).document
-
-        chunker = HybridChunker(max_tokens=256)
-        chunks = list(chunker.chunk(dl_doc=doc))
-
-        for chunk in chunks:
-            chunk.text = "\n".join([line for line in chunk.text.splitlines() if line.strip()])
-            #logging.info(f"{chunk.meta}, {chunk.text}, {len(chunk.text)}")
-
-        documents = [
-            Document(
-                text=chunk.meta.headings[0] + ': ' + chunk.text,
-                metadata={
-                    "headings": "".join(chunk.meta.headings),
-                },
-            ) for chunk in chunks
-        ]
-        vector_store = MilvusVectorStore(uri=self.__store_uri, dim=self.__dimension, overwrite=True)
-        index = VectorStoreIndex.from_documents(
-            documents=documents,
-            storage_context=StorageContext.from_defaults(vector_store=vector_store),
-            embed_model=Settings.embed_model,
-            show_progress=True,
-        )
+    def __set_index(self, index):
+        """Build the long-lived query engine for a new or reloaded index"""
         self.index = index
+        self.__engines = {}
+        self.engine = self.__engine(None)
+        with self.__cache_lock:
+            self.__index_version += 1
+            self.__retrievals.clear()
+            self.__answers.clear()
+
+    def __engine(self, source: str | None):
+        """Query engine of the whole corpus, or of one manual when `source` is its file name"""
+        engine = self.__engines.get(source)
+        if engine is None:
+            engine = RetrieverQueryEngine(
+                retriever=HybridRetriever(
+                    dense=HeadingMatchRetriever(index=self.index, similarity_top_k=5, source=source),
+                    sparse=self.__sparse, similarity_top_k=5, similarity_cutoff=0.5, source=source,
+                ),
+                response_synthesizer=get_response_synthesizer(),
+            )
+            self.__engines[source] = engine
+        return engine
+
+    def __load_manifest(self) -> dict:
+        try:
+            with open(self.__manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def __save_manifest(self, manifest: dict):
+        with open(self.__manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+    @staticmethod
+    def __file_hash(path: str) -> str:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def __up_to_date(self, entry: dict | None, file_hash: str) -> bool:
+        return (bool(entry) and entry["file_hash"] == file_hash and entry.get("version") == CHUNK_VERSION
+                # documents missing from the BM25 index (e.g. indexed before it existed) are re-chunked, their vectors are kept
+                and all(node_id in self.__sparse for node_id in entry["node_ids"]))
+
+    def __open_index(self, manifest: dict):
+        from llama_index.core import VectorStoreIndex
+
+        # without a manifest the collection may hold chunks with unknown ids, start clean
+        if not manifest:
+            self.__sparse.clear()
+        vector_store = MilvusVectorStore(uri=self.__store_uri, dim=self.__dimension, overwrite=not manifest)
+        index = VectorStoreIndex.from_vector_store(vector_store=vector_store, embed_model=self.__index_embed_model)
+        return vector_store, index
+
+    def __update_document(self, vector_store, index, manifest: dict, source: str, file_hash: str, nodes: list) -> tuple[int, int]:
+        """Apply the chunk diff of one document to the vector store, returns (added, removed)"""
+        entry = manifest.get(source)
+        # chunks of an older chunk version lack metadata, replace them all
+        old_ids = set(entry["node_ids"]) if entry else set()
+        reuse = old_ids if entry and entry.get("version") == CHUNK_VERSION else set()
+        new_ids = {node.node_id for node in nodes}
+        removed = list(old_ids - (new_ids & reuse))
+        added = [node for node in nodes if node.node_id not in reuse]
+        if removed:
+            vector_store.delete_nodes(node_ids=removed)
+        # batches bound memory and let Milvus inserts follow each round of embedding requests
+        for i in range(0, len(added), self.insert_batch_size):
+            index.insert_nodes(added[i:i + self.insert_batch_size])
+        self.__sparse.remove(removed)
+        for node in nodes:
+            self.__sparse.add(node.node_id, node.text, node.metadata)
+        self.__sparse.save()
+
+        manifest[source] = {"file_hash": file_hash, "version": CHUNK_VERSION, "node_ids": [node.node_id for node in nodes]}
+        # saved per document, an interrupted run keeps the documents already indexed
+        self.__save_manifest(manifest)
+        return len(added), len(removed)
+
+    def create_index_from_hybrid_chunks(self, path: str, rebuild: bool = False):
+        """Index a document incrementally: only new chunks are embedded and inserted, removed chunks are deleted.
+
+        An unchanged file is skipped without converting it; `rebuild` recreates the collection,
+        still reusing the cached chunk embeddings.
+        """
+        start_time = time.time()
+        source = os.path.basename(path)
+        manifest = {} if rebuild else self.__load_manifest()
+        file_hash = self.__file_hash(path)
+        vector_store, index = self.__open_index(manifest)
+
+        if self.__up_to_date(manifest.get(source), file_hash):
+            self.__set_index(index)
+            logging.info(f"Index of {source} is up to date")
+            return
+
+        nodes = chunk_document(path)
+        added, removed = self.__update_document(vector_store, index, manifest, source, file_hash, nodes)
+        self.__set_index(index)
+        end_time = time.time()
+        logging.info(f"Index of {source} updated in {end_time - start_time:.2f} seconds: {added} added, {removed} removed, "
+                     f"{len(nodes) - added} unchanged chunks, embedding cache {self.__index_embed_model.stats()}")
+
+    def create_index_from_directory(self, directory: str = "./data", pattern: str = "*.md", workers: int | None = None, rebuild: bool = False,
+                                    pool: Executor | None = None):
+        """Index every manual in a directory incrementally, see create_index_from_hybrid_chunks.
+
+        Changed manuals are converted and chunked by docling in a process pool; each document's chunks
+        are embedded and inserted as soon as it is ready, while the other documents are still converting.
+        Manuals removed from the directory are removed from the index.
+
+        A server indexing from a background thread passes a `pool` from create_index_pool, forked
+        before its threads started; forking here is only done while no other thread is running.
+        """
+        start_time = time.time()
+        paths = sorted(glob.glob(os.path.join(directory, pattern)))
+        manifest = {} if rebuild else self.__load_manifest()
+        hashes = {os.path.basename(path): self.__file_hash(path) for path in paths}
+        changed = [path for path in paths if not self.__up_to_date(manifest.get(os.path.basename(path)), hashes[os.path.basename(path)])]
+        workers = min(len(changed), workers or index_workers())
+        own_pool = False
+        if pool is None and workers > 1:
+            if threading.active_count() == 1:
+                pool = create_index_pool(workers)
+                own_pool = pool is not None
+            else:
+                logging.warning(f"Indexing {len(changed)} manuals in this process, other threads are running and no index pool was passed")
+        if pool is None:
+            workers = min(workers, 1)
+        try:
+            if pool:
+                futures = {pool.submit(chunk_document, path): path for path in changed}
+                documents = ((futures[future], future.result()) for future in as_completed(futures))
+            else:
+                documents = ((path, chunk_document(path)) for path in changed)
+
+            vector_store, index = self.__open_index(manifest)
+            for source in [source for source in manifest if source not in hashes]:
+                node_ids = manifest.pop(source)["node_ids"]
+                vector_store.delete_nodes(node_ids=node_ids)
+                self.__sparse.remove(node_ids)
+                self.__sparse.save()
+                self.__save_manifest(manifest)
+                logging.info(f"Removed {source} from the index")
+            total_added = total_removed = 0
+            for path, nodes in documents:
+                source = os.path.basename(path)
+                added, removed = self.__update_document(vector_store, index, manifest, source, hashes[source], nodes)
+                total_added += added
+                total_removed += removed
+                logging.info(f"Index of {source} updated: {len(nodes)} chunks, {added} added, {removed} removed")
+        finally:
+            if own_pool:
+                pool.shutdown(cancel_futures=True)
+        self.__set_index(index)
         end_time = time.time()
-        logging.info(f"Index created from hybrid chunks in {end_time - start_time:.2f} seconds")
+        logging.info(f"Index of {len(paths)} documents in {directory} updated in {end_time - start_time:.2f} seconds with {max(workers, 1)} workers: "
+                     f"{len(changed)} changed, {total_added} chunks added, {total_removed} removed, embedding cache {self.__index_embed_model.stats()}")
     
     def load_index_from_hybrid_chunks(self):
         from llama_index.core import VectorStoreIndex 
@@ -82,35 +357,52 @@ class RAG:
         start_time = time.time()
         vector_store = MilvusVectorStore(uri=self.__store_uri, dim=self.__dimension)
         index = VectorStoreIndex.from_vector_store(vector_store=vector_store, embed_model=Settings.embed_model)
-        self.index = index
+        self.__set_index(index)
         end_time = time.time()
         logging.info(f"Index loaded from hybrid chunks in {end_time - start_time:.2f} seconds")
-    
-    def query(self, query: str):
-        from llama_index.core import get_response_synthesizer
-        from llama_index.core.retrievers import VectorIndexRetriever
-        from llama_index.core.query_engine import RetrieverQueryEngine
-        from llama_index.core.postprocessor import SimilarityPostprocessor
-
-        retriever = VectorIndexRetriever(
-            index=self.index,
-            similarity_top_k=5,
-            filters=MetadataFilters(
-                filters=[MetadataFilter(
-                    key="headings",
-                    value=query,
-                    operator=FilterOperator.TEXT_MATCH,
-                )]
-            ),
-        )
-        response_synthesizer = get_response_synthesizer()
-        engine = RetrieverQueryEngine(
-            retriever=retriever,
-            response_synthesizer=response_synthesizer,
-            node_postprocessors=[SimilarityPostprocessor(similarity_cutoff=0.5)],
-        )
 
-        response = engine.query(query)
+    def __cache_get(self, cache: OrderedDict, key):
+        with self.__cache_lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def __cache_put(self, cache: OrderedDict, key, value):
+        with self.__cache_lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+    def retrieve(self, query: str, source: str | None = None) -> list:
+        key = (normalize_query(query), source, self.__index_version)
+        nodes = self.__cache_get(self.__retrievals, key)
+        if nodes is None:
+            nodes = self.__engine(source).retrieve(QueryBundle(query))
+            self.__cache_put(self.__retrievals, key, nodes)
+        return nodes
+
+    def query(self, query: str, source: str | None = None):
+        key = (normalize_query(query), source, self.__index_version)
+        response = self.__cache_get(self.__answers, key)
+        if response is not None:
+            logging.info(f"RAG answer cache hit: {query}")
+            return response
+        response = self.__engine(source).synthesize(QueryBundle(query), self.retrieve(query, source))
+        self.__cache_put(self.__answers, key, response)
+        return response
+
+    async def aquery(self, query: str, source: str | None = None):
+        """Like query, without blocking the event loop: retrieval runs in a thread, synthesis on the async LLM API"""
+        key = (normalize_query(query), source, self.__index_version)
+        response = self.__cache_get(self.__answers, key)
+        if response is not None:
+            logging.info(f"RAG answer cache hit: {query}")
+            return response
+        nodes = await asyncio.to_thread(self.retrieve, query, source)
+        response = await self.__engine(source).asynthesize(QueryBundle(query), nodes)
+        self.__cache_put(self.__answers, key, response)
         return response
     
 if __name__ == "__main__":
@@ -118,8 +410,7 @@ if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, filename=os.path.join(project_path, "../logs/rag.log"), filemode="a", format="%(asctime)s - %(levelname)s - %(message)s")
     load_dotenv()
     rag = RAG()
-    #rag.create_index_from_hybrid_chunks("./data/3HAC066553-001_20250426182528.md")
-    #rag.create_index_from_hybrid_chunks("./data/3HAC066553-010_20250426183500.md")
+    #rag.create_index_from_directory("./data")
     rag.load_index_from_hybrid_chunks()
     start_time = time.time()
     response = rag.query("50515")
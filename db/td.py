@@ -1,8 +1,11 @@
 from td_client import Client
 import logging
+from typing import Iterator
 from pandas import Timestamp
 from dotenv import load_dotenv
 
+from util import tracer
+
 load_dotenv()
 
 class DB:
@@ -12,6 +15,7 @@ class DB:
         self.use_database("demo")
         self.create_status_table()
         self.create_tags_table()
+        self.create_alarms_table()
     
     def create_db(self):
         self.td.execute("CREATE DATABASE IF NOT EXISTS demo")
@@ -35,6 +39,14 @@ class DB:
         """
         self.td.execute(sql)
     
+    def create_alarms_table(self):
+        sql = """
+        CREATE TABLE IF NOT EXISTS alarms (
+            `ts` TIMESTAMP, `device` BINARY(128), `tag_name` BINARY(128), `rule` BINARY(64), `severity` BINARY(16),
+            `state` BINARY(16), `tag_value` BINARY(128), `message` BINARY(256))
+        """
+        self.td.execute(sql)
+
     def update_device_status(self, time: Timestamp, device: str, status: str):
         sql = f"INSERT INTO devices VALUES ('{time}', '{device}', '{status}')"
         logging.info(f"SQL: {sql}")
@@ -48,6 +60,39 @@ class DB:
         result = self.td.execute(sql)
         logging.debug(f"Inserted {result} rows into tag_values table")
     
+    def insert_alarm(self, event):
+        timestamp = int(event.ts.timestamp() * 1000)
+        sql = (f"INSERT INTO alarms VALUES ('{timestamp}', '{event.device}', '{event.tag}', '{event.rule}', "
+               f"'{event.severity}', '{event.state}', '{event.value}', '{event.message}')")
+        result = self.td.execute(sql)
+        logging.debug(f"Inserted {result} rows into alarms table")
+
+    def query_alarms(self, start: str, end: str, device: str | None = None, state: str | None = None) -> list[dict]:
+        sql = f"SELECT * FROM alarms WHERE ts >= '{start}' AND ts < '{end}'"
+        if device:
+            sql += f" AND device = '{device}'"
+        if state:
+            sql += f" AND state = '{state}'"
+        return self.query_sql(sql + " ORDER BY ts ASC")
+
+    def query_data_version(self, table: str, device: str | None = None, tag: str | None = None,
+                           start: str | None = None, end: str | None = None) -> dict:
+        """Row count and latest ts of a table, or of the rows of a device, tag and time range in it"""
+        sql = f"SELECT COUNT(*) AS rec_count, LAST(ts) AS last_ts FROM {table}"
+        conditions = []
+        if device:
+            conditions.append(f"device = '{device}'")
+        if tag:
+            conditions.append(f"tag_name = '{tag}'")
+        if start:
+            conditions.append(f"ts >= '{start}'")
+        if end:
+            conditions.append(f"ts <= '{end}'")
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        results = self.query_sql(sql)
+        return results[0] if results else {"rec_count": 0, "last_ts": None}
+
     def query_tag_range(self, device: str, tag: str, start: str, end: str) -> list[dict]:
         sql = f"SELECT * FROM tag_values WHERE device = '{device}' AND tag_name = '{tag}' AND ts > '{start}' AND ts < '{end}'"
         return self.td.execute(sql)
@@ -60,18 +105,38 @@ class DB:
         sql = f"SELECT * FROM devices WHERE device = '{device}' AND ts > '{start}' AND ts < '{end}'"
         return self.td.query(sql)
     
+    def query_device_status_events(self, device: str, since: str) -> list[dict]:
+        sql = f"SELECT ts, status FROM devices WHERE device = '{device}' AND ts >= '{since}' ORDER BY ts ASC"
+        return self.query_sql(sql)
+
+    def query_device_last_status_before(self, device: str, before: str) -> list[dict]:
+        sql = f"SELECT ts, status FROM devices WHERE device = '{device}' AND ts < '{before}' ORDER BY ts DESC LIMIT 1"
+        return self.query_sql(sql)
+
+    def query_status_devices(self) -> list[str]:
+        return [row['device'] for row in self.query_sql("SELECT DISTINCT device FROM devices")]
+
     def execute_sql(self, sql: str) -> list[dict]:
         result = self.td.execute(sql)
         return result.to_dict(orient="records")
     
-    def query_sql(self, sql: str) -> list[dict]:
-        result = self.td.query(sql)
-        lresult = []
+    def iter_sql(self, sql: str) -> Iterator[tuple]:
+        """Rows of `sql` as they are fetched, for results too large to hold in a list"""
+        with tracer.span("tdengine.query", sql=sql[:200]):
+            result = self.td.query(sql)
         for row in result:
-            item = {}
-            for i in range(len(row)):
-                item[result.fields[i].name()] = row[i]
-            lresult.append(item)
+            yield tuple(row)
+
+    def query_sql(self, sql: str) -> list[dict]:
+        with tracer.span("tdengine.query", sql=sql[:200]) as span:
+            result = self.td.query(sql)
+            lresult = []
+            for row in result:
+                item = {}
+                for i in range(len(row)):
+                    item[result.fields[i].name()] = row[i]
+                lresult.append(item)
+            span.set(rows=len(lresult))
         return lresult
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
 import os
-from typing import Any, Union
+import asyncio
+from typing import Any, Awaitable, Callable, Optional, Union
 import logging
 import traceback
 
@@ -14,12 +15,15 @@ from llama_index.core.workflow import (
 
 from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.core.llms import ChatMessage, MessageRole 
-from llama_index.core.agent.workflow import (AgentWorkflow, AgentStream, ToolCallResult)
+from llama_index.core.tools import ToolOutput
+from llama_index.core.agent.workflow import (AgentWorkflow, AgentStream, AgentInput, AgentOutput, ToolCall, ToolCallResult)
 from llama_index.llms.openai_like import OpenAILike
 from llama_index.llms.siliconflow import SiliconFlow
 
 from llama_index.tools.mcp import BasicMCPClient, McpToolSpec
-from util import load_system_prompt,load_json_prompt
+from util import load_system_prompt,load_json_prompt,tracer
+from util.condense import condense_tool_output
+from mcp_pool import MCPClientManager
 
 def cprint(text: str, end: str = "", flush: bool = True):
     WORKFLOW_COLOR = '\033[36m'
@@ -28,6 +32,10 @@ def cprint(text: str, end: str = "", flush: bool = True):
 
 base_dir=os.getenv("MCP_SRV_BASE_DIR")
 
+# Upper bound of tool workers per workflow, the effective per-request cap is max_concurrent_tools
+MAX_TOOL_WORKERS = 16
+MAX_CONCURRENT_TOOLS = int(os.getenv("MAX_CONCURRENT_TOOLS", 4))
+
 
 class ProgressEvent(Event):
     msg: str
@@ -55,12 +63,80 @@ async def init_mcp_server():
         all_tools.extend(tools)   
     return all_tools
 
+class ConcurrentAgentWorkflow(AgentWorkflow):
+    """AgentWorkflow that runs the tool calls of one agent step concurrently.
+
+    Each ToolCallResult is streamed as soon as its call finishes, while the
+    results are handed to the agent memory in the order the LLM emitted the calls.
+    Large tabular outputs reach the agent memory as a numeric digest only.
+    With `fingerprint_tool` set, the fingerprint of the data each call reads is
+    taken before the call runs and kept in `tool_fingerprints` by tool id.
+    """
+    def __init__(self, *args, max_concurrent_tools: int = MAX_CONCURRENT_TOOLS,
+                 fingerprint_tool: Optional[Callable[[str, dict], Awaitable[Optional[str]]]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tool_semaphore = asyncio.Semaphore(max(1, min(max_concurrent_tools, MAX_TOOL_WORKERS)))
+        self.fingerprint_tool = fingerprint_tool
+        self.tool_fingerprints: dict[str, Optional[str]] = {}
+
+    @step
+    async def parse_agent_output(self, ctx: Context, ev: AgentOutput) -> Union[StopEvent, ToolCall, None]:
+        await ctx.set("tool_call_order", [tool_call.tool_id for tool_call in ev.tool_calls])
+        await ctx.set("pending_tool_results", [])
+        return await super().parse_agent_output(ctx, ev)
+
+    @step(num_workers=MAX_TOOL_WORKERS)
+    async def call_tool(self, ctx: Context, ev: ToolCall) -> ToolCallResult:
+        if self.fingerprint_tool is not None:
+            self.tool_fingerprints[ev.tool_id] = await self.fingerprint_tool(ev.tool_name, ev.tool_kwargs)
+        async with self.tool_semaphore:
+            result_ev = await super().call_tool(ctx, ev)
+
+        # The full output was already streamed to the UI, the agent context only gets a digest of large tables
+        output = result_ev.tool_output
+        digest = condense_tool_output(output.raw_output, str(output.content))
+        if digest is None:
+            return result_ev
+        logging.info(f"Condensed {ev.tool_name} output from {len(str(output.content))} to {len(digest)} chars")
+        return ToolCallResult(
+            tool_name=result_ev.tool_name,
+            tool_kwargs=result_ev.tool_kwargs,
+            tool_id=result_ev.tool_id,
+            tool_output=ToolOutput(
+                content=digest,
+                tool_name=output.tool_name,
+                raw_input=output.raw_input,
+                raw_output=output.raw_output,
+                is_error=output.is_error,
+            ),
+            return_direct=result_ev.return_direct,
+        )
+
+    @step
+    async def aggregate_tool_results(self, ctx: Context, ev: ToolCallResult) -> Union[AgentInput, StopEvent, None]:
+        pending = await ctx.get("pending_tool_results", default=[])
+        pending.append(ev)
+        num_tool_calls = await ctx.get("num_tool_calls", default=0)
+        if len(pending) < num_tool_calls:
+            await ctx.set("pending_tool_results", pending)
+            return None
+
+        await ctx.set("pending_tool_results", [])
+        order = await ctx.get("tool_call_order", default=[])
+        pending.sort(key=lambda e: order.index(e.tool_id) if e.tool_id in order else len(order))
+        result = None
+        for result_ev in pending:
+            result = await super().aggregate_tool_results(ctx, result_ev)
+        return result
+
 class DemoFlow(Workflow):
     def __init__(
             self,
             llm: OpenAILike,
             lang: str = "zh",
             memory: ChatMemoryBuffer = None,
+            mcp_manager: MCPClientManager = None,
+            fingerprint_tool: Optional[Callable[[str, dict], Awaitable[Optional[str]]]] = None,
             *args,
             **kwargs):
         # Initialize memory if not provided
@@ -70,57 +146,76 @@ class DemoFlow(Workflow):
         self.lang = lang
         self.client = None
         self.llm = llm
+        self.mcp_manager = mcp_manager
+        # (tool_name, tool_kwargs, fingerprint) of every tool call of this run, the fingerprint
+        # of its data taken by `fingerprint_tool` before it ran, None without one
+        self.fingerprint_tool = fingerprint_tool
+        self.tool_calls = []
         super().__init__(*args, **kwargs)
 
     @step
     async def query_data(self, ctx: Context, ev: StartEvent) -> Union[ ToolExecResultEvent | StopEvent]:
-        self.all_tools = await init_mcp_server()
-        tools_name = [tool.metadata.name for tool in self.all_tools]
-        # # Add event showing available tools
-        ctx.write_event_to_stream(ProgressEvent(msg=f"Available tools: {tools_name}\n\n"))
-
-        system_prompt=load_system_prompt(prompt_filename="system.txt", lang=self.lang).format(ev=ev)
-        self.memory.put(ChatMessage(role=MessageRole.SYSTEM,content=system_prompt))
-
-        query_info = AgentWorkflow.from_tools_or_functions(
-            tools_or_functions=self.all_tools,
-            llm=self.llm,
-            system_prompt=system_prompt,
-            verbose=False,
-            timeout=180,
-            )
+        with tracer.span("DemoFlow.query_data"):
+            if self.mcp_manager is not None:
+                self.all_tools = await self.mcp_manager.get_tools()
+            else:
+                self.all_tools = await init_mcp_server()
+            tools_name = [tool.metadata.name for tool in self.all_tools]
+            # # Add event showing available tools
+            ctx.write_event_to_stream(ProgressEvent(msg=f"Available tools: {tools_name}\n\n"))
+
+            system_prompt=load_system_prompt(prompt_filename="system.txt", lang=self.lang).format(ev=ev)
+            # The system prompt is the same on every turn of a session, keep only one copy in memory
+            if not any(m.role == MessageRole.SYSTEM and m.content == system_prompt for m in self.memory.get_all()):
+                self.memory.put(ChatMessage(role=MessageRole.SYSTEM,content=system_prompt))
+
+            query_info = ConcurrentAgentWorkflow.from_tools_or_functions(
+                tools_or_functions=self.all_tools,
+                llm=self.llm,
+                system_prompt=system_prompt,
+                verbose=False,
+                timeout=180,
+                )
+            query_info.fingerprint_tool = self.fingerprint_tool
         
-        json_prompts = load_json_prompt("data_analysis.json", self.lang)
-        user_prompt = json_prompts["pre_analyze"].format(ev=ev)
-        await ctx.set("user_input", ev.user_input)
-        self.memory.put(ChatMessage(role=MessageRole.USER,content=user_prompt))
-
-        handler = query_info.run(user_msg=f'{user_prompt}. \n\n')
-
-        response = ""
-        async for event in handler.stream_events():
-            if isinstance(event, AgentStream):
-                cprint(event.delta, end="", flush=True)
-                response += event.delta
-                # ctx.write_event_to_stream(ProgressEvent(msg=event.delta))
-            elif isinstance(event, ToolCallResult):
-                ctx.write_event_to_stream(ProgressEvent(msg=f'{event.tool_name}: {event.tool_kwargs}\n\n'))
-                ctx.write_event_to_stream(ProgressEvent(msg=f'{event.tool_output}\n'))
-
-        self.memory.put(ChatMessage(role=MessageRole.ASSISTANT,content=response))
-        return ToolExecResultEvent(result=response)
+            json_prompts = load_json_prompt("data_analysis.json", self.lang)
+            user_prompt = json_prompts["pre_analyze"].format(ev=ev)
+            await ctx.set("user_input", ev.user_input)
+            self.memory.put(ChatMessage(role=MessageRole.USER,content=user_prompt))
+
+            handler = query_info.run(user_msg=f'{user_prompt}. \n\n')
+
+            response = ""
+            try:
+                async for event in handler.stream_events():
+                    if isinstance(event, AgentStream):
+                        cprint(event.delta, end="", flush=True)
+                        response += event.delta
+                        # ctx.write_event_to_stream(ProgressEvent(msg=event.delta))
+                    elif isinstance(event, ToolCallResult):
+                        self.tool_calls.append((event.tool_name, event.tool_kwargs, query_info.tool_fingerprints.get(event.tool_id)))
+                        ctx.write_event_to_stream(ProgressEvent(msg=f'{event.tool_name}: {event.tool_kwargs}\n\n'))
+                        ctx.write_event_to_stream(ProgressEvent(msg=f'{event.tool_output}\n'))
+            except asyncio.CancelledError:
+                # The outer workflow was cancelled, stop the agent and its in-flight tool calls too
+                await handler.cancel_run()
+                raise
+
+            self.memory.put(ChatMessage(role=MessageRole.ASSISTANT,content=response))
+            return ToolExecResultEvent(result=response)
 
     @step
     async def gen_report(self, ctx: Context, ev: ToolExecResultEvent) -> StopEvent:
-        ev.user_input = await ctx.get("user_input")
-        user_prompt = load_json_prompt("data_analysis.json", self.lang)["gen_report"].format(ev=ev)
-        self.memory.put(ChatMessage(role=MessageRole.USER, content=user_prompt))
-        chat_history = self.memory.get()
-
-        response = ""
-        handle = await self.llm.astream_chat(chat_history)
-        async for token in handle:
-            # cprint(token.delta)
-            ctx.write_event_to_stream(ProgressEvent(msg=token.delta))
-            response += token.delta
-        return StopEvent(result=response)
\ No newline at end of file
+        with tracer.span("DemoFlow.gen_report"):
+            ev.user_input = await ctx.get("user_input")
+            user_prompt = load_json_prompt("data_analysis.json", self.lang)["gen_report"].format(ev=ev)
+            self.memory.put(ChatMessage(role=MessageRole.USER, content=user_prompt))
+            chat_history = self.memory.get()
+
+            response = ""
+            handle = await self.llm.astream_chat(chat_history)
+            async for token in handle:
+                # cprint(token.delta)
+                ctx.write_event_to_stream(ProgressEvent(msg=token.delta))
+                response += token.delta
+            return StopEvent(result=response)
\ No newline at end of file
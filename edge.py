@@ -0,0 +1,61 @@
+"""Single-process deployment: chat app, Sparkplug MCP tools and biz tools in one event loop.
+
+The tools are reached over in-memory MCP streams instead of HTTP SSE. With
+--sse the tool servers are also served on their usual ports for external
+MCP clients.
+
+    uv run edge.py
+    uv run edge.py --sse
+"""
+import os
+import asyncio
+import logging
+import argparse
+
+project_path = os.path.abspath(os.path.dirname(__file__))
+logging.basicConfig(level=logging.INFO, filename=os.path.join(project_path, "logs/edge.log"), filemode="a", format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Must be set before main is imported, it creates the MCP client manager
+os.environ["MCP_SERVERS"] = "memory:spb_server,memory:biz_app"
+
+import uvicorn
+
+import spb_server
+import biz_app
+import main
+
+
+async def serve(args):
+    # live tag values and history export on the app port, the spb app is in this process
+    main.app.add_route("/tags/stream", spb_server.stream_tags)
+    main.app.add_route("/export/tags", spb_server.export_tags)
+    configs = [uvicorn.Config(main.app, host=args.host, port=args.port)]
+    if args.sse:
+        configs.append(uvicorn.Config(spb_server.create_starlette_app(spb_server.mcp._mcp_server), host=args.host, port=args.spb_port,
+                                      lifespan="off", timeout_graceful_shutdown=5))
+        configs.append(uvicorn.Config(biz_app.create_starlette_app(biz_app.mcp._mcp_server), host=args.host, port=args.biz_port,
+                                      lifespan="off", timeout_graceful_shutdown=5))
+    # Each server re-raises the signal it captured on exit, so Ctrl+C stops all of them
+    await asyncio.gather(*(uvicorn.Server(config).serve() for config in configs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--sse", action="store_true", help="Also serve the MCP tools over SSE for external clients")
+    parser.add_argument("--spb-port", type=int, default=8081)
+    parser.add_argument("--biz-port", type=int, default=8082)
+    args = parser.parse_args()
+
+    logging.info("Starting single-process server...")
+    # Backends connect and the RAG index loads in the background while the ports are bound;
+    # the indexing workers are forked first, while this is the only thread
+    biz_app.start_index_pool()
+    spb_server.warmup.start()
+    biz_app.warmup.start()
+    try:
+        asyncio.run(serve(args))
+    finally:
+        spb_server.warmup.close()
+        logging.warning("Single-process server stopped")
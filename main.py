@@ -1,6 +1,8 @@
 import os
 import logging
 import uuid
+import asyncio
+from contextlib import asynccontextmanager, aclosing
 
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request
@@ -8,20 +10,51 @@ from llama_index.llms.siliconflow import SiliconFlow
 from llama_index.llms.deepseek import DeepSeek
 from sse_starlette.sse import EventSourceResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
+from starlette.background import BackgroundTask
 import json
 
 from demo_flow import DemoFlow, Context, ProgressEvent
 from session_store import SessionStore
-from db.rag import RAG
+from session_backend import create_backend
+from mcp_pool import MCPClientManager
+from router import FastPathRouter
+from admission import AdmissionController, Ticket
+from answer_cache import AnswerCache
+from util import tracer, configure_tracer, timing_summary, instrument_llm
+from llama_index.core.memory import ChatMemoryBuffer
+from llama_index.core.llms import ChatMessage, MessageRole
 
 project_path = os.path.abspath(os.path.dirname(__file__))
 logging.basicConfig(level=logging.INFO, filename=os.path.join(project_path, "logs/mcp_service.log"), filemode="a", format="%(asctime)s - %(levelname)s - %(message)s")
 
 load_dotenv()
+configure_tracer("main")
+instrument_llm()
+# Send a `timing` SSE event with the request spans after the answer
+TRACE_SSE_TIMING = os.getenv("TRACE_SSE_TIMING", "false").lower() == "true"
 
-app = FastAPI()
-session_store = SessionStore()
+session_store = SessionStore(backend=create_backend())
+mcp_manager = MCPClientManager()
+router = FastPathRouter(mcp_manager)
+admission = AdmissionController()
+
+cache_embed_model = None
+if os.getenv("ANSWER_CACHE_SIMILARITY"):
+    from db.rag import create_embed_model
+    cache_embed_model = create_embed_model()
+answer_cache = AnswerCache(mcp_manager, embed_model=cache_embed_model, similarity=float(os.getenv("ANSWER_CACHE_SIMILARITY") or 0.95))
+background_tasks = set()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await mcp_manager.start()
+    session_store.start()
+    yield
+    await session_store.stop()
+    await mcp_manager.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add after creating the FastAPI app
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -30,15 +63,70 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 async def root():
     return FileResponse("index.html")
 
+@app.get("/livez")
+async def livez():
+    return {"service": "main", "status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    # MCP sessions connect in the background after the port is bound
+    servers = mcp_manager.status()
+    ready = all(servers.values())
+    return JSONResponse({"service": "main", "ready": ready, "mcp_servers": servers}, status_code=200 if ready else 503)
+
 llm = SiliconFlow(api_key=os.getenv("SFAPI_KEY"), model=str(os.getenv("MODEL_NAME")), temperature=0.6, max_tokens=4000, timeout=180)
 # llm = DeepSeek(model=os.getenv("DS_MODEL_NAME"), api_key=os.getenv("DS_API_KEY"),temperature=0.6,max_tokens=6000)
 
-async def event_generator(prompt: str, session_id: str, language: str):
+async def event_generator(prompt: str, session_id: str, language: str, ticket: Ticket):
+    try:
+        with tracer.span("event_generator", session_id=session_id, lang=language) as span:
+            if TRACE_SSE_TIMING:
+                tracer.collect(span.trace_id)
+            with tracer.span("admission.wait"):
+                async for position in admission.wait(ticket):
+                    yield {
+                        "event": "queue",
+                        "data": json.dumps({"queue_position": position})
+                    }
+            # closed right away on a disconnect, its finally cancels the workflow and saves the memory
+            async with aclosing(answer_events(prompt, session_id, language)) as events:
+                async for item in events:
+                    yield item
+    finally:
+        # Also runs when the client disconnects and the stream is cancelled
+        admission.release(ticket)
+        spans = tracer.pop_collected(span.trace_id) if TRACE_SSE_TIMING else None
+
+    if spans is not None:
+        yield {
+            "event": "timing",
+            "data": json.dumps(timing_summary(spans))
+        }
+
+async def answer_events(prompt: str, session_id: str, language: str):
     # Get existing memory or create new one
     memory = session_store.get_memory(session_id)
     if memory is not None:
         print(memory.get())
 
+    # Simple questions are answered from the tools directly, without the LLM pipeline.
+    # Repeated first questions of a session replay a cached answer while its data is unchanged,
+    # follow-ups are not cached since their answer depends on the conversation
+    answer = await router.answer(prompt, language)
+    if answer is None and memory is None:
+        answer = await answer_cache.get(prompt, language)
+    if answer is not None:
+        yield {
+            "event": "message",
+            "data": f'{json.dumps({"content": answer})}\n\n'
+        }
+        if memory is None:
+            memory = ChatMemoryBuffer(token_limit=64000)
+        memory.put(ChatMessage(role=MessageRole.USER, content=prompt))
+        memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=answer))
+        session_store.save_memory(session_id, memory)
+        return
+
     device_info = '''要查询的设备是 ABB FlexPendant。ABB FlexPendant 是一款手持式触摸屏设备，用于编程和控制 ABB 工业机器人。它作为机器人控制器的用户界面，允许操作员执行多种操作，如更改和运行程序、教授机器人新的动作以及调整参数。
           
           设备定义的点位如下所示，
@@ -51,7 +139,10 @@ async def event_generator(prompt: str, session_id: str, language: str):
         其中 diagnose 分组中包含了 error_code 是设备上报的错误代码；
           '''
     # Initialize the LLM and workflow
-    workflow = DemoFlow(timeout=None, llm=llm, verbose=True, memory=memory, lang=language)
+    # Only first questions are cached, their data version is taken before each tool call runs
+    fingerprint_tool = answer_cache.fingerprint_call if memory is None else None
+    workflow = DemoFlow(timeout=None, llm=llm, verbose=True, memory=memory, lang=language, mcp_manager=mcp_manager,
+                        fingerprint_tool=fingerprint_tool)
     ctx = Context(workflow)
 
     # Run the workflow
@@ -66,12 +157,23 @@ async def event_generator(prompt: str, session_id: str, language: str):
                     "event": "message",
                     "data": f'{json.dumps({"content": ev.msg})}\n\n'
                 }
+        report = await handler
+        if memory is None:
+            # only the report, the tool list and tool outputs streamed before it are not replayed
+            await answer_cache.put(prompt, language, str(report or ""), workflow.tool_calls)
     except Exception as e:
         yield {
             "event": "error",
             "data": str(e)
         }
     finally:
+        if not handler.done():
+            # Client disconnected, the stream was cancelled or closed at a yield;
+            # stop the workflow with its LLM streams and tool calls
+            logging.info(f"Client of session {session_id} disconnected, cancelling workflow")
+            cancel_task = asyncio.create_task(handler.cancel_run())
+            background_tasks.add(cancel_task)
+            cancel_task.add_done_callback(background_tasks.discard)
         # Save the updated memory
         session_store.save_memory(session_id, workflow.memory)
 
@@ -89,13 +191,32 @@ async def stream_llm_response(request: Request):
     # Get language preference from header, default to 'zh' if not present
     language = request.headers.get("X-Language", "zh")
     
+    # Reject overload before opening the stream
+    ticket = admission.reserve()
+    if ticket is None:
+        return JSONResponse(status_code=503, content={"error": "Server is busy, please retry later"}, headers={"Retry-After": "10"})
+
     return EventSourceResponse(
-        event_generator(user_prompt, session_id, language),
+        event_generator(user_prompt, session_id, language, ticket),
+        # release is idempotent, this covers a disconnect before the generator started
+        background=BackgroundTask(admission.release, ticket),
         media_type="text/event-stream"
     )
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
 
-    logging.info("Starting FastAPI server...")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes, requires SESSION_BACKEND=sqlite or redis when > 1")
+    args = parser.parse_args()
+
+    if args.workers > 1 and not session_store.backend.shared:
+        logging.error("Multiple workers need a shared session backend, set SESSION_BACKEND to sqlite or redis")
+        exit(1)
+
+    logging.info(f"Starting FastAPI server with {args.workers} workers...")
+    if args.workers > 1:
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=args.workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
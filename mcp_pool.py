@@ -0,0 +1,227 @@
+import os
+import asyncio
+import importlib
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any
+
+from mcp import ClientSession, types
+from mcp.client.sse import sse_client
+from mcp.server import Server
+from mcp.shared.memory import create_connected_server_and_client_session
+from llama_index.core.tools import FunctionTool
+from llama_index.tools.mcp import McpToolSpec
+
+from util import tracer
+
+DEFAULT_SERVERS = "http://localhost:8081/sse,http://localhost:8082/sse"
+# `memory:<module>` in MCP_SERVERS serves the FastMCP `mcp` of that module in this process
+MEMORY_SCHEME = "memory:"
+# Tools the app calls itself through call_tool, left out of the tool list given to the LLM
+INTERNAL_TOOLS = {"get_data_version"}
+
+
+def in_process_server(url: str) -> Server | None:
+    """The MCP server behind a `memory:<module>` url, e.g. memory:spb_server, None for a network url"""
+    if not url.startswith(MEMORY_SCHEME):
+        return None
+    module = importlib.import_module(url[len(MEMORY_SCHEME):])
+    return module.mcp._mcp_server
+
+
+class MCPServerConnection:
+    """A long-lived MCP session to one SSE server, or to an in-process server over memory streams.
+
+    The session is owned by a background task that reconnects with backoff and
+    pings the server periodically; requests from concurrent callers are
+    multiplexed over the same session.
+    """
+    def __init__(self, url: str, health_interval: float = 30, connect_timeout: float = 10, on_tools_changed=None,
+                 server: Server | None = None):
+        self.url = url
+        self.server = server
+        self.health_interval = health_interval
+        self.connect_timeout = connect_timeout
+        self.on_tools_changed = on_tools_changed
+        self.session: ClientSession | None = None
+        self.__ready = asyncio.Event()
+        self.__reconnect = asyncio.Event()
+        self.__task: asyncio.Task | None = None
+        self.__closing = False
+
+    async def __handle_message(self, message):
+        if isinstance(message, types.ServerNotification) and isinstance(message.root, types.ToolListChangedNotification):
+            logging.info(f"Tool list changed on {self.url}")
+            if self.on_tools_changed:
+                self.on_tools_changed()
+
+    async def __health_check(self, session: ClientSession):
+        while not self.__reconnect.is_set():
+            try:
+                await asyncio.wait_for(self.__reconnect.wait(), timeout=self.health_interval)
+            except asyncio.TimeoutError:
+                try:
+                    await asyncio.wait_for(session.send_ping(), timeout=self.connect_timeout)
+                except Exception as e:
+                    logging.warning(f"MCP server {self.url} health check failed: {e}")
+                    return
+
+    @asynccontextmanager
+    async def __open_session(self):
+        if self.server is not None:
+            # No HTTP or JSON encoding, the server runs as a task of this connection
+            async with create_connected_server_and_client_session(self.server, message_handler=self.__handle_message) as session:
+                yield session
+            return
+        async with sse_client(self.url, timeout=self.connect_timeout) as (read_stream, write_stream):
+            async with ClientSession(read_stream, write_stream, message_handler=self.__handle_message) as session:
+                await session.initialize()
+                yield session
+
+    async def __run(self):
+        delay = 1
+        while not self.__closing:
+            try:
+                async with self.__open_session() as session:
+                    logging.info(f"Connected to MCP server {self.url}")
+                    self.session = session
+                    self.__ready.set()
+                    delay = 1
+                    await self.__health_check(session)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"MCP server {self.url} connection error: {e}")
+            finally:
+                self.session = None
+                self.__ready.clear()
+                self.__reconnect.clear()
+            if not self.__closing:
+                logging.info(f"Reconnecting to MCP server {self.url} in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    def start(self):
+        if self.__task is None:
+            self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        self.__closing = True
+        if self.__task:
+            self.__task.cancel()
+            try:
+                await self.__task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self.__task = None
+
+    def reconnect(self):
+        self.__reconnect.set()
+
+    @property
+    def ready(self) -> bool:
+        return self.__ready.is_set()
+
+    async def __session(self) -> ClientSession:
+        try:
+            await asyncio.wait_for(self.__ready.wait(), timeout=self.connect_timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError(f"MCP server {self.url} is not available")
+        return self.session
+
+    async def list_tools(self) -> types.ListToolsResult:
+        session = await self.__session()
+        return await session.list_tools()
+
+    async def call_tool(self, tool_name: str, arguments: dict | None = None) -> types.CallToolResult:
+        with tracer.span("mcp.call_tool", tool=tool_name, server=self.url) as span:
+            session = await self.__session()
+            # The trace context travels in the request _meta, see util.tracing.instrument_mcp_server
+            request = types.ClientRequest(types.CallToolRequest(
+                method="tools/call",
+                params=types.CallToolRequestParams(
+                    name=tool_name,
+                    arguments=arguments,
+                    _meta=types.RequestParams.Meta(**(tracer.context() or {})),
+                ),
+            ))
+            try:
+                result = await session.send_request(request, types.CallToolResult)
+            except (ConnectionError, OSError) as e:
+                logging.warning(f"MCP call {tool_name} on {self.url} failed: {e}")
+                self.reconnect()
+                raise
+            if result.isError:
+                span.set(is_error=True)
+            return result
+
+
+class MCPClientManager:
+    """Keeps warm MCP sessions and caches the tool list built from them.
+
+    The cached tools are rebuilt when a server notifies a tool list change or
+    after `tools_ttl` seconds, and are shared by all concurrent requests.
+    """
+    def __init__(self, urls: list[str] | None = None, tools_ttl: float = 300, health_interval: float = 30):
+        if urls is None:
+            urls = [url.strip() for url in os.getenv("MCP_SERVERS", DEFAULT_SERVERS).split(",") if url.strip()]
+        self.connections = [
+            MCPServerConnection(url, health_interval=health_interval, on_tools_changed=self.invalidate, server=in_process_server(url))
+            for url in urls
+        ]
+        self.tools_ttl = tools_ttl
+        self.__tools: list[FunctionTool] | None = None
+        self.__tools_time = 0.0
+        self.__tool_conn: dict[str, MCPServerConnection] = {}
+        self.__lock = asyncio.Lock()
+
+    async def start(self):
+        for conn in self.connections:
+            conn.start()
+
+    async def stop(self):
+        await asyncio.gather(*(conn.stop() for conn in self.connections))
+
+    def invalidate(self):
+        self.__tools = None
+
+    def status(self) -> dict[str, bool]:
+        """Whether each server currently has a live session"""
+        return {conn.url: conn.ready for conn in self.connections}
+
+    async def get_tools(self) -> list[FunctionTool]:
+        if self.__tools is not None and time.monotonic() - self.__tools_time < self.tools_ttl:
+            return self.__tools
+
+        async with self.__lock:
+            if self.__tools is not None and time.monotonic() - self.__tools_time < self.tools_ttl:
+                return self.__tools
+            start_time = time.monotonic()
+            all_tools = []
+            tool_conn = {}
+            complete = True
+            for conn in self.connections:
+                try:
+                    tools = await McpToolSpec(client=conn).to_tool_list_async()
+                except Exception as e:
+                    logging.error(f"Failed to list tools from {conn.url}: {e}")
+                    complete = False
+                    continue
+                all_tools.extend(tool for tool in tools if tool.metadata.name not in INTERNAL_TOOLS)
+                tool_conn.update({tool.metadata.name: conn for tool in tools})
+            self.__tool_conn = tool_conn
+            # Do not cache a partial list, retry the missing server on the next request
+            if complete:
+                self.__tools = all_tools
+                self.__tools_time = time.monotonic()
+            logging.info(f"Loaded {len(all_tools)} MCP tools in {time.monotonic() - start_time:.2f} seconds")
+            return all_tools
+
+    async def call_tool(self, tool_name: str, arguments: dict[str, Any] | None = None) -> types.CallToolResult:
+        if tool_name not in self.__tool_conn:
+            await self.get_tools()
+        conn = self.__tool_conn.get(tool_name)
+        if conn is None:
+            raise ValueError(f"Tool {tool_name} not found")
+        return await conn.call_tool(tool_name, arguments)
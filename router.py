@@ -0,0 +1,174 @@
+import os
+import re
+import json
+import logging
+from dataclasses import dataclass, field
+
+from util import load_json_prompt
+
+# Questions with any of these words need the data analysis pipeline
+COMPLEX_PATTERN = re.compile(
+    r"history|trend|analy[sz]|report|average|\bavg\b|compare|statistic|summar|past|last\s+\d|today|yesterday|week|month|hour|alias|knowledge|diagnos|why|"
+    r"历史|趋势|分析|报告|平均|对比|比较|统计|总结|过去|最近|今天|昨天|一周|本周|每天|小时|别名|知识库|诊断|为什么"
+)
+LATEST_PATTERN = re.compile(r"latest|current|\bnow\b|real.?time|最新|当前|现在|实时")
+STATUS_PATTERN = re.compile(r"online|offline|status|state|在线|离线|状态")
+TREE_PATTERN = re.compile(r"\btree\b|list\s+(all\s+)?(devices|tags)|which\s+devices|what\s+devices|树|列出|有哪些设备|有哪些点位")
+ERROR_CODE_PATTERN = re.compile(r"(?<!\d)(\d{5})(?!\d)")
+ERROR_WORD_PATTERN = re.compile(r"error|fault|alarm|code|错误|故障|报警|代码")
+TAG_PATTERN = re.compile(r"([A-Za-z_][\w]*/[A-Za-z_][\w]*)")
+# "device modbus", "设备modbus"; the word after "device" can also be part of the question, e.g. "device status"
+DEVICE_PATTERN = re.compile(r"(?:\bdevice\s+|设备\s*)([A-Za-z_][A-Za-z0-9_\-]*)", re.IGNORECASE)
+DEVICE_STOPWORDS = {
+    "status", "state", "online", "offline", "tree", "tag", "tags", "value", "values", "list", "name", "names",
+    "is", "are", "was", "the", "a", "an", "of", "in", "on", "for", "with", "and", "or", "has", "have", "now",
+    "current", "latest", "info", "information", "data", "error", "code", "alarm", "alarms",
+}
+
+TAG_KEYWORDS = {
+    "voltage": re.compile(r"voltage|电压"),
+    "amper": re.compile(r"amper|ampere|电流"),
+    "error_code": re.compile(r"error.?code|错误码|错误代码|故障码"),
+}
+
+
+@dataclass
+class Intent:
+    name: str
+    device: str | None = None
+    tags: list[str] = field(default_factory=list)
+    code: str | None = None
+
+
+def classify(prompt: str, max_length: int = 80) -> Intent | None:
+    """Match a prompt to one of the simple question shapes, None if it needs the full pipeline"""
+    text = prompt.strip().lower()
+    # tag paths are left out of the check, e.g. diagnose/error_code is not a diagnosis question
+    if not text or len(text) > max_length or COMPLEX_PATTERN.search(TAG_PATTERN.sub(" ", text)):
+        return None
+
+    device = next((name for name in DEVICE_PATTERN.findall(prompt) if name.lower() not in DEVICE_STOPWORDS), None)
+
+    code_match = ERROR_CODE_PATTERN.search(text)
+    if code_match and ERROR_WORD_PATTERN.search(text) and not LATEST_PATTERN.search(text):
+        return Intent("error_code", code=code_match.group(1))
+
+    tags = TAG_PATTERN.findall(prompt)
+    if not tags:
+        tags = [key for key, pattern in TAG_KEYWORDS.items() if pattern.search(text)]
+    if tags and LATEST_PATTERN.search(text):
+        return Intent("latest_value", device=device, tags=tags)
+
+    # "which devices are online" asks for the status of all devices, not for the tree
+    if not tags and STATUS_PATTERN.search(text):
+        return Intent("device_status", device=device)
+
+    if TREE_PATTERN.search(text):
+        return Intent("tree", device=device)
+    return None
+
+
+def parse_tree(tree: str) -> dict[str, dict[str, str]]:
+    """Parse the get_spb_tree output into {device: {tag: value}}"""
+    devices: dict[str, dict[str, str]] = {}
+    device = None
+    for line in tree.splitlines():
+        stripped = line.lstrip("| ")
+        if not stripped.startswith("-- "):
+            continue
+        item = stripped[3:]
+        if ", " in item:
+            if device is not None:
+                tag, value = item.split(", ", 1)
+                devices[device][tag] = value
+        else:
+            # group and node lines are replaced by the device line that follows them
+            device = item
+            devices.setdefault(device, {})
+    return {name: tags for name, tags in devices.items() if tags}
+
+
+def tool_text(result) -> list[str]:
+    return [content.text for content in result.content if hasattr(content, "text")]
+
+
+class FastPathRouter:
+    """Answer simple questions by calling MCP tools directly and filling a template.
+
+    Latest value, device status, tree listing and error code lookup skip the
+    agent loop and the report LLM call; everything else returns None and goes
+    through DemoFlow.
+    """
+    def __init__(self, mcp_manager, enabled: bool | None = None):
+        self.mcp_manager = mcp_manager
+        if enabled is None:
+            enabled = os.getenv("FAST_PATH", "true").lower() == "true"
+        self.enabled = enabled
+
+    async def answer(self, prompt: str, lang: str = "zh") -> str | None:
+        if not self.enabled:
+            return None
+        intent = classify(prompt)
+        if intent is None:
+            return None
+
+        templates = load_json_prompt("router.json", lang)
+        try:
+            if intent.name == "latest_value":
+                answer = await self.__latest_value(intent, templates)
+            elif intent.name == "device_status":
+                answer = await self.__device_status(intent, templates)
+            elif intent.name == "tree":
+                answer = await self.__tree(intent, templates)
+            else:
+                answer = await self.__error_code(intent, templates)
+        except Exception as e:
+            logging.warning(f"Fast path {intent.name} failed, fall back to workflow: {e}")
+            return None
+        if answer is not None:
+            logging.info(f"Fast path {intent.name} answered: {prompt}")
+        return answer
+
+    async def __call(self, tool: str, arguments: dict) -> list[str]:
+        result = await self.mcp_manager.call_tool(tool, arguments)
+        if result.isError:
+            raise RuntimeError(f"{tool} failed: {tool_text(result)}")
+        return tool_text(result)
+
+    async def __latest_value(self, intent: Intent, templates: dict) -> str | None:
+        devices = parse_tree("\n".join(await self.__call("get_spb_tree", {})))
+        if intent.device:
+            devices = {name: tags for name, tags in devices.items() if name == intent.device}
+        lines = []
+        for device, tags in devices.items():
+            for tag, value in tags.items():
+                if any(tag == wanted or tag.endswith("/" + wanted) for wanted in intent.tags):
+                    lines.append(templates["latest_value_line"].format(device=device, tag=tag, value=value))
+        if not lines:
+            return None
+        return templates["latest_value"] + "\n\n" + "\n".join(lines) + "\n"
+
+    async def __device_status(self, intent: Intent, templates: dict) -> str | None:
+        sql = "SELECT device, LAST(ts) AS ts, LAST(status) AS status FROM devices"
+        if intent.device:
+            sql += f" WHERE device = '{intent.device}'"
+        sql += " GROUP BY device"
+        rows = [json.loads(text) for text in await self.__call("get_device_status_by_sql", {"sql": sql})
+                if text.startswith("{")]
+        if not rows:
+            return None
+        lines = [templates["device_status_line"].format(**row) for row in rows]
+        return templates["device_status"] + "\n\n" + "\n".join(lines) + "\n"
+
+    async def __tree(self, intent: Intent, templates: dict) -> str | None:
+        arguments = {"device": intent.device} if intent.device else {}
+        tree = "\n".join(await self.__call("get_spb_tree", arguments))
+        if not tree.strip() or tree.strip() == "device not found":
+            return None
+        return templates["tree"] + "\n\n```\n" + tree + "\n```\n"
+
+    async def __error_code(self, intent: Intent, templates: dict) -> str | None:
+        info = "\n".join(await self.__call("search_error_info_by_code", {"query": intent.code}))
+        if not info.strip() or info.strip() == "Empty Response":
+            return None
+        return templates["error_code"].format(code=intent.code) + "\n\n" + info + "\n"
@@ -0,0 +1,283 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from llama_index.core.memory import ChatMemoryBuffer
+from llama_index.core.llms import ChatMessage
+
+MEMORY_TOKEN_LIMIT = 64000
+
+
+def dump_memory(memory: ChatMemoryBuffer) -> str:
+    """Serialize the chat history of a memory to compact JSON, only role, content and non-empty additional_kwargs are kept"""
+    messages = []
+    for message in memory.get_all():
+        item = {"role": message.role.value, "content": message.content}
+        if message.additional_kwargs:
+            item["additional_kwargs"] = message.additional_kwargs
+        messages.append(item)
+    return json.dumps(messages, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def load_memory(data: str | bytes, token_limit: int = MEMORY_TOKEN_LIMIT) -> ChatMemoryBuffer:
+    messages = [ChatMessage(**item) for item in json.loads(data)]
+    return ChatMemoryBuffer.from_defaults(chat_history=messages, token_limit=token_limit)
+
+
+class SessionBackend(ABC):
+    """Storage of session memories with last access time and token count.
+
+    Implementations must be safe to share between the workers of main.py when
+    `shared` is True.
+    """
+    shared = False
+
+    @abstractmethod
+    def load(self, session_id: str, timeout: float) -> Optional[ChatMemoryBuffer]:
+        """Return the memory and refresh its access time, None if missing or idle for longer than timeout"""
+
+    @abstractmethod
+    def save(self, session_id: str, memory: ChatMemoryBuffer, tokens: int):
+        pass
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        pass
+
+    @abstractmethod
+    def expire(self, timeout: float) -> int:
+        """Remove sessions idle for longer than timeout, return the number removed"""
+
+    @abstractmethod
+    def evict(self, max_sessions: int, max_total_tokens: int, keep: str) -> list[str]:
+        """Remove least recently used sessions until within budget, never removing `keep`"""
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(SessionBackend):
+    """In-process backend, memories are kept as live objects without serialization"""
+    def __init__(self):
+        self.sessions: "OrderedDict[str, tuple[ChatMemoryBuffer, float]]" = OrderedDict()
+        self.session_tokens: Dict[str, int] = {}
+        self.total_tokens = 0
+
+    def load(self, session_id: str, timeout: float) -> Optional[ChatMemoryBuffer]:
+        if session_id not in self.sessions:
+            return None
+
+        memory, last_access = self.sessions[session_id]
+        if time.time() - last_access > timeout:
+            self.delete(session_id)
+            return None
+
+        self.sessions[session_id] = (memory, time.time())
+        self.sessions.move_to_end(session_id)
+        return memory
+
+    def save(self, session_id: str, memory: ChatMemoryBuffer, tokens: int):
+        self.total_tokens += tokens - self.session_tokens.get(session_id, 0)
+        self.session_tokens[session_id] = tokens
+        self.sessions[session_id] = (memory, time.time())
+        self.sessions.move_to_end(session_id)
+
+    def delete(self, session_id: str):
+        self.sessions.pop(session_id, None)
+        self.total_tokens -= self.session_tokens.pop(session_id, 0)
+
+    def expire(self, timeout: float) -> int:
+        current_time = time.time()
+        expired = [
+            sid for sid, (_, last_access) in self.sessions.items()
+            if current_time - last_access > timeout
+        ]
+        for sid in expired:
+            self.delete(sid)
+        return len(expired)
+
+    def evict(self, max_sessions: int, max_total_tokens: int, keep: str) -> list[str]:
+        evicted = []
+        while len(self.sessions) > 1 and (len(self.sessions) > max_sessions or self.total_tokens > max_total_tokens):
+            sid = next(iter(self.sessions))
+            if sid == keep:
+                self.sessions.move_to_end(sid)
+                continue
+            self.delete(sid)
+            evicted.append(sid)
+        return evicted
+
+
+class SQLiteBackend(SessionBackend):
+    """Local file backend, lets several main.py workers on one host share sessions"""
+    shared = True
+
+    def __init__(self, path: str = "./storage/sessions.db", token_limit: int = MEMORY_TOKEN_LIMIT):
+        self.token_limit = token_limit
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            messages TEXT NOT NULL,
+            tokens INTEGER NOT NULL,
+            last_access REAL NOT NULL)
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+
+    def load(self, session_id: str, timeout: float) -> Optional[ChatMemoryBuffer]:
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT messages FROM sessions WHERE session_id = ? AND last_access >= ?",
+                (session_id, now - timeout)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (now, session_id))
+        return load_memory(row[0], self.token_limit)
+
+    def save(self, session_id: str, memory: ChatMemoryBuffer, tokens: int):
+        data = dump_memory(memory)
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO sessions (session_id, messages, tokens, last_access) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET messages = excluded.messages, tokens = excluded.tokens, last_access = excluded.last_access",
+                (session_id, data, tokens, time.time()))
+
+    def delete(self, session_id: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def expire(self, timeout: float) -> int:
+        with self.lock:
+            cursor = self.conn.execute("DELETE FROM sessions WHERE last_access < ?", (time.time() - timeout,))
+        return cursor.rowcount
+
+    def evict(self, max_sessions: int, max_total_tokens: int, keep: str) -> list[str]:
+        evicted = []
+        with self.lock:
+            count, total = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM sessions").fetchone()
+            if count <= max_sessions and total <= max_total_tokens:
+                return evicted
+            rows = self.conn.execute(
+                "SELECT session_id, tokens FROM sessions WHERE session_id != ? ORDER BY last_access", (keep,))
+            for sid, tokens in rows.fetchall():
+                if count <= max_sessions and total <= max_total_tokens:
+                    break
+                evicted.append(sid)
+                count -= 1
+                total -= tokens
+            self.conn.executemany("DELETE FROM sessions WHERE session_id = ?", [(sid,) for sid in evicted])
+        return evicted
+
+    def close(self):
+        self.conn.close()
+
+
+class RedisBackend(SessionBackend):
+    """Redis compatible backend, lets main.py instances on several hosts share sessions.
+
+    Each session is a string key with a TTL of the session timeout, the access
+    order and token counts are kept in a sorted set and a hash for eviction.
+    """
+    shared = True
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "spb:session:",
+                 session_timeout: int = 3600, token_limit: int = MEMORY_TOKEN_LIMIT, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("RedisBackend requires the redis package, install it with `uv sync --extra redis`")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.session_timeout = session_timeout
+        self.token_limit = token_limit
+        self.access_key = f"{prefix}access"
+        self.tokens_key = f"{prefix}tokens"
+
+    def __key(self, session_id: str) -> str:
+        return f"{self.prefix}data:{session_id}"
+
+    def load(self, session_id: str, timeout: float) -> Optional[ChatMemoryBuffer]:
+        data = self.client.get(self.__key(session_id))
+        if data is None:
+            return None
+        last_access = self.client.zscore(self.access_key, session_id)
+        if last_access is not None and time.time() - float(last_access) > timeout:
+            self.delete(session_id)
+            return None
+        pipe = self.client.pipeline()
+        pipe.expire(self.__key(session_id), int(self.session_timeout))
+        pipe.zadd(self.access_key, {session_id: time.time()})
+        pipe.execute()
+        return load_memory(data, self.token_limit)
+
+    def save(self, session_id: str, memory: ChatMemoryBuffer, tokens: int):
+        pipe = self.client.pipeline()
+        pipe.set(self.__key(session_id), dump_memory(memory), ex=int(self.session_timeout))
+        pipe.zadd(self.access_key, {session_id: time.time()})
+        pipe.hset(self.tokens_key, session_id, tokens)
+        pipe.execute()
+
+    def delete(self, session_id: str):
+        pipe = self.client.pipeline()
+        pipe.delete(self.__key(session_id))
+        pipe.zrem(self.access_key, session_id)
+        pipe.hdel(self.tokens_key, session_id)
+        pipe.execute()
+
+    def expire(self, timeout: float) -> int:
+        # Session data expires by TTL, only the bookkeeping entries need to be removed
+        expired = self.client.zrangebyscore(self.access_key, "-inf", time.time() - timeout)
+        for sid in expired:
+            self.delete(sid.decode() if isinstance(sid, bytes) else sid)
+        return len(expired)
+
+    def evict(self, max_sessions: int, max_total_tokens: int, keep: str) -> list[str]:
+        count = self.client.zcard(self.access_key)
+        tokens = {
+            (k.decode() if isinstance(k, bytes) else k): int(v)
+            for k, v in self.client.hgetall(self.tokens_key).items()
+        }
+        total = sum(tokens.values())
+        evicted = []
+        if count <= max_sessions and total <= max_total_tokens:
+            return evicted
+        for sid in self.client.zrange(self.access_key, 0, -1):
+            sid = sid.decode() if isinstance(sid, bytes) else sid
+            if count <= max_sessions and total <= max_total_tokens:
+                break
+            if sid == keep:
+                continue
+            self.delete(sid)
+            evicted.append(sid)
+            count -= 1
+            total -= tokens.get(sid, 0)
+        return evicted
+
+    def close(self):
+        self.client.close()
+
+
+def create_backend(name: str | None = None, session_timeout: int = 3600) -> SessionBackend:
+    """Create the session backend selected by SESSION_BACKEND: memory (default), sqlite or redis"""
+    name = (name or os.getenv("SESSION_BACKEND", "memory")).lower()
+    if name == "sqlite":
+        path = os.getenv("SESSION_SQLITE_PATH", "./storage/sessions.db")
+        logging.info(f"Using SQLite session backend: {path}")
+        return SQLiteBackend(path)
+    if name == "redis":
+        url = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+        logging.info(f"Using Redis session backend: {url}")
+        return RedisBackend(url, session_timeout=session_timeout)
+    return MemoryBackend()
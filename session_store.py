@@ -1,37 +1,121 @@
-from typing import Dict, Optional
+from typing import Optional
 from llama_index.core.memory import ChatMemoryBuffer
-import time
+from llama_index.core.llms import ChatMessage, MessageRole
+import asyncio
+import logging
+
+from session_backend import SessionBackend, MemoryBackend
+
+SUMMARY_PREFIX = "Summary of earlier conversation:"
 
 class SessionStore:
-    def __init__(self, session_timeout: int = 3600):  # 1 hour default timeout
-        self.sessions: Dict[str, tuple[ChatMemoryBuffer, float]] = {}
+    def __init__(
+            self,
+            session_timeout: int = 3600,  # 1 hour default timeout
+            max_sessions: int = 1000,
+            max_total_tokens: int = 2_000_000,
+            compact_threshold: int = 16000,
+            keep_recent_messages: int = 6,
+            summary_chars: int = 300,
+            backend: Optional[SessionBackend] = None):
+        self.backend = backend if backend is not None else MemoryBackend()
         self.session_timeout = session_timeout
-    
+        self.max_sessions = max_sessions
+        self.max_total_tokens = max_total_tokens
+        self.compact_threshold = compact_threshold
+        self.keep_recent_messages = keep_recent_messages
+        self.summary_chars = summary_chars
+        self._expiry_task: Optional[asyncio.Task] = None
+
     def get_memory(self, session_id: str) -> Optional[ChatMemoryBuffer]:
         """Get memory for a session, return None if session expired or doesn't exist"""
-        if session_id not in self.sessions:
-            return None
-        
-        memory, last_access = self.sessions[session_id]
-        if time.time() - last_access > self.session_timeout:
-            # Session expired
-            del self.sessions[session_id]
-            return None
-            
-        # Update last access time
-        self.sessions[session_id] = (memory, time.time())
-        return memory
-    
+        return self.backend.load(session_id, self.session_timeout)
+
     def save_memory(self, session_id: str, memory: ChatMemoryBuffer):
-        """Save or update memory for a session"""
-        self.sessions[session_id] = (memory, time.time())
-    
+        """Save or update memory for a session, compact it and evict least recently used sessions over budget"""
+        self.compact(memory)
+        self.backend.save(session_id, memory, self._count_tokens(memory))
+
+        evicted = self.backend.evict(self.max_sessions, self.max_total_tokens, keep=session_id)
+        if evicted:
+            logging.info(f"Evicted {len(evicted)} sessions over budget")
+
     def cleanup_expired(self):
         """Remove expired sessions"""
-        current_time = time.time()
-        expired = [
-            sid for sid, (_, last_access) in self.sessions.items() 
-            if current_time - last_access > self.session_timeout
-        ]
-        for sid in expired:
-            del self.sessions[sid] 
\ No newline at end of file
+        expired = self.backend.expire(self.session_timeout)
+        if expired:
+            logging.info(f"Removed {expired} expired sessions")
+
+    async def _expire_periodically(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.cleanup_expired()
+            except Exception as e:
+                logging.error(f"Session cleanup failed: {e}")
+
+    def start(self, interval: float = 60):
+        """Schedule cleanup_expired on the running event loop"""
+        if self._expiry_task is None:
+            self._expiry_task = asyncio.create_task(self._expire_periodically(interval))
+
+    async def stop(self):
+        if self._expiry_task is not None:
+            self._expiry_task.cancel()
+            try:
+                await self._expiry_task
+            except asyncio.CancelledError:
+                pass
+            self._expiry_task = None
+        self.backend.close()
+
+    def compact(self, memory: ChatMemoryBuffer):
+        """Drop repeated system messages and fold old turns into a summary once the history is over compact_threshold tokens"""
+        messages = dedup_system_messages(memory.get_all())
+        if self._count_messages(memory, messages) > self.compact_threshold:
+            system = [m for m in messages if m.role == MessageRole.SYSTEM and not is_summary(m)]
+            rest = [m for m in messages if m.role != MessageRole.SYSTEM or is_summary(m)]
+            if len(rest) > self.keep_recent_messages:
+                old, recent = rest[:-self.keep_recent_messages], rest[-self.keep_recent_messages:]
+                messages = system + [summarize_messages(old, self.summary_chars)] + recent
+        memory.set(messages)
+
+    def _count_tokens(self, memory: ChatMemoryBuffer) -> int:
+        return self._count_messages(memory, memory.get_all())
+
+    @staticmethod
+    def _count_messages(memory: ChatMemoryBuffer, messages: list[ChatMessage]) -> int:
+        return sum(len(memory.tokenizer_fn(str(m.content or ""))) for m in messages)
+
+
+def is_summary(message: ChatMessage) -> bool:
+    return message.role == MessageRole.SYSTEM and str(message.content or "").startswith(SUMMARY_PREFIX)
+
+
+def dedup_system_messages(messages: list[ChatMessage]) -> list[ChatMessage]:
+    """Keep only the latest copy of identical system messages"""
+    seen = set()
+    result = []
+    for message in reversed(messages):
+        if message.role == MessageRole.SYSTEM:
+            if message.content in seen:
+                continue
+            seen.add(message.content)
+        result.append(message)
+    result.reverse()
+    return result
+
+
+def summarize_messages(messages: list[ChatMessage], max_chars: int, max_lines: int = 50) -> ChatMessage:
+    """Fold messages into one system message, each clipped to max_chars; earlier summaries are carried over up to max_lines"""
+    lines = []
+    for message in messages:
+        content = str(message.content or "")
+        if is_summary(message):
+            lines.extend(content.splitlines()[1:])
+            continue
+        content = " ".join(content.split())
+        if len(content) > max_chars:
+            content = content[:max_chars] + "..."
+        lines.append(f"- {message.role.value}: {content}")
+    return ChatMessage(role=MessageRole.SYSTEM, content="\n".join([SUMMARY_PREFIX] + lines[-max_lines:]))
@@ -0,0 +1,260 @@
+import json
+import logging
+import operator
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable
+
+from pandas import Timedelta, Timestamp
+
+RAISED = "raised"
+CLEARED = "cleared"
+
+OPERATORS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le, "==": operator.eq, "!=": operator.ne}
+
+
+def to_number(value: str) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class AlarmEvent:
+    ts: Timestamp
+    device: str
+    tag: str
+    rule: str
+    severity: str
+    state: str
+    value: str
+    message: str
+
+
+class Rule(ABC):
+    """An alarm condition on the values of one tag, for one device or all of them (`*`).
+
+    `check` gets the per device/tag state returned by `new_state` and one sample,
+    and returns a message while the condition holds, None otherwise.
+    """
+    def __init__(self, name: str, tag: str, device: str = "*", severity: str = "warning"):
+        self.name = name
+        self.tag = tag
+        self.device = device
+        self.severity = severity
+
+    def matches(self, device: str, tag: str) -> bool:
+        return tag == self.tag and self.device in ("*", device)
+
+    def new_state(self):
+        return None
+
+    def alarm_key(self, value: float):
+        """Identifies an active alarm, a different key while active raises it again"""
+        return True
+
+    @abstractmethod
+    def check(self, state, ts: float, value: float) -> str | None:
+        pass
+
+
+class ThresholdRule(Rule):
+    """The value compared with `limit`, e.g. voltage > 230 or error_code != 0.
+
+    With `per_value` every new abnormal value raises again, e.g. each new error code.
+    """
+    def __init__(self, name: str, tag: str, op: str, limit: float, per_value: bool = False, **kwargs):
+        super().__init__(name, tag, **kwargs)
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown operator {op} in rule {name}")
+        self.op = op
+        self.limit = float(limit)
+        self.per_value = per_value
+
+    def alarm_key(self, value: float):
+        return value if self.per_value else True
+
+    def check(self, state, ts: float, value: float) -> str | None:
+        if OPERATORS[self.op](value, self.limit):
+            return f"{self.tag} {value:g} {self.op} {self.limit:g}"
+        return None
+
+
+class RateOfChangeRule(Rule):
+    """The absolute change per second between two samples above `max_rate`"""
+    def __init__(self, name: str, tag: str, max_rate: float, **kwargs):
+        super().__init__(name, tag, **kwargs)
+        self.max_rate = float(max_rate)
+
+    def new_state(self):
+        return {"ts": None, "value": None}
+
+    def check(self, state, ts: float, value: float) -> str | None:
+        last_ts, last_value = state["ts"], state["value"]
+        state["ts"], state["value"] = ts, value
+        if last_ts is None or ts <= last_ts:
+            return None
+        rate = abs(value - last_value) / (ts - last_ts)
+        if rate > self.max_rate:
+            return f"{self.tag} changed {rate:.3g}/s, more than {self.max_rate:g}/s"
+        return None
+
+
+class WindowAverageRule(Rule):
+    """The average of the samples in the last `window` seconds compared with `limit`.
+
+    The window keeps a running sum, each sample is added and dropped once.
+    """
+    def __init__(self, name: str, tag: str, window: float, op: str, limit: float, min_samples: int = 1, **kwargs):
+        super().__init__(name, tag, **kwargs)
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown operator {op} in rule {name}")
+        self.window = float(window)
+        self.op = op
+        self.limit = float(limit)
+        self.min_samples = min_samples
+
+    def new_state(self):
+        return {"samples": deque(), "sum": 0.0}
+
+    def check(self, state, ts: float, value: float) -> str | None:
+        samples = state["samples"]
+        samples.append((ts, value))
+        state["sum"] += value
+        while samples[0][0] <= ts - self.window:
+            state["sum"] -= samples.popleft()[1]
+        if len(samples) < self.min_samples:
+            return None
+        average = state["sum"] / len(samples)
+        if OPERATORS[self.op](average, self.limit):
+            return f"{self.tag} {self.window:g}s average {average:.4g} {self.op} {self.limit:g}"
+        return None
+
+
+class StuckValueRule(Rule):
+    """The same value for at least `duration` seconds, e.g. a frozen sensor; checked when samples arrive"""
+    def __init__(self, name: str, tag: str, duration: float, tolerance: float = 0.0, **kwargs):
+        super().__init__(name, tag, **kwargs)
+        self.duration = float(duration)
+        self.tolerance = float(tolerance)
+
+    def new_state(self):
+        return {"since": None, "value": None}
+
+    def check(self, state, ts: float, value: float) -> str | None:
+        if state["since"] is None or abs(value - state["value"]) > self.tolerance:
+            state["since"], state["value"] = ts, value
+            return None
+        if ts - state["since"] >= self.duration:
+            return f"{self.tag} stuck at {value:g} for {ts - state['since']:.0f}s"
+        return None
+
+
+RULE_TYPES = {
+    "threshold": ThresholdRule,
+    "rate_of_change": RateOfChangeRule,
+    "window_average": WindowAverageRule,
+    "stuck_value": StuckValueRule,
+}
+
+
+def load_rules(path: str) -> list[Rule]:
+    """Rules from a JSON list, e.g. [{"type": "threshold", "name": "overvoltage", "tag": "robotic_arm/voltage", "op": ">", "limit": 230}]"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            configs = json.load(f)
+    except FileNotFoundError:
+        logging.info(f"No alarm rules file {path}, alarms are disabled")
+        return []
+    rules = []
+    for config in configs:
+        config = dict(config)
+        kind = config.pop("type", None)
+        if kind not in RULE_TYPES:
+            raise ValueError(f"Unknown alarm rule type {kind}, expected one of {', '.join(RULE_TYPES)}")
+        rules.append(RULE_TYPES[kind](**config))
+    logging.info(f"Loaded {len(rules)} alarm rules from {path}")
+    return rules
+
+
+class Series:
+    """A rule applied to one device tag, with its window state and the key of its active alarm"""
+    __slots__ = ("rule", "state", "active")
+
+    def __init__(self, rule: Rule):
+        self.rule = rule
+        self.state = rule.new_state()
+        self.active = None
+
+
+class AlarmEngine:
+    """Evaluates the alarm rules on every decoded tag value.
+
+    An event is emitted when a condition starts to hold (raised) and when it
+    stops (cleared), not for every abnormal sample. The rules of a device tag
+    are looked up once and kept with their state, a sample costs O(1) per rule.
+    Samples come from the MQTT thread and `active` is read from the event loop,
+    the state is guarded by a lock that is not held while the sink stores events.
+    """
+    def __init__(self, rules: list[Rule], sink: Callable[[AlarmEvent], None] | None = None):
+        self.rules = rules
+        self.sink = sink
+        self.__series: dict[tuple[str, str], list[Series]] = {}
+        self.__last_ms = 0
+        self.__lock = threading.Lock()
+
+    def active(self) -> list[dict]:
+        with self.__lock:
+            return [
+                {"device": device, "tag": tag, "rule": series.rule.name, "severity": series.rule.severity}
+                for (device, tag), series_list in self.__series.items() for series in series_list if series.active is not None
+            ]
+
+    def __event_ts(self, ts: Timestamp) -> Timestamp:
+        """`ts`, moved forward when needed to a later millisecond than the previous event.
+
+        alarms is a plain table keyed by ts and TDengine overwrites a row with the same
+        millisecond, so the events of different devices and tags must not share one either.
+        """
+        ms = int(ts.timestamp() * 1000)
+        shift = max(0, self.__last_ms + 1 - ms)
+        self.__last_ms = ms + shift
+        return ts + Timedelta(milliseconds=shift)
+
+    def evaluate(self, device: str, tag: str, value: str, ts: Timestamp) -> list[AlarmEvent]:
+        with self.__lock:
+            events = self.__check(device, tag, value, ts)
+        for event in events:
+            logging.warning(f"Alarm {event.rule} {event.state} on {device}: {event.message}")
+            if self.sink:
+                try:
+                    self.sink(event)
+                except Exception as e:
+                    logging.error(f"Failed to store alarm {event.rule} on {device}: {e}")
+        return events
+
+    def __check(self, device: str, tag: str, value: str, ts: Timestamp) -> list[AlarmEvent]:
+        series_list = self.__series.get((device, tag))
+        if series_list is None:
+            series_list = [Series(rule) for rule in self.rules if rule.matches(device, tag)]
+            self.__series[(device, tag)] = series_list
+        if not series_list:
+            return []
+        number = to_number(value)
+        if number is None:
+            return []
+        seconds = ts.timestamp()
+        events = []
+        for series in series_list:
+            message = series.rule.check(series.state, seconds, number)
+            key = series.rule.alarm_key(number) if message is not None else None
+            if key == series.active:
+                continue
+            series.active = key
+            state = RAISED if key is not None else CLEARED
+            events.append(AlarmEvent(self.__event_ts(ts), device, tag, series.rule.name, series.rule.severity, state, value,
+                                     message or f"{tag} back to normal"))
+        return events
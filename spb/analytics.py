@@ -0,0 +1,219 @@
+import math
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from pandas import Timestamp
+
+TIMEZONE = "Asia/Shanghai"
+# samples in the rolling z-score window and on each side of a change point
+DEFAULT_WINDOW = 30
+
+
+def significant(value: float, digits: int = 6) -> float | None:
+    if value is None or not math.isfinite(value):
+        return None
+    return float(f"{value:.{digits}g}")
+
+
+def to_time(seconds: float) -> str:
+    return Timestamp(seconds, unit="s", tz=TIMEZONE).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def load_series(table: pa.Table, tags: list[str]) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+    """(epoch seconds, values) per tag from an export table, non-numeric values dropped"""
+    series = {}
+    for tag in tags:
+        rows = table.filter(pc.and_(pc.equal(table["tag_name"], tag), pc.is_valid(table["value"])))
+        seconds = rows["ts"].cast(pa.int64()).to_numpy() / 1000.0
+        series[tag] = (seconds, rows["value"].to_numpy())
+    return series
+
+
+def describe(values: np.ndarray) -> dict:
+    return {
+        "count": int(values.size),
+        "min": significant(values.min()),
+        "max": significant(values.max()),
+        "mean": significant(values.mean()),
+        "std": significant(values.std()),
+        "first": significant(values[0]),
+        "last": significant(values[-1]),
+    }
+
+
+def trend(seconds: np.ndarray, values: np.ndarray) -> dict:
+    """Least squares line through the samples, slope per hour and how much of the variance it explains"""
+    if values.size < 3:
+        return {}
+    hours = (seconds - seconds[0]) / 3600.0
+    hours_centered = hours - hours.mean()
+    values_centered = values - values.mean()
+    sxx = np.dot(hours_centered, hours_centered)
+    if sxx == 0:
+        return {}
+    slope = np.dot(hours_centered, values_centered) / sxx
+    fitted_start = values.mean() - slope * hours.mean()
+    fitted_end = fitted_start + slope * hours[-1]
+    residual = values_centered - slope * hours_centered
+    sst = np.dot(values_centered, values_centered)
+    return {
+        "slope_per_hour": significant(slope),
+        "r2": significant(1 - np.dot(residual, residual) / sst) if sst else None,
+        "fitted_change": significant(fitted_end - fitted_start),
+        "fitted_change_pct": significant((fitted_end - fitted_start) / abs(fitted_start) * 100) if fitted_start else None,
+    }
+
+
+def rolling_zscores(values: np.ndarray, window: int) -> np.ndarray:
+    """z-score of every sample against the mean and std of the `window` samples before it, NaN for the first ones"""
+    z = np.full(values.size, np.nan)
+    if values.size <= window:
+        return z
+    # centered first, the cumulative sums of squares stay precise
+    centered = values - values.mean()
+    sums = np.concatenate(([0.0], np.cumsum(centered)))
+    squares = np.concatenate(([0.0], np.cumsum(centered * centered)))
+    mean = (sums[window:-1] - sums[:-window - 1]) / window
+    variance = (squares[window:-1] - squares[:-window - 1]) / window - mean * mean
+    std = np.sqrt(np.clip(variance, 0, None))
+    deviation = centered[window:] - mean
+    # a constant window has no spread, any step away from it counts as far out
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z[window:] = np.where(std > 1e-12, deviation / std, np.where(np.abs(deviation) > 1e-12, np.sign(deviation) * np.inf, 0.0))
+    return z
+
+
+def anomalies(seconds: np.ndarray, values: np.ndarray, window: int, threshold: float, top: int) -> dict:
+    z = rolling_zscores(values, window)
+    found = np.flatnonzero(np.abs(np.nan_to_num(z)) >= threshold)
+    worst = found[np.argsort(-np.abs(z[found]), kind="stable")[:top]]
+    return {
+        "count": int(found.size),
+        "window": window,
+        "threshold": threshold,
+        "top": [{"time": to_time(seconds[i]), "value": significant(values[i]), "z": significant(np.clip(z[i], -999, 999), 3)} for i in sorted(worst)],
+    }
+
+
+def change_point_segments(values: np.ndarray, max_points: int, window: int = DEFAULT_WINDOW,
+                          threshold: float = 6.0) -> list[tuple[int, float, float]]:
+    """Shifts of the level, where the mean of the `window` samples after a point differs from the one before.
+
+    The difference is scaled by the noise, estimated from the differences of
+    neighbouring samples so that the shifts do not inflate it; a slow drift or a
+    single spike barely moves a window mean and is left to trend and anomalies.
+    Returns (index, mean before, mean after) per shift, the means of the whole
+    segments between the shifts.
+    """
+    n = values.size
+    if n < 2 * window or max_points <= 0:
+        return []
+    centered = values - values.mean()
+    sums = np.concatenate(([0.0], np.cumsum(centered)))
+    differences = np.diff(centered)
+    noise = np.median(np.abs(differences)) / (0.6745 * math.sqrt(2)) or np.std(differences) / math.sqrt(2) or 1e-12
+    points = np.arange(window, n - window + 1)
+    shift = (sums[points + window] - 2 * sums[points] + sums[points - window]) / window
+    score = np.abs(shift) / (noise * math.sqrt(2 / window))
+    # the strongest point of every shift, the others within a window of it belong to the same shift
+    chosen = []
+    for i in np.flatnonzero(score >= threshold)[np.argsort(-score[score >= threshold], kind="stable")]:
+        if all(abs(points[i] - point) >= window for point in chosen):
+            chosen.append(int(points[i]))
+            if len(chosen) >= max_points:
+                break
+
+    chosen.sort()
+    bounds = [0, *chosen, n]
+    means = [float(values[bounds[i]:bounds[i + 1]].mean()) for i in range(len(bounds) - 1)]
+    return [(point, means[i], means[i + 1]) for i, point in enumerate(chosen)]
+
+
+def change_points(seconds: np.ndarray, values: np.ndarray, max_points: int, window: int = DEFAULT_WINDOW,
+                  threshold: float = 6.0) -> list[dict]:
+    return [
+        {"time": to_time(seconds[point]), "before_mean": significant(before), "after_mean": significant(after)}
+        for point, before, after in change_point_segments(values, max_points, window, threshold)
+    ]
+
+
+def bin_means(seconds: np.ndarray, values: np.ndarray, start: float, width: float, bins: int) -> np.ndarray:
+    index = np.clip(((seconds - start) / width).astype(np.int64), 0, bins - 1)
+    counts = np.bincount(index, minlength=bins)
+    totals = np.bincount(index, weights=values, minlength=bins)
+    with np.errstate(invalid="ignore"):
+        return np.where(counts > 0, totals / counts, np.nan)
+
+
+def pearson(a: np.ndarray, b: np.ndarray) -> float | None:
+    valid = ~(np.isnan(a) | np.isnan(b))
+    if valid.sum() < 3:
+        return None
+    a, b = a[valid] - a[valid].mean(), b[valid] - b[valid].mean()
+    denominator = math.sqrt(np.dot(a, a) * np.dot(b, b))
+    return float(np.dot(a, b) / denominator) if denominator else None
+
+
+def correlation(series_a: tuple[np.ndarray, np.ndarray], series_b: tuple[np.ndarray, np.ndarray],
+                bins: int, max_lag: int) -> dict:
+    """Pearson correlation of two tags on a common time grid, and the lag of the grid where it is strongest.
+
+    A positive lag means the second tag follows the first.
+    """
+    (seconds_a, values_a), (seconds_b, values_b) = series_a, series_b
+    if values_a.size < 3 or values_b.size < 3:
+        return {}
+    start = max(seconds_a[0], seconds_b[0])
+    end = min(seconds_a[-1], seconds_b[-1])
+    if end <= start:
+        return {}
+    bins = max(3, min(bins, values_a.size, values_b.size))
+    width = (end - start) / bins
+    in_a = (seconds_a >= start) & (seconds_a <= end)
+    in_b = (seconds_b >= start) & (seconds_b <= end)
+    grid_a = bin_means(seconds_a[in_a], values_a[in_a], start, width, bins)
+    grid_b = bin_means(seconds_b[in_b], values_b[in_b], start, width, bins)
+    result = {"pearson": significant(pearson(grid_a, grid_b), 3), "bin_seconds": significant(width)}
+    best_lag, best = 0, pearson(grid_a, grid_b)
+    for lag in range(1, min(max_lag, bins - 3) + 1):
+        for signed, r in ((lag, pearson(grid_a[:-lag], grid_b[lag:])), (-lag, pearson(grid_a[lag:], grid_b[:-lag]))):
+            if r is not None and (best is None or abs(r) > abs(best)):
+                best_lag, best = signed, r
+    if best_lag:
+        result["best_lag_seconds"] = significant(best_lag * width)
+        result["best_lag_pearson"] = significant(best, 3)
+    return result
+
+
+def check_options(window: int, z_threshold: float):
+    """Rejects options the detectors cannot work with, cheap enough to call before fetching any data"""
+    if window < 2:
+        raise ValueError(f"window must be at least 2 samples, got {window}")
+    if not z_threshold > 0:
+        raise ValueError(f"z_threshold must be greater than 0, got {z_threshold}")
+
+
+def analyze(series: dict[str, tuple[np.ndarray, np.ndarray]], window: int = DEFAULT_WINDOW, z_threshold: float = 3.0,
+            max_change_points: int = 5, correlation_bins: int = 500, max_lag: int = 10, top: int = 5) -> dict:
+    """Concise numeric findings per tag and for every pair of tags"""
+    check_options(window, z_threshold)
+    tags = {}
+    for tag, (seconds, values) in series.items():
+        if values.size == 0:
+            tags[tag] = {"count": 0}
+            continue
+        tags[tag] = {
+            **describe(values),
+            "trend": trend(seconds, values),
+            "anomalies": anomalies(seconds, values, window, z_threshold, top),
+            "change_points": change_points(seconds, values, max_change_points, window),
+        }
+    names = list(series)
+    correlations = []
+    for i, tag_a in enumerate(names):
+        for tag_b in names[i + 1:]:
+            result = correlation(series[tag_a], series[tag_b], correlation_bins, max_lag)
+            if result:
+                correlations.append({"tags": [tag_a, tag_b], **result})
+    return {"tags": tags, "correlations": correlations}
@@ -0,0 +1,134 @@
+import logging
+import threading
+from dataclasses import dataclass, field
+
+from pandas import Timestamp
+
+ONLINE = "online"
+OFFLINE = "offline"
+
+
+@dataclass
+class Interval:
+    status: str
+    start: Timestamp
+    end: Timestamp
+
+    @property
+    def seconds(self) -> float:
+        return (self.end - self.start).total_seconds()
+
+
+@dataclass
+class DeviceTimeline:
+    """Status timeline of one device, built from the `devices` table events.
+
+    Closed intervals never change once an event ends them, so they are kept
+    and only events after `watermark` are fetched on the next query.
+    """
+    origin: Timestamp
+    intervals: list[Interval] = field(default_factory=list)
+    open_status: str | None = None
+    open_since: Timestamp | None = None
+    watermark: Timestamp | None = None
+
+    def feed(self, ts: Timestamp, status: str):
+        if self.watermark is not None and ts <= self.watermark:
+            return
+        self.watermark = ts
+        if status == self.open_status:
+            return
+        if self.open_status is not None:
+            self.intervals.append(Interval(self.open_status, self.open_since, ts))
+        self.open_status = status
+        self.open_since = max(ts, self.origin)
+
+    def clipped(self, start: Timestamp, end: Timestamp) -> list[Interval]:
+        intervals = list(self.intervals)
+        if self.open_status is not None:
+            intervals.append(Interval(self.open_status, self.open_since, end))
+        result = []
+        for iv in intervals:
+            s, e = max(iv.start, start), min(iv.end, end)
+            if s < e:
+                result.append(Interval(iv.status, s, e))
+        return result
+
+
+def to_timestamp(value, tz: str = "Asia/Shanghai") -> Timestamp:
+    ts = Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize(tz)
+    return ts
+
+
+def to_sql_time(ts: Timestamp) -> str:
+    return ts.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3] + ts.strftime('%z')
+
+
+def summarize(device: str, intervals: list[Interval], start: Timestamp, end: Timestamp) -> dict:
+    online = sum(iv.seconds for iv in intervals if iv.status == ONLINE)
+    offline = sum(iv.seconds for iv in intervals if iv.status == OFFLINE)
+    outages = [iv for iv in intervals if iv.status == OFFLINE]
+    observed = online + offline
+    return {
+        "device": device,
+        "start": str(start),
+        "end": str(end),
+        "observed_seconds": round(observed, 3),
+        "unknown_seconds": round((end - start).total_seconds() - observed, 3),
+        "online_seconds": round(online, 3),
+        "offline_seconds": round(offline, 3),
+        "uptime_pct": round(online / observed * 100, 3) if observed else None,
+        "outage_count": len(outages),
+        "mtbf_seconds": round(online / len(outages), 3) if outages else None,
+        "mttr_seconds": round(offline / len(outages), 3) if outages else None,
+        "longest_outage_seconds": round(max(iv.seconds for iv in outages), 3) if outages else None,
+        "status_at_end": intervals[-1].status if intervals else None,
+    }
+
+
+class AvailabilityTracker:
+    """Compute per-device uptime, outage count and MTBF/MTTR from status events.
+
+    Timelines are cached per device; a query that starts at or after the cached
+    origin only pulls the events newer than the last one seen.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.timelines: dict[str, DeviceTimeline] = {}
+        self.lock = threading.Lock()
+
+    def __load(self, device: str, start: Timestamp) -> DeviceTimeline:
+        timeline = DeviceTimeline(origin=start)
+        before = self.db.query_device_last_status_before(device, to_sql_time(start))
+        if before:
+            timeline.feed(to_timestamp(before[0]['ts']), before[0]['status'])
+        return timeline
+
+    def __refresh(self, device: str, start: Timestamp) -> DeviceTimeline:
+        timeline = self.timelines.get(device)
+        if timeline is None or start < timeline.origin:
+            timeline = self.__load(device, start)
+            self.timelines[device] = timeline
+        since = timeline.watermark if timeline.watermark is not None else timeline.origin
+        for event in self.db.query_device_status_events(device, to_sql_time(since)):
+            timeline.feed(to_timestamp(event['ts']), event['status'])
+        return timeline
+
+    def device_availability(self, device: str, start: str, end: str | None = None) -> dict:
+        start_ts = to_timestamp(start)
+        end_ts = to_timestamp(end) if end else Timestamp.now(tz=start_ts.tz)
+        end_ts = min(end_ts, Timestamp.now(tz=end_ts.tz))
+        if end_ts <= start_ts:
+            raise ValueError(f"Invalid time range: {start} - {end}")
+
+        with self.lock:
+            timeline = self.__refresh(device, start_ts)
+            intervals = timeline.clipped(start_ts, end_ts)
+        logging.info(f"Availability for {device}: {len(intervals)} intervals in range")
+        return summarize(device, intervals, start_ts, end_ts)
+
+    def availability(self, device: str | None, start: str, end: str | None = None) -> list[dict]:
+        devices = [device] if device else self.db.query_status_devices()
+        return [self.device_availability(d, start, end) for d in devices]
@@ -1,15 +1,20 @@
 import os
+from typing import Iterator
 from pandas import Timestamp
 
 from db.td import DB as TDDB
 from db.mariadb import Client
 from spb_client import SparkPlugBClient
+from availability import AvailabilityTracker, to_timestamp, to_sql_time
+
+EXPORT_BLOCK_ROWS = int(os.getenv("EXPORT_BLOCK_ROWS", 65536))
 
 class SparkPlugBApp:
     def __init__(self):
         self.db = TDDB()
         self.mariadb = Client()
         self.client = SparkPlugBClient()
+        self.availability = AvailabilityTracker(self.db)
 
     @staticmethod
     def timestamp_to_str(timestamp: Timestamp, tz: str = 'Asia/Shanghai') -> str:
@@ -51,13 +56,73 @@ class SparkPlugBApp:
             })
         return status
     
+    def query_device_availability(self, device: str | None, start: str, end: str | None = None) -> list[dict]:
+        return self.availability.availability(device, start, end)
+
+    def stream_tag_history(self, start: str, end: str | None = None, devices: list[str] | None = None,
+                           tags: list[str] | None = None, fmt: str = "parquet") -> Iterator[bytes]:
+        """Tag history as Parquet or Arrow IPC file content, streamed block by block"""
+        # pyarrow is only imported by the exports, not when the app starts
+        from tag_export import build_sql, stream_export
+
+        sql = build_sql(start, end, devices, tags)
+        return stream_export(self.db.iter_sql(sql), fmt, EXPORT_BLOCK_ROWS)
+
+    def export_tag_history(self, path: str, start: str, end: str | None = None, devices: list[str] | None = None,
+                           tags: list[str] | None = None, fmt: str = "parquet") -> int:
+        from tag_export import build_sql, export_to_file
+
+        sql = build_sql(start, end, devices, tags)
+        return export_to_file(self.db.iter_sql(sql), path, fmt, EXPORT_BLOCK_ROWS)
+
+    def analyze_tags(self, device: str, tags: list[str], start: str, end: str | None = None,
+                     window: int = 30, z_threshold: float = 3.0) -> dict:
+        """Trend, anomalies, change points and cross correlation of the tags, fetched with one query"""
+        import pyarrow as pa
+        from tag_export import build_sql, iter_blocks, SCHEMA
+        from analytics import analyze, load_series, check_options
+
+        check_options(window, z_threshold)
+        sql = build_sql(start, end, [device], tags)
+        table = pa.Table.from_batches(iter_blocks(self.db.iter_sql(sql), EXPORT_BLOCK_ROWS), schema=SCHEMA)
+        return {"device": device, "start": start, "end": end,
+                **analyze(load_series(table, tags), window=window, z_threshold=z_threshold)}
+
+    def query_alarms(self, start: str, end: str | None = None, device: str | None = None, state: str | None = None) -> list[dict]:
+        start_ts = to_timestamp(start)
+        end_ts = to_timestamp(end) if end else Timestamp.now(tz=start_ts.tz)
+        results = self.db.query_alarms(to_sql_time(start_ts), to_sql_time(end_ts), device, state)
+        return [{
+            "time": self.timestamp_to_str(result['ts']),
+            "device": result['device'],
+            "tag": result['tag_name'],
+            "rule": result['rule'],
+            "severity": result['severity'],
+            "state": result['state'],
+            "value": result['tag_value'],
+            "message": result['message'],
+        } for result in results]
+
+    def query_active_alarms(self) -> list[dict]:
+        return self.client.alarms.active()
+
     def query_device_by_alias(self, alias: str) -> str | None:
         return self.mariadb.query_device_by_alias(alias)
     
+    def data_version(self, table: str, device: str | None = None, tag: str | None = None,
+                     start: str | None = None, end: str | None = None) -> dict:
+        result = self.db.query_data_version(table, device, tag, start, end)
+        last_ts = result['last_ts']
+        return {"rows": result['rec_count'], "last_ts": self.timestamp_to_str(last_ts) if last_ts is not None else None}
+
     def db_execute_sql(self, sql: str) -> list[dict]:
         result = self.db.query_sql(sql)
         return result
     
+    def on_tag_value(self, callback):
+        """Call `callback(device, tag, value)` for every tag value received over MQTT"""
+        self.client.on_tag_value = callback
+
     def stop(self):
         self.client.disconnect()
     
@@ -11,6 +11,7 @@ from dotenv import load_dotenv
 from db.td import DB as TDDB
 
 from spb_pb2 import Payload
+from alarm_rules import AlarmEngine, load_rules
 
 class SparkPlugBClient:
     def __init__(self):
@@ -23,6 +24,10 @@ class SparkPlugBClient:
 
         self.device_tag_alias = {}
         self.device_tags = {}
+        # called with (device, tag, value) for every received tag value, e.g. TagStream.publish
+        self.on_tag_value = None
+        # alarm rules evaluated inline on every decoded value, events go to the alarms table
+        self.alarms = AlarmEngine(load_rules(os.getenv("ALARM_RULES_FILE", "./data/alarm_rules.json")), sink=self.db.insert_alarm)
 
         # tree
         # -- {group}
@@ -40,6 +45,11 @@ class SparkPlugBClient:
         device = parts[4]
         return group, node, device
     
+    def __tag_received(self, device: str, name: str, value: str, tag_time: Timestamp):
+        self.alarms.evaluate(device, name, value, tag_time)
+        if self.on_tag_value:
+            self.on_tag_value(device, name, value)
+
     # spBv1.0/{group}/msg_type/{node}/{device}
     def __on_connect(self, client, userdata, flags, rc):
         result = self.client.subscribe('spBv1.0/#', qos=1)
@@ -105,6 +115,7 @@ class SparkPlugBClient:
                     self.db.insert_tag(device, name, value, tag_time)
                     self.device_tags[device][name] = value
                     self.groups[group][node][device][name] = value
+                    self.__tag_received(device, name, value, tag_time)
                     if 'alias' in metric:
                         alias = metric['alias']
                         self.device_tag_alias[device][alias] = name 
@@ -135,6 +146,7 @@ class SparkPlugBClient:
                             name = self.device_tag_alias[device].get(alias, alias)
                             self.device_tags[device][name] = value
                             self.db.insert_tag(device, name, value, tag_time)
+                        self.__tag_received(device, name, value, tag_time)
                         time.sleep(0.05)
             elif 'NDATA' in msg.topic:
                 logging.info("Node Data message received")
@@ -0,0 +1,187 @@
+"""Columnar export of tag history from TDengine.
+
+    uv run python -m spb.tag_export --start "2025-05-18 00:00:00+0800" --device modbus --output modbus.parquet
+    uv run python -m spb.tag_export --start "2025-05-18 00:00:00+0800" --tag robotic_arm/voltage --format arrow --output voltage.arrow
+
+Rows are streamed from the query result and written as one Parquet row group
+or Arrow record batch per `block_rows` rows, so memory stays bounded by the
+block size whatever the range. Columns are typed: `ts` timestamp, `device`,
+`tag_name` and the raw `tag_value` strings (Parquet dictionary encodes them),
+and `value` float64, null where the value is not numeric.
+"""
+import os
+import re
+import time
+import logging
+from datetime import datetime
+from typing import Iterator
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from availability import to_timestamp, to_sql_time
+
+TIMEZONE = "Asia/Shanghai"
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+CONTENT_TYPES = {"parquet": "application/vnd.apache.parquet", "arrow": "application/vnd.apache.arrow.file"}
+
+SCHEMA = pa.schema([
+    ("ts", pa.timestamp("ms", tz=TIMEZONE)),
+    ("device", pa.string()),
+    ("tag_name", pa.string()),
+    ("tag_value", pa.string()),
+    ("value", pa.float64()),
+])
+COLUMNS = [field.name for field in SCHEMA]
+
+NUMBER_PATTERN = r"^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$"
+
+# device and tag names go into the SQL, anything that could end the string literal is rejected
+NAME_PATTERN = re.compile(r"^[^'\"\\]+$")
+
+
+class ChunkSink:
+    """Write-only file the writers write into, drained after every block"""
+    def __init__(self):
+        self.chunks: list[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def build_sql(start: str, end: str | None = None, devices: list[str] | None = None, tags: list[str] | None = None) -> str:
+    start_ts = to_timestamp(start)
+    end_ts = to_timestamp(end) if end else pd.Timestamp.now(tz=start_ts.tz)
+    if end_ts <= start_ts:
+        raise ValueError(f"Invalid time range: {start} - {end}")
+    for name in (devices or []) + (tags or []):
+        if not NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid device or tag name: {name}")
+    sql = f"SELECT {', '.join(COLUMNS[:4])} FROM tag_values WHERE ts >= '{to_sql_time(start_ts)}' AND ts < '{to_sql_time(end_ts)}'"
+    if devices:
+        sql += " AND device IN (" + ", ".join(f"'{device}'" for device in devices) + ")"
+    if tags:
+        sql += " AND tag_name IN (" + ", ".join(f"'{tag}'" for tag in tags) + ")"
+    return sql + " ORDER BY ts ASC"
+
+
+def to_timestamps(values: list) -> pa.Array:
+    if isinstance(values[0], datetime):
+        return pa.array(values, type=SCHEMA.field("ts").type)
+    # string or epoch timestamps, depending on the connector settings
+    return pa.Array.from_pandas(pd.to_datetime(pd.Series(values), utc=True).dt.tz_convert(TIMEZONE), type=SCHEMA.field("ts").type)
+
+
+def to_record_batch(ts: list, devices: list[str], tags: list[str], values: list[str]) -> pa.RecordBatch:
+    # built column by column, pandas object inference costs ten times as much
+    tag_values = pa.array(values, type=pa.string())
+    try:
+        numbers = pc.cast(tag_values, pa.float64())
+    except pa.ArrowInvalid:
+        # booleans and strings mixed in, those become null
+        numeric = pc.match_substring_regex(tag_values, NUMBER_PATTERN)
+        numbers = pc.cast(pc.if_else(numeric, tag_values, pa.scalar(None, pa.string())), pa.float64())
+    return pa.RecordBatch.from_arrays([to_timestamps(ts), pa.array(devices, type=pa.string()), pa.array(tags, type=pa.string()),
+                                       tag_values, numbers], schema=SCHEMA)
+
+
+def iter_blocks(rows: Iterator[tuple], block_rows: int) -> Iterator[pa.RecordBatch]:
+    columns = ([], [], [], [])
+    ts, devices, tags, values = columns
+    for row in rows:
+        ts.append(row[0])
+        devices.append(row[1])
+        tags.append(row[2])
+        values.append(row[3])
+        if len(ts) >= block_rows:
+            yield to_record_batch(*columns)
+            for column in columns:
+                column.clear()
+    if ts:
+        yield to_record_batch(*columns)
+
+
+def open_writer(sink: ChunkSink, fmt: str, compression: str):
+    compression = None if compression == "none" else compression
+    if fmt == "parquet":
+        return pq.ParquetWriter(pa.PythonFile(sink, mode="w"), SCHEMA, compression=compression)
+    if fmt == "arrow":
+        return ipc.new_file(pa.PythonFile(sink, mode="w"), SCHEMA, options=ipc.IpcWriteOptions(compression=compression))
+    raise ValueError(f"Unknown export format {fmt}, expected one of {', '.join(FORMATS)}")
+
+
+def stream_export(rows: Iterator[tuple], fmt: str = "parquet", block_rows: int = 65536, compression: str = "zstd") -> Iterator[bytes]:
+    """Encoded file content, one chunk per block of rows"""
+    start_time = time.monotonic()
+    sink = ChunkSink()
+    count = 0
+    writer = open_writer(sink, fmt, compression)
+    try:
+        for batch in iter_blocks(rows, block_rows):
+            writer.write_batch(batch)
+            count += batch.num_rows
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+    logging.info(f"Exported {count} rows as {fmt}, {sink.position} bytes in {time.monotonic() - start_time:.2f} seconds")
+
+
+def export_to_file(rows: Iterator[tuple], path: str, fmt: str = "parquet", block_rows: int = 65536, compression: str = "zstd") -> int:
+    """Writes the export to `path`, returns the file size"""
+    with open(path, "wb") as f:
+        for chunk in stream_export(rows, fmt, block_rows, compression):
+            f.write(chunk)
+    return os.path.getsize(path)
+
+
+def main():
+    import argparse
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Export tag history from TDengine as Parquet or Arrow IPC")
+    parser.add_argument("--start", required=True, help="Range start, e.g. 2025-05-18 00:00:00+0800")
+    parser.add_argument("--end", help="Range end, now by default")
+    parser.add_argument("--device", action="append", help="Device name, repeat for more, all devices by default")
+    parser.add_argument("--tag", action="append", help="Tag name, repeat for more, all tags by default")
+    parser.add_argument("--format", choices=list(FORMATS), default="parquet")
+    parser.add_argument("--compression", default="zstd", help="zstd, lz4, or for parquet also snappy, gzip, none")
+    parser.add_argument("--block-rows", type=int, default=int(os.getenv("EXPORT_BLOCK_ROWS", 65536)))
+    parser.add_argument("--output", help="Output file, tag_history.<format> by default")
+    args = parser.parse_args()
+
+    from db.td import DB as TDDB
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    output = args.output or f"tag_history{FORMATS[args.format]}"
+    sql = build_sql(args.start, args.end, args.device, args.tag)
+    start_time = time.monotonic()
+    size = export_to_file(TDDB().iter_sql(sql), output, args.format, args.block_rows, args.compression)
+    print(f"Wrote {output}, {size} bytes in {time.monotonic() - start_time:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()
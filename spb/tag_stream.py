@@ -0,0 +1,118 @@
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import AsyncIterator
+
+Key = tuple[str, str]
+
+
+class TagStream:
+    """Current tag values from the MQTT ingest path, pushed to live subscribers.
+
+    `publish` is called from the MQTT thread and only updates two dicts. While
+    anyone is subscribed, a flusher turns the values changed in each `interval`
+    into one immutable frame that all subscribers share; each subscriber merges
+    the frames it has not seen yet, so updates coalesce to the latest value per
+    tag, at most once per its `min_interval`.
+    """
+    def __init__(self, interval: float = 0.1, history: int = 256, max_subscribers: int = 100):
+        self.interval = interval
+        self.max_subscribers = max_subscribers
+        self.latest: dict[Key, tuple[str, float]] = {}
+        self.subscribers = 0
+        self.__pending: dict[Key, tuple[str, float]] = {}
+        self.__lock = threading.Lock()
+        self.__frames: deque[tuple[int, dict[Key, tuple[str, float]]]] = deque(maxlen=history)
+        self.__seq = 0
+        self.__condition: asyncio.Condition | None = None
+        self.__flusher: asyncio.Task | None = None
+        # seq range and filter -> encoded event, subscribers with the same selection share it
+        self.__encoded: dict = {}
+
+    def publish(self, device: str, tag: str, value: str):
+        update = (value, time.time())
+        with self.__lock:
+            self.latest[(device, tag)] = update
+            self.__pending[(device, tag)] = update
+
+    async def __flush(self):
+        try:
+            while self.subscribers:
+                await asyncio.sleep(self.interval)
+                with self.__lock:
+                    pending, self.__pending = self.__pending, {}
+                if not pending:
+                    continue
+                self.__seq += 1
+                self.__frames.append((self.__seq, pending))
+                self.__encoded = {}
+                async with self.__condition:
+                    self.__condition.notify_all()
+        finally:
+            self.__flusher = None
+
+    @staticmethod
+    def __selected(key: Key, devices: frozenset | None, tags: frozenset | None) -> bool:
+        return (devices is None or key[0] in devices) and (tags is None or key[1] in tags)
+
+    def __encode(self, updates: dict[Key, tuple[str, float]], seq: int) -> str:
+        values: dict[str, dict[str, dict]] = {}
+        for (device, tag), (value, ts) in updates.items():
+            values.setdefault(device, {})[tag] = {"value": value, "ts": round(ts, 3)}
+        return json.dumps({"seq": seq, "values": values}, ensure_ascii=False)
+
+    def __snapshot(self, devices: frozenset | None, tags: frozenset | None) -> str:
+        with self.__lock:
+            updates = {key: update for key, update in self.latest.items() if self.__selected(key, devices, tags)}
+        return self.__encode(updates, self.__seq)
+
+    def __changes(self, cursor: int, devices: frozenset | None, tags: frozenset | None) -> str | None:
+        """Encoded updates of the frames after `cursor`, None if none of them is selected"""
+        cache_key = (cursor, self.__seq, devices, tags)
+        if cache_key in self.__encoded:
+            return self.__encoded[cache_key]
+        if self.__frames and self.__frames[0][0] > cursor + 1:
+            # fell behind the kept frames, resend the selected current values
+            encoded = self.__snapshot(devices, tags)
+        else:
+            updates: dict[Key, tuple[str, float]] = {}
+            for seq, frame in self.__frames:
+                if seq > cursor:
+                    for key, update in frame.items():
+                        if self.__selected(key, devices, tags):
+                            updates[key] = update
+            encoded = self.__encode(updates, self.__seq) if updates else None
+        self.__encoded[cache_key] = encoded
+        return encoded
+
+    async def subscribe(self, devices: set[str] | None = None, tags: set[str] | None = None,
+                        min_interval: float = 0.5) -> AsyncIterator[str]:
+        """JSON events: the selected current values first, then the changes, at most one event per `min_interval`"""
+        if self.subscribers >= self.max_subscribers:
+            raise ConnectionRefusedError(f"Too many tag stream subscribers ({self.subscribers})")
+        devices = frozenset(devices) if devices else None
+        tags = frozenset(tags) if tags else None
+        if self.__condition is None:
+            self.__condition = asyncio.Condition()
+        self.subscribers += 1
+        if self.__flusher is None:
+            self.__flusher = asyncio.create_task(self.__flush())
+        logging.info(f"Tag stream subscriber joined, devices {devices}, tags {tags}, {self.subscribers} subscribers")
+        try:
+            cursor = self.__seq
+            encoded = self.__snapshot(devices, tags)
+            while True:
+                if encoded is not None:
+                    yield encoded
+                    # rate limit, the frames arriving meanwhile are merged into the next event
+                    await asyncio.sleep(min_interval)
+                async with self.__condition:
+                    await self.__condition.wait_for(lambda: self.__seq > cursor)
+                encoded = self.__changes(cursor, devices, tags)
+                cursor = self.__seq
+        finally:
+            self.subscribers -= 1
+            logging.info(f"Tag stream subscriber left, {self.subscribers} subscribers")
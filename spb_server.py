@@ -1,4 +1,5 @@
 import os
+import asyncio
 import logging
 import time
 import signal
@@ -6,7 +7,8 @@ import signal
 from mcp.server.fastmcp import FastMCP
 from dotenv import load_dotenv
 
-from spb.spb_app import SparkPlugBApp
+from spb.tag_stream import TagStream
+from util import configure_tracer, instrument_mcp_server, Warmup
 
 load_dotenv()
 
@@ -14,7 +16,29 @@ project_path = os.path.abspath(os.path.dirname(__file__))
 logging.basicConfig(level=logging.INFO, filename=os.path.join(project_path, "logs/spb_server.log"), filemode="a", format="%(asctime)s - %(levelname)s - %(message)s")
 
 mcp = FastMCP()
-spb = SparkPlugBApp()
+configure_tracer("spb_server")
+instrument_mcp_server(mcp._mcp_server)
+
+# Live tag values for the browser, fed by the MQTT ingest path
+tag_stream = TagStream(
+    max_subscribers=int(os.getenv("TAG_STREAM_MAX_SUBSCRIBERS", 100)),
+)
+TAG_STREAM_MIN_INTERVAL = float(os.getenv("TAG_STREAM_MIN_INTERVAL", 0.5))
+# tables get_data_version reports on
+DATA_TABLES = {"tag_values", "devices", "alarms"}
+
+def load_spb():
+    # TDengine, MariaDB and MQTT clients are imported and connected in the background
+    from spb.spb_app import SparkPlugBApp
+
+    spb = SparkPlugBApp()
+    spb.on_tag_value(tag_stream.publish)
+    if not spb.connect():
+        raise ConnectionError("failed to connect to the MQTT broker or MariaDB")
+    return spb
+
+warmup = Warmup("spb_server")
+warmup.add("spb", load_spb, closer=lambda spb: spb.stop())
 
 @mcp.tool()
 async def get_spb_tree(device: str | None = None) -> str:
@@ -32,6 +56,7 @@ async def get_spb_tree(device: str | None = None) -> str:
         |      -- diagnose/tag2, 0
         |      -- diagnose/error_code, 0
     """
+    spb = await warmup.aget("spb")
     tree = spb.query_spb_tree(device)
     logging.info(f"Tree: \n{tree}")
     return tree
@@ -63,6 +88,7 @@ async def get_device_tag_value_count_by_sql(sql) -> int:
     """
 
     logging.info(f"Getting get_device_tag_value_count_by_sql by sql {sql}")
+    spb = await warmup.aget("spb")
     results = spb.db_execute_sql(sql)
     if not results:
         logging.info("No results found")
@@ -95,6 +121,7 @@ async def get_device_tag_value_aggregate_time_window_by_sql(sql) -> str:
     '''
     
     logging.info(f"Getting get_device_tag_value_aggregate_time_window_by_sql by sql {sql}")
+    spb = await warmup.aget("spb")
     results = spb.db_execute_sql(sql)
     if not results:
         logging.info("No results found")
@@ -143,6 +170,7 @@ async def get_device_tag_history_raw_values_by_sql(sql) -> str:
 
     """
     logging.info(f"Getting get_device_tag_history_raw_values_by_sql by sql {sql}")
+    spb = await warmup.aget("spb")
     results = spb.db_execute_sql(sql)
     if not results:
         logging.info("No results found")
@@ -160,6 +188,7 @@ async def get_device_latest_tag_value(device: str, tag: str) -> str:
         tag: Tag name.
     """
     logging.info(f"Getting get_device_latest_tag_value for {device} {tag}")
+    spb = await warmup.aget("spb")
     value = spb.query_device_current_tag_value(device, tag)
     return value
 
@@ -174,6 +203,7 @@ async def get_device_status_count_by_sql(sql) -> int:
     """
 
     logging.info(f"Getting device status record number by sql {sql}")
+    spb = await warmup.aget("spb")
     results = spb.db_execute_sql(sql)
     if not results:
         logging.info("No results found")
@@ -216,6 +246,7 @@ async def get_device_status_by_sql(sql: str) -> str:
             because the ts is not aggregated, syntax error.
     """
     logging.info(f"Getting device status by sql: {sql}")
+    spb = await warmup.aget("spb")
     results  = spb.db_execute_sql(sql)
     if not results:
         logging.info("No results found")
@@ -223,12 +254,184 @@ async def get_device_status_by_sql(sql: str) -> str:
 
     return results
     
+@mcp.tool()
+async def get_device_availability(start: str, end: str | None = None, device: str | None = None) -> str:
+    """Compute device availability from the online/offline events in the devices table.
+
+    Prefer this tool over `get_device_status_by_sql` for questions about uptime, outages, MTBF or MTTR;
+    it returns a few numbers per device instead of raw status rows.
+
+    Args:
+        start: Range start, format: YYYY-MM-DD HH:MM:SS+0800, should include timezone, e.g. 2023-10-01 00:00:00+0800.
+        end: Range end, same format as start. Option, If None, use current time.
+        device: Device name. Option, If None, compute for all devices.
+
+    Returns:
+        List of per-device summaries, e.g.:
+        [{"device": "modbus", "uptime_pct": 99.2, "outage_count": 2, "mtbf_seconds": 42800.0, "mttr_seconds": 345.5,
+          "online_seconds": ..., "offline_seconds": ..., "unknown_seconds": ..., "status_at_end": "online", ...}]
+        `unknown_seconds` is the part of the range before the first known status, it is excluded from uptime_pct.
+        `status_at_end` is the status at the end of the range, the current status only when end is now.
+    """
+    logging.info(f"Getting device availability for {device} from {start} to {end}")
+    spb = await warmup.aget("spb")
+    try:
+        results = spb.query_device_availability(device, start, end)
+    except ValueError as e:
+        return str(e)
+    if not results:
+        logging.info("No results found")
+        return "No results found"
+
+    logging.info(f"Results: {results}")
+    return results
+
+@mcp.tool()
+async def analyze_device_tags(device: str, tags: list[str], start: str, end: str | None = None,
+                              window: int = 30, z_threshold: float = 3.0) -> str:
+    """Compute numeric findings for tags of a device over a time range: statistics, linear trend,
+    rolling z-score anomalies, change points of the mean and the correlation between every pair of tags.
+
+    Prefer this tool over fetching raw or aggregated values for questions about trends, anomalies,
+    changes or relations between tags (e.g. voltage vs amper); the findings can be quoted in the report as they are.
+
+    Args:
+        device: Device name.
+        tags: Tag names, e.g. ["robotic_arm/voltage", "robotic_arm/amper"]; two or more to get correlations.
+        start: Range start, format: YYYY-MM-DD HH:MM:SS+0800, should include timezone, e.g. 2023-10-01 00:00:00+0800.
+        end: Range end, same format as start. Option, If None, use current time.
+        window: Samples before each value its z-score is computed against, at least 2. Option, default 30.
+        z_threshold: Absolute z-score from which a value is an anomaly, greater than 0. Option, default 3.
+
+    Returns:
+        {"tags": {"robotic_arm/voltage": {"count": 8640, "min": ..., "max": ..., "mean": ..., "std": ..., "first": ..., "last": ...,
+                  "trend": {"slope_per_hour": 0.12, "r2": 0.64, "fitted_change": 2.9, "fitted_change_pct": 1.3},
+                  "anomalies": {"count": 3, "top": [{"time": "2025-05-18 10:02:11", "value": 251.2, "z": 6.1}]},
+                  "change_points": [{"time": "2025-05-18 14:00:05", "before_mean": 220.1, "after_mean": 228.4}]}},
+         "correlations": [{"tags": ["robotic_arm/voltage", "robotic_arm/amper"], "pearson": 0.91, "bin_seconds": 172.8,
+                           "best_lag_seconds": 345.6, "best_lag_pearson": 0.95}]}
+        A positive best_lag_seconds means the second tag follows the first.
+    """
+    logging.info(f"Analyzing {tags} of {device} from {start} to {end}")
+    spb = await warmup.aget("spb")
+    try:
+        # fetching a long range takes a while, keep the event loop serving other tools meanwhile
+        results = await asyncio.to_thread(spb.analyze_tags, device, tags, start, end, window=window, z_threshold=z_threshold)
+    except ValueError as e:
+        return str(e)
+    logging.info(f"Results: {results}")
+    return results
+
+@mcp.tool()
+async def get_alarms(start: str, end: str | None = None, device: str | None = None, state: str | None = None) -> str:
+    """Get the alarms raised and cleared by the alarm rules evaluated on incoming tag values
+    (threshold, rate of change, windowed average and stuck value rules).
+
+    Prefer this tool over querying tag_values for questions about alarms, abnormal values or new error codes.
+
+    Args:
+        start: Range start, format: YYYY-MM-DD HH:MM:SS+0800, should include timezone, e.g. 2023-10-01 00:00:00+0800.
+        end: Range end, same format as start. Option, If None, use current time.
+        device: Device name. Option, If None, get alarms of all devices.
+        state: Option, `raised` or `cleared`. If None, get both.
+
+    Returns:
+        The alarm events in time order and the alarms active now, e.g.:
+        {"events": [{"time": "2025-05-18 07:43:05.120", "device": "modbus", "tag": "robotic_arm/voltage", "rule": "overvoltage",
+                     "severity": "critical", "state": "raised", "value": "245.1", "message": "robotic_arm/voltage 245.1 > 240"}],
+         "active": [{"device": "modbus", "tag": "robotic_arm/voltage", "rule": "overvoltage", "severity": "critical"}]}
+    """
+    logging.info(f"Getting alarms for {device} from {start} to {end}, state {state}")
+    spb = await warmup.aget("spb")
+    events = spb.query_alarms(start, end, device, state)
+    active = [alarm for alarm in spb.query_active_alarms() if device is None or alarm["device"] == device]
+    return {"events": events, "active": active}
+
+@mcp.tool()
+async def get_data_version(table: str, device: str | None = None, tag: str | None = None,
+                           start: str | None = None, end: str | None = None) -> str:
+    """Row count and latest timestamp of a table, or of the rows of a device, tag and time range in it;
+    used by the chat app to tell whether a cached answer is still current. Internal, not offered to the LLM.
+
+    Args:
+        table: tag_values, devices or alarms.
+        device: Device name. Option, If None, all devices.
+        tag: Tag name, not for the devices table. Option, If None, all tags.
+        start: Earliest ts, inclusive, e.g. 2023-10-01 00:00:00+0800. Option, If None, from the first row.
+        end: Latest ts, inclusive, same format as start. Option, If None, up to the last row.
+
+    Returns:
+        {"rows": 8640, "last_ts": "2025-05-18 10:02:11.000"}
+    """
+    if table not in DATA_TABLES:
+        raise ValueError(f"Unknown table {table}, expected one of {', '.join(sorted(DATA_TABLES))}")
+    if tag and table == "devices":
+        raise ValueError("The devices table has no tag_name")
+    for value in (device, tag, start, end):
+        if value and "'" in value:
+            raise ValueError(f"Invalid condition value: {value}")
+    spb = await warmup.aget("spb")
+    return spb.data_version(table, device, tag, start, end)
+
 from mcp.server import Server
+from sse_starlette.sse import EventSourceResponse
+from starlette.responses import JSONResponse, StreamingResponse
 from starlette.requests import Request
 from starlette.applications import Starlette
 from mcp.server.sse import SseServerTransport
 from starlette.routing import Mount, Route
 
+def query_names(request: Request, param: str) -> list[str] | None:
+    """Comma separated names of a query parameter, None when not given"""
+    values = [value.strip() for value in request.query_params.get(param, "").split(",") if value.strip()]
+    return values or None
+
+async def stream_tags(request: Request):
+    """Live tag values as SSE `tags` events, e.g. /tags/stream?device=modbus,opcua&tag=robotic_arm/voltage&interval=1
+
+    The first event holds the selected current values, later ones only the changes,
+    at most one event per `interval` seconds (not below TAG_STREAM_MIN_INTERVAL).
+    """
+    if tag_stream.subscribers >= tag_stream.max_subscribers:
+        return JSONResponse({"error": "too many tag stream subscribers"}, status_code=503)
+    try:
+        interval = max(TAG_STREAM_MIN_INTERVAL, float(request.query_params.get("interval", TAG_STREAM_MIN_INTERVAL)))
+    except ValueError:
+        return JSONResponse({"error": "interval must be a number"}, status_code=400)
+
+    async def events():
+        async for data in tag_stream.subscribe(query_names(request, "device"), query_names(request, "tag"), interval):
+            yield {"event": "tags", "data": data}
+
+    # the UI is served by main.py on another port
+    return EventSourceResponse(events(), headers={"Access-Control-Allow-Origin": "*"})
+
+async def export_tags(request: Request):
+    """Tag history as a Parquet or Arrow IPC file,
+    e.g. /export/tags?start=2025-05-18 00:00:00%2B0800&device=modbus&tag=robotic_arm/voltage&format=parquet
+
+    `end` defaults to now, `device` and `tag` to all; rows are streamed from TDengine block by block.
+    """
+    # pyarrow is only loaded when someone exports
+    from spb.tag_export import FORMATS, CONTENT_TYPES
+
+    fmt = request.query_params.get("format", "parquet")
+    if fmt not in FORMATS:
+        return JSONResponse({"error": f"format must be one of {', '.join(FORMATS)}"}, status_code=400)
+    start = request.query_params.get("start")
+    if not start:
+        return JSONResponse({"error": "start is required"}, status_code=400)
+    spb = await warmup.aget("spb")
+    try:
+        chunks = spb.stream_tag_history(start, request.query_params.get("end"), query_names(request, "device"),
+                                        query_names(request, "tag"), fmt)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    logging.info(f"Exporting tag history as {fmt} from {start}")
+    headers = {"Content-Disposition": f'attachment; filename="tag_history{FORMATS[fmt]}"', "Access-Control-Allow-Origin": "*"}
+    # a sync iterator, starlette pulls it in a worker thread while TDengine fetches block by block
+    return StreamingResponse(chunks, media_type=CONTENT_TYPES[fmt], headers=headers)
+
 def create_starlette_app(mcp_server: Server, *, debug: bool = False) -> Starlette:
     """Create a Starlette application that can server the provied mcp server with SSE."""
     sse = SseServerTransport("/messages/")
@@ -250,6 +453,9 @@ def create_starlette_app(mcp_server: Server, *, debug: bool = False) -> Starlett
         routes=[
             Route("/sse", endpoint=handle_sse),
             Mount("/messages/", app=sse.handle_post_message),
+            Route("/tags/stream", endpoint=stream_tags),
+            Route("/export/tags", endpoint=export_tags),
+            *warmup.routes(),
         ],
     )
 
@@ -259,7 +465,7 @@ if __name__ == "__main__":
     
     def signal_handler(sig, frame):
         logging.info("Shutting down...")
-        spb.stop()
+        warmup.close()
         logging.warning("SparkPlugB mcp server stopped")
         exit(0)
     
@@ -267,8 +473,8 @@ if __name__ == "__main__":
     
     logging.info("Starting SparkPlugB mcp server...")
 
-    if not spb.connect():
-        exit(1)
-    
+    # Connecting runs in the background, /readyz reports when the tools can be served
+    warmup.start()
+
     starlette_app = create_starlette_app(mcp._mcp_server, debug=True)
     uvicorn.run(starlette_app, host="0.0.0.0", port=8081)
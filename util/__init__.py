@@ -1,6 +1,14 @@
 from .prompt_loader import (load_system_prompt, load_json_prompt)
+from .tracing import (tracer, configure_tracer, timing_summary, instrument_mcp_server, instrument_llm)
+from .warmup import Warmup
 
 __all__ = [
     'load_system_prompt',
     'load_json_prompt',
+    'tracer',
+    'configure_tracer',
+    'timing_summary',
+    'instrument_mcp_server',
+    'instrument_llm',
+    'Warmup',
 ]
\ No newline at end of file
@@ -0,0 +1,152 @@
+import ast
+import json
+import math
+import os
+from typing import Any, Optional
+
+CONDENSE_THRESHOLD = int(os.getenv("CONDENSE_THRESHOLD", 4000))
+# Columns that identify a series in tag_values / devices rows
+SERIES_COLUMNS = ("device", "tag_name")
+TIME_COLUMNS = ("ts", "_wstart", "_wend", "time")
+
+
+def _parse_text(text: str) -> Any:
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return text
+
+
+def extract_rows(raw_output: Any) -> Optional[list[dict]]:
+    """Get the row dicts out of an MCP CallToolResult or a plain tool return value, None if not tabular"""
+    if hasattr(raw_output, "content") and isinstance(raw_output.content, list):
+        items = [_parse_text(c.text) for c in raw_output.content if hasattr(c, "text")]
+    elif isinstance(raw_output, str):
+        items = [_parse_text(raw_output)]
+    else:
+        items = [raw_output]
+
+    rows = []
+    for item in items:
+        if isinstance(item, dict):
+            rows.append(item)
+        elif isinstance(item, list) and all(isinstance(row, dict) for row in item):
+            rows.extend(item)
+        else:
+            return None
+    return rows or None
+
+
+def _to_float(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or value is None:
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _round(value: float) -> float:
+    return round(value, 4)
+
+
+def change_points(values: list[float], max_points: int = 3) -> list[dict]:
+    """Mean shift change points, found the same way as by the analyze_device_tags tool"""
+    # numpy, pyarrow and pandas come with the analytics module, only loaded once a large output is condensed
+    import numpy as np
+    from spb.analytics import change_point_segments
+
+    return [
+        {"index": index, "before_mean": _round(before), "after_mean": _round(after)}
+        for index, before, after in change_point_segments(np.asarray(values, dtype=float), max_points)
+    ]
+
+
+def _series_digest(rows: list[dict], time_column: Optional[str], head_tail: int) -> dict:
+    digest: dict[str, Any] = {"rows": len(rows)}
+    if time_column:
+        digest["time_range"] = [str(rows[0][time_column]), str(rows[-1][time_column])]
+
+    columns = [c for c in rows[0].keys() if c != time_column and c not in SERIES_COLUMNS]
+    stats = {}
+    for column in columns:
+        values = [_to_float(row.get(column)) for row in rows]
+        numeric = [(i, v) for i, v in enumerate(values) if v is not None]
+        if numeric and len(numeric) >= 0.8 * len(rows):
+            series = [v for _, v in numeric]
+            mean = sum(series) / len(series)
+            i_min, v_min = min(numeric, key=lambda x: x[1])
+            i_max, v_max = max(numeric, key=lambda x: x[1])
+            column_stats = {
+                "count": len(series),
+                "mean": _round(mean),
+                "std": _round(math.sqrt(sum((v - mean) ** 2 for v in series) / len(series))),
+                "min": _round(v_min),
+                "max": _round(v_max),
+                "first": _round(series[0]),
+                "last": _round(series[-1]),
+            }
+            distinct = set(series)
+            if len(distinct) <= 10:
+                # codes and states are numeric but categorical, keep their counts
+                column_stats["distinct"] = {str(_round(v)): series.count(v) for v in sorted(distinct)}
+            if time_column:
+                column_stats["min_at"] = str(rows[i_min][time_column])
+                column_stats["max_at"] = str(rows[i_max][time_column])
+            points = change_points(series)
+            if points:
+                for p in points:
+                    if time_column:
+                        p["at"] = str(rows[numeric[p["index"]][0]][time_column])
+                    del p["index"]
+                column_stats["change_points"] = points
+            stats[column] = column_stats
+        else:
+            counts: dict[str, int] = {}
+            for row in rows:
+                key = str(row.get(column))
+                counts[key] = counts.get(key, 0) + 1
+            top = sorted(counts.items(), key=lambda kv: kv[1], reverse=True)[:5]
+            stats[column] = {"distinct": len(counts), "top": dict(top)}
+    digest["columns"] = stats
+    if len(rows) > 2 * head_tail:
+        digest["head"] = rows[:head_tail]
+        digest["tail"] = rows[-head_tail:]
+    return digest
+
+
+def condense_rows(rows: list[dict], head_tail: int = 3) -> dict:
+    """Numeric digest of tabular rows: shape, per-column stats, extrema, change points and head/tail rows"""
+    time_column = next((c for c in TIME_COLUMNS if c in rows[0]), None)
+    if time_column:
+        rows = sorted(rows, key=lambda row: str(row.get(time_column)))
+    series_keys = [c for c in SERIES_COLUMNS if c in rows[0]]
+
+    groups: dict[str, list[dict]] = {}
+    for row in rows:
+        key = "/".join(str(row.get(c)) for c in series_keys) if series_keys else "all"
+        groups.setdefault(key, []).append(row)
+
+    return {
+        "condensed": True,
+        "note": "Large result replaced by a digest, the full rows were shown to the user",
+        "shape": [len(rows), len(rows[0])],
+        "columns": list(rows[0].keys()),
+        "series": {key: _series_digest(group, time_column, head_tail) for key, group in groups.items()},
+    }
+
+
+def condense_tool_output(raw_output: Any, text: str, threshold: int = CONDENSE_THRESHOLD) -> Optional[str]:
+    """Return a compact digest for large tabular/time series output, None to keep the output as is"""
+    if len(text) <= threshold:
+        return None
+    rows = extract_rows(raw_output)
+    if not rows:
+        return None
+    return json.dumps(condense_rows(rows), ensure_ascii=False, default=str)
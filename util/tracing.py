@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Optional
+
+# (trace_id, span_id) of the innermost open span in the current task
+_current_span: contextvars.ContextVar[Optional[tuple[str, str]]] = contextvars.ContextVar("trace_span", default=None)
+# Open LLM call spans by llama-index span id, see instrument_llm
+_llm_spans: "dict[str, Span]" = {}
+_llm_instrumented = False
+# LLM calls without an end event after this long are recorded as failed and forgotten
+LLM_SPAN_MAX_AGE = float(os.getenv("TRACE_LLM_SPAN_MAX_AGE", 600))
+
+
+def _new_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class Span:
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: Optional[str], attrs: dict):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.start = time.time()
+        self.__start_perf = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self):
+        if self.duration_ms is None:
+            self.duration_ms = round((time.perf_counter() - self.__start_perf) * 1000, 3)
+            self.tracer.record(self)
+
+    def to_dict(self) -> dict:
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "service": self.tracer.service,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration_ms": self.duration_ms,
+        }
+        if self.attrs:
+            record["attrs"] = self.attrs
+        if self.error:
+            record["error"] = self.error
+        return record
+
+
+class Tracer:
+    """Minimal span tracer writing one JSON line per finished span.
+
+    Spans nest through a context variable, so spans opened in workflow steps
+    and tool calls join the trace of the request that started them. The trace
+    context crosses process boundaries as the `trace_id`/`parent_id` pair
+    returned by `context()`.
+    """
+    def __init__(self, service: str = "spb-demo", path: Optional[str] = None, enabled: Optional[bool] = None):
+        if path is None:
+            project_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+            path = os.getenv("TRACE_FILE", os.path.join(project_path, "logs/trace.jsonl"))
+        if enabled is None:
+            enabled = os.getenv("TRACE_ENABLED", "true").lower() == "true"
+        self.service = service
+        self.path = path
+        self.enabled = enabled
+        self.__file = None
+        self.__lock = threading.Lock()
+        # finished spans of traces whose caller asked to collect them
+        self.__collected: dict[str, list[dict]] = {}
+
+    def record(self, span: Span):
+        record = span.to_dict()
+        collected = self.__collected.get(span.trace_id)
+        if collected is not None:
+            collected.append(record)
+        if not self.enabled:
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self.__lock:
+            try:
+                if self.__file is None:
+                    self.__file = open(self.path, "a", encoding="utf-8")
+                self.__file.write(line)
+                self.__file.flush()
+            except OSError as e:
+                logging.warning(f"Failed to write trace: {e}")
+
+    @contextmanager
+    def span(self, name: str, trace_id: Optional[str] = None, parent_id: Optional[str] = None, **attrs: Any):
+        """Open a span as child of the current one, or of the given remote trace context"""
+        current = _current_span.get()
+        if trace_id is None:
+            trace_id, parent_id = current if current else (_new_id() + _new_id(), None)
+        span = Span(self, name, trace_id, parent_id, attrs)
+        token = _current_span.set((trace_id, span.span_id))
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end()
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # async generators may be closed from another context
+                pass
+
+    def context(self) -> Optional[dict]:
+        current = _current_span.get()
+        if current is None:
+            return None
+        return {"trace_id": current[0], "parent_id": current[1]}
+
+    def collect(self, trace_id: str):
+        """Keep the finished spans of trace_id in memory until pop_collected, which must always follow"""
+        self.__collected.setdefault(trace_id, [])
+
+    def pop_collected(self, trace_id: str) -> list[dict]:
+        return self.__collected.pop(trace_id, [])
+
+
+tracer = Tracer()
+
+
+def configure_tracer(service: str):
+    tracer.service = service
+
+
+def timing_summary(spans: list[dict]) -> dict:
+    """Condense the spans of one trace for the UI `timing` event"""
+    spans = sorted(spans, key=lambda s: s["start"])
+    root = next((s for s in spans if s["parent_id"] is None), None)
+    return {
+        "trace_id": root["trace_id"] if root else None,
+        "total_ms": root["duration_ms"] if root else None,
+        "spans": [
+            {"name": s["name"], "start_ms": round((s["start"] - spans[0]["start"]) * 1000, 3), "duration_ms": s["duration_ms"], **s.get("attrs", {})}
+            for s in spans if s is not root
+        ],
+    }
+
+
+def instrument_mcp_server(server):
+    """Wrap the tools/call handler of an MCP server in a span joined to the caller's trace via the request `_meta`"""
+    from mcp import types
+
+    handler = server.request_handlers[types.CallToolRequest]
+
+    async def traced_call_tool(req: types.CallToolRequest):
+        meta = req.params.meta.model_dump() if req.params.meta else {}
+        with tracer.span(f"tool.{req.params.name}", trace_id=meta.get("trace_id"), parent_id=meta.get("parent_id")) as span:
+            result = await handler(req)
+            if getattr(result.root, "isError", False):
+                span.set(is_error=True)
+            return result
+
+    server.request_handlers[types.CallToolRequest] = traced_call_tool
+
+
+def instrument_llm():
+    """Record a span for every llama-index LLM chat call, with time to first token and token counts"""
+    global _llm_instrumented
+    if _llm_instrumented:
+        return
+    _llm_instrumented = True
+
+    from llama_index.core.instrumentation import get_dispatcher
+    from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+    from llama_index.core.instrumentation.events.llm import (
+        LLMChatStartEvent, LLMChatInProgressEvent, LLMChatEndEvent)
+    from llama_index.core.instrumentation.events.exception import ExceptionEvent
+    from llama_index.core.instrumentation.events.span import SpanDropEvent
+    from llama_index.core.utils import get_tokenizer
+
+    def usage_of(response) -> dict:
+        raw = getattr(response, "raw", None)
+        usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+        if usage is None:
+            return {}
+        if not isinstance(usage, dict):
+            usage = usage.model_dump() if hasattr(usage, "model_dump") else vars(usage)
+        return {k: usage.get(k) for k in ("prompt_tokens", "completion_tokens", "total_tokens") if usage.get(k) is not None}
+
+    def end_abandoned(matches, error: str):
+        for span_id, span in list(_llm_spans.items()):
+            if matches(span_id, span) and _llm_spans.pop(span_id, None) is not None:
+                span.error = error
+                span.end()
+
+    class LLMTraceHandler(BaseEventHandler):
+        @classmethod
+        def class_name(cls) -> str:
+            return "LLMTraceHandler"
+
+        def handle(self, event, **kwargs):
+            if isinstance(event, LLMChatStartEvent):
+                # calls that never ended, e.g. a stream nobody closed
+                cutoff = time.time() - LLM_SPAN_MAX_AGE
+                end_abandoned(lambda span_id, span: span.start < cutoff, f"no end event after {LLM_SPAN_MAX_AGE}s")
+                current = _current_span.get()
+                trace_id, parent_id = current if current else (_new_id() + _new_id(), None)
+                span = Span(tracer, "llm.chat", trace_id, parent_id, {"model": event.model_dict.get("model")})
+                # keyed by the dispatcher span of the call, unique per call; the events carry copies of the messages
+                _llm_spans[event.span_id] = span
+            elif isinstance(event, LLMChatInProgressEvent):
+                span = _llm_spans.get(event.span_id)
+                if span is not None and "ttft_ms" not in span.attrs:
+                    span.set(ttft_ms=round((time.time() - span.start) * 1000, 3))
+            elif isinstance(event, LLMChatEndEvent):
+                span = _llm_spans.pop(event.span_id, None)
+                if span is None:
+                    return
+                try:
+                    usage = usage_of(event.response) if event.response else {}
+                    if not usage:
+                        tokenizer = get_tokenizer()
+                        usage = {
+                            "prompt_tokens": sum(len(tokenizer(str(m.content or ""))) for m in event.messages),
+                            "completion_tokens": len(tokenizer(str(event.response.message.content or ""))) if event.response else 0,
+                            "estimated": True,
+                        }
+                    span.set(**usage)
+                finally:
+                    # recorded without token counts when they cannot be estimated
+                    span.end()
+            elif isinstance(event, (ExceptionEvent, SpanDropEvent)):
+                # a failed or cancelled call, streams included, ends without LLMChatEndEvent
+                error = event.err_str if isinstance(event, SpanDropEvent) else f"{type(event.exception).__name__}: {event.exception}"
+                end_abandoned(lambda span_id, span: span_id == event.span_id, error)
+
+    get_dispatcher().add_event_handler(LLMTraceHandler())
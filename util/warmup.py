@@ -0,0 +1,114 @@
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Optional
+
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+
+class Resource:
+    def __init__(self, name: str, loader: Callable[[], Any], closer: Optional[Callable[[Any], None]] = None):
+        self.name = name
+        self.loader = loader
+        self.closer = closer
+        self.state = "pending"
+        self.value: Any = None
+        self.error: Optional[str] = None
+        self.seconds: Optional[float] = None
+        self.loaded = threading.Event()
+
+    def to_dict(self) -> dict:
+        status = {"state": self.state}
+        if self.seconds is not None:
+            status["seconds"] = round(self.seconds, 3)
+        if self.error:
+            status["error"] = self.error
+        return status
+
+
+class Warmup:
+    """Loads the heavy resources of a server in background threads, so it can bind its port first.
+
+    Tools wait for the resource they need with `aget`; `/livez` answers as soon as
+    the server is up and `/readyz` once every resource is loaded.
+    """
+    def __init__(self, service: str):
+        self.service = service
+        self.resources: dict[str, Resource] = {}
+        self.__started = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def add(self, name: str, loader: Callable[[], Any], closer: Optional[Callable[[Any], None]] = None):
+        self.resources[name] = Resource(name, loader, closer)
+
+    def __load(self, resource: Resource):
+        start_time = time.monotonic()
+        try:
+            resource.value = resource.loader()
+            resource.state = "ready"
+            logging.info(f"{self.service}: {resource.name} loaded in {time.monotonic() - start_time:.2f} seconds")
+        except Exception as e:
+            resource.state = "failed"
+            resource.error = f"{type(e).__name__}: {e}"
+            logging.critical(f"{self.service}: failed to load {resource.name}: {e}")
+        finally:
+            resource.seconds = time.monotonic() - start_time
+            resource.loaded.set()
+
+    def start(self, *names: str):
+        """Start loading the named resources, all of them by default; resources already loading are skipped"""
+        with self.__lock:
+            for name in names or self.resources:
+                resource = self.resources[name]
+                if resource.state == "pending":
+                    resource.state = "loading"
+                    threading.Thread(target=self.__load, args=(resource,), name=f"warmup-{name}", daemon=True).start()
+
+    def get(self, name: str, timeout: Optional[float] = None) -> Any:
+        """The loaded resource, waits for it and starts loading it when nobody did yet"""
+        resource = self.resources[name]
+        self.start(name)
+        if not resource.loaded.wait(timeout):
+            raise TimeoutError(f"{name} is still loading")
+        if resource.state == "failed":
+            raise RuntimeError(f"{name} is not available: {resource.error}")
+        return resource.value
+
+    async def aget(self, name: str) -> Any:
+        resource = self.resources[name]
+        if resource.state == "ready":
+            return resource.value
+        return await asyncio.to_thread(self.get, name)
+
+    @property
+    def ready(self) -> bool:
+        return all(resource.state == "ready" for resource in self.resources.values())
+
+    def status(self) -> dict:
+        return {
+            "service": self.service,
+            "ready": self.ready,
+            "uptime": round(time.monotonic() - self.__started, 3),
+            "resources": {name: resource.to_dict() for name, resource in self.resources.items()},
+        }
+
+    def close(self):
+        for resource in self.resources.values():
+            if resource.state == "ready" and resource.closer:
+                try:
+                    resource.closer(resource.value)
+                except Exception as e:
+                    logging.warning(f"{self.service}: failed to close {resource.name}: {e}")
+
+    def routes(self) -> list[Route]:
+        async def livez(request: Request) -> JSONResponse:
+            return JSONResponse({"service": self.service, "status": "ok"})
+
+        async def readyz(request: Request) -> JSONResponse:
+            status = self.status()
+            return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+        return [Route("/livez", endpoint=livez), Route("/readyz", endpoint=readyz)]